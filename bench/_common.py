@@ -0,0 +1,123 @@
+"""Shared helpers for the bench/ scripts: scratch workspaces, synthetic audio, stub model.
+
+Nothing here touches the network. Benchmarks run against a copy of main.py in a
+temporary directory, so data.db, input/, output/ and cache/ of the checkout are
+never read or written.
+"""
+import importlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+SAMPLERATE = 44100
+SIGNALS = ("sines", "noise", "clicks", "mix")
+
+
+def scratch_workspace(prefix="aura-bench-"):
+    tmp = Path(tempfile.mkdtemp(prefix=prefix))
+    shutil.copy2(ROOT / "main.py", tmp / "main.py")
+    shutil.copytree(ROOT / "static", tmp / "static")
+    return tmp
+
+
+def import_main(workdir):
+    """Import the workspace copy of main.py (env-driven settings must be set before)."""
+    sys.path.insert(0, str(workdir))
+    sys.modules.pop("main", None)
+    return importlib.import_module("main")
+
+
+def install_stub_model(seed=0):
+    """Swap the pretrained htdemucs for a small untrained one (same code path, no download).
+
+    Also keeps static_ffmpeg from fetching its binaries; a system ffmpeg is used
+    when present, otherwise WAV input is decoded with libsndfile.
+    """
+    import static_ffmpeg
+    import demucs.pretrained
+    import torch
+    from demucs.apply import BagOfModels
+    from demucs.htdemucs import HTDemucs
+
+    def get_model(name, repo=None):
+        torch.manual_seed(seed)
+        model = HTDemucs(sources=["drums", "bass", "other", "vocals"], channels=8,
+                         t_layers=1, bottom_channels=0, segment=7.8)
+        return BagOfModels([model])
+
+    static_ffmpeg.add_paths = lambda *a, **k: None
+    demucs.pretrained.get_model = get_model
+
+
+def synth_signal(kind, seconds, samplerate=SAMPLERATE, seed=0):
+    """Deterministic stereo test audio, float32 [frames, 2] in [-1, 1]."""
+    rng = np.random.default_rng(seed)
+    frames = int(seconds * samplerate)
+    t = np.arange(frames) / samplerate
+    parts = []
+    if kind in ("sines", "mix"):
+        base = 55.0 * (1 + seed % 5)
+        parts.append(sum(0.15 * np.sin(2 * np.pi * base * h * t + rng.uniform(0, np.pi)) for h in (1, 1.5, 2, 3)))
+    if kind in ("noise", "mix"):
+        parts.append(0.1 * rng.standard_normal(frames))
+    if kind in ("clicks", "mix"):
+        clicks = np.zeros(frames)
+        period = int(samplerate * 60 / (90 + seed % 60))
+        decay = np.exp(-np.arange(min(2000, frames)) / 200)
+        for start in range(int(rng.integers(0, period)), frames, period):
+            n = min(len(decay), frames - start)
+            clicks[start:start + n] += 0.6 * decay[:n]
+        parts.append(clicks)
+    if not parts:
+        raise ValueError(f"unknown signal kind {kind!r} (expected one of {SIGNALS})")
+    mono = np.clip(sum(parts), -1.0, 1.0)
+    right = np.roll(mono, int(rng.integers(1, 64))) * 0.9
+    return np.stack([mono, right], axis=1).astype(np.float32)
+
+
+def write_wav(path, kind, seconds, seed=0, samplerate=SAMPLERATE):
+    import soundfile as sf
+    sf.write(str(path), synth_signal(kind, seconds, samplerate, seed), samplerate, subtype="FLOAT")
+    return path
+
+
+def percentiles(values, points=(50, 90, 95, 99)):
+    if not values:
+        return {}
+    arr = np.asarray(values, dtype=float)
+    out = {f"p{p}": round(float(np.percentile(arr, p)), 5) for p in points}
+    out.update({"min": round(float(arr.min()), 5), "max": round(float(arr.max()), 5),
+                "mean": round(float(arr.mean()), 5), "n": len(values)})
+    return out
+
+
+def peak_rss_bytes():
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def environment():
+    """Enough context to tell two result files apart."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"commit": commit, "python": platform.python_version(), "platform": platform.platform(),
+            "cpus": os.cpu_count()}
+
+
+def emit(report, out=None):
+    text = json.dumps(report, indent=2)
+    if out:
+        Path(out).write_text(text + "\n")
+    print(text)
@@ -0,0 +1,219 @@
+"""HTTP hot-path benchmark: latency percentiles and req/s of the polling/library endpoints.
+
+A uvicorn server is started on a scratch copy of main.py whose database is
+seeded with completed jobs and projects (synthetic stems, manifests, peaks).
+Each endpoint is then hit by N client threads, each on its own keep-alive
+connection:
+
+  job_status   GET /api/jobs/{id}          (random seeded job)
+  my_jobs      GET /api/my_jobs
+  history      GET /api/history?limit=50
+  download_zip GET /api/download_zip/{id}  (full body read)
+
+--background-jobs K keeps K separations running on the server (stub model,
+synthetic uploads) while the endpoints are measured, like clients polling a
+busy box.
+
+Usage:
+    python bench/bench_api.py [--projects 200] [--jobs 200] [--concurrency 1,8,32]
+                              [--requests 400] [--background-jobs 0] [--out results.json]
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import _common
+
+BENCH_DIR = Path(__file__).resolve().parent
+
+SERVER = """
+import sys
+sys.path.insert(0, {bench!r})
+import _common
+_common.install_stub_model()
+import uvicorn
+uvicorn.run("main:app", host="127.0.0.1", port={port}, log_level="warning")
+"""
+
+
+def seed(main, projects, jobs, stem_seconds):
+    """Completed jobs + projects for the admin user, as the pipeline would leave them."""
+    import soundfile as sf
+    user = main.user_from_row(main.DB.query_one("SELECT * FROM users WHERE username = 'admin'"))
+    # One set of stem files, hard-linked into every project folder
+    template = main.OUTPUT_DIR / main.MODEL_NAME / "_bench_template"
+    template.mkdir(parents=True)
+    analysis = {}
+    for i, name in enumerate(("vocals", "drums", "bass", "other")):
+        kind = _common.SIGNALS[i % len(_common.SIGNALS)]
+        sf.write(str(template / f"{name}.wav"), _common.synth_signal(kind, stem_seconds, seed=i),
+                 _common.SAMPLERATE, subtype="FLOAT")
+        main.build_peaks_file(template / f"{name}.wav")
+        analysis[name] = {"silent": False, "duration": stem_seconds}
+
+    project_ids = []
+    with main.DB.connect() as conn:
+        for i in range(projects):
+            project_id = str(uuid.uuid4())
+            folder = main.OUTPUT_DIR / main.MODEL_NAME / project_id
+            folder.mkdir()
+            for f in template.iterdir():
+                os.link(f, folder / f.name)
+            manifest = main.build_manifest(folder, analysis)
+            main.insert_project(conn, project_id, user["id"], f"Track {i}", project_id, manifest)
+            project_ids.append(project_id)
+
+    job_ids = []
+    for i in range(jobs):
+        job_id = str(uuid.uuid4())
+        project_id = project_ids[i % len(project_ids)] if project_ids else None
+        main.JOB_STORE.create(job_id, user, f"Track {i}.wav", "file", {"title": f"Track {i}.wav"})
+        main.JOB_STORE.update(job_id, status="completed", progress=100,
+                              result={"message": "Success", "stems": main.stem_urls(template, analysis),
+                                      "project": {"id": project_id, "name": f"Track {i}"}},
+                              timings={"separate": 1.0, "total": 1.5})
+        job_ids.append(job_id)
+    return project_ids, job_ids
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workdir, port, env):
+    proc = subprocess.Popen([sys.executable, "-c", SERVER.format(bench=str(BENCH_DIR), port=port)],
+                            cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("server exited during startup")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/")
+            conn.getresponse().read()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError("server did not start")
+
+
+def request_json(port, method, path, body=None, headers=None):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    conn.request(method, path, body=body, headers=headers or {})
+    resp = conn.getresponse()
+    return resp.status, json.loads(resp.read() or b"null")
+
+
+def load(port, headers, paths, concurrency, total):
+    """`total` requests over `concurrency` keep-alive connections; per-request wall times."""
+    latencies, errors, lock = [], [], threading.Lock()
+    per_thread = [total // concurrency + (1 if i < total % concurrency else 0) for i in range(concurrency)]
+
+    def client(count, rng):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        mine = []
+        for _ in range(count):
+            path = rng.choice(paths)
+            started = time.perf_counter()
+            try:
+                conn.request("GET", path, headers=headers)
+                resp = conn.getresponse()
+                resp.read()
+                status = resp.status
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+                status = repr(e)
+            mine.append(time.perf_counter() - started)
+            if status != 200:
+                with lock:
+                    errors.append(status)
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=client, args=(n, random.Random(i))) for i, n in enumerate(per_thread) if n]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+    return {"concurrency": concurrency, "requests": total, "errors": len(errors),
+            "requests_per_second": round(total / wall, 2), "latency": _common.percentiles(latencies)}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--projects", type=int, default=200)
+    parser.add_argument("--jobs", type=int, default=200)
+    parser.add_argument("--stem-seconds", type=float, default=10.0)
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--requests", type=int, default=400, help="requests per endpoint and level")
+    parser.add_argument("--zip-requests", type=int, default=40, help="requests per level for download_zip")
+    parser.add_argument("--background-jobs", type=int, default=0)
+    parser.add_argument("--out", help="also write the JSON report here")
+    args = parser.parse_args()
+
+    workdir = _common.scratch_workspace()
+    proc = None
+    try:
+        main = _common.import_main(workdir)
+        project_ids, job_ids = seed(main, args.projects, args.jobs, args.stem_seconds)
+        main.DB.close_all()
+
+        port = free_port()
+        env = dict(os.environ, AURA_QUEUE_SIZE=str(max(args.background_jobs, 1) + 20))
+        proc = start_server(workdir, port, env)
+        _, login = request_json(port, "POST", "/api/login",
+                                json.dumps({"username": "admin", "password": "admin123"}),
+                                {"Content-Type": "application/json"})
+        headers = {"Authorization": f"Bearer {login['token']}"}
+
+        for i in range(args.background_jobs):
+            wav = workdir / f"bg{i}.wav"
+            _common.write_wav(wav, "mix", 30, seed=1000 + i)
+            request_json(port, "POST", f"/api/upload?filename=bg{i}.wav", wav.read_bytes(), headers)
+
+        endpoints = {
+            "job_status": ([f"/api/jobs/{j}" for j in job_ids], args.requests),
+            "my_jobs": (["/api/my_jobs"], args.requests),
+            "history": (["/api/history?limit=50"], args.requests),
+            "download_zip": ([f"/api/download_zip/{p}" for p in project_ids], args.zip_requests),
+        }
+        results = {}
+        for name, (paths, total) in endpoints.items():
+            if not paths:
+                continue
+            results[name] = [load(port, headers, paths, c, total)
+                             for c in (int(x) for x in args.concurrency.split(","))]
+
+        report = {"benchmark": "api", "environment": _common.environment(),
+                  "config": {"projects": args.projects, "jobs": args.jobs, "stem_seconds": args.stem_seconds,
+                             "background_jobs": args.background_jobs},
+                  "endpoints": results}
+        _common.emit(report, args.out)
+    finally:
+        if proc:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main_cli()
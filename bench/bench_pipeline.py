@@ -0,0 +1,147 @@
+"""Separation pipeline benchmark: job latency, throughput and peak RSS per concurrency level.
+
+Every level runs in its own process (so peak RSS is per level) against a scratch
+copy of main.py with AURA_WORKERS set to the level. Jobs go through the same
+path as /api/process_file_async (JOB_STORE -> scheduler -> run_file_job) on
+synthetic audio (sines / noise / clicks / mix, one distinct signal per job so
+the separation cache never hits). Per-stage times come from the job records
+(jobs.timings). The model is loaded once before the clock starts and reported
+separately.
+
+  --model stub   small untrained htdemucs, offline (default; same code path)
+  --model real   pretrained htdemucs (downloads the weights on first use)
+  --album        submit each level's tracks as one batch job (/api/process_batch
+                 path: children share inference batches) instead of N jobs
+
+Usage:
+    python bench/bench_pipeline.py [--levels 1,2,4,8] [--jobs 0] [--seconds 10,30]
+                                   [--model stub] [--encode] [--album] [--out results.json]
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import _common
+
+
+def run_level(level, jobs, seconds, model, encode, album=False):
+    os.environ["AURA_WORKERS"] = str(level)
+    os.environ["AURA_QUEUE_SIZE"] = str(jobs + level)
+    workdir = _common.scratch_workspace()
+    try:
+        if model == "stub":
+            _common.install_stub_model()
+        main = _common.import_main(workdir)
+        if not encode:
+            main.STEM_ENCODER.submit = lambda folder: None  # Encodes run after completion anyway
+
+        load_started = time.perf_counter()
+        main.ENGINE.load()
+        model_load = time.perf_counter() - load_started
+
+        user = main.user_from_row(main.DB.query_one("SELECT * FROM users WHERE username = 'admin'"))
+        inputs = []
+        for i in range(jobs):
+            kind = _common.SIGNALS[i % len(_common.SIGNALS)]
+            length = seconds[i % len(seconds)]
+            path = main.INPUT_DIR / f"{uuid.uuid4()}.wav"
+            _common.write_wav(path, kind, length, seed=i)
+            inputs.append((path, f"{kind}-{length:g}s-{i}.wav", length))
+
+        started = time.perf_counter()
+        job_ids = []
+        if album:
+            parent = str(uuid.uuid4())
+            children = [{"job_id": str(uuid.uuid4()), "kind": "file", "title": name, "input_path": str(path)}
+                        for path, name, _ in inputs]
+            main.JOB_STORE.create(parent, user, "album", "batch", {"title": "album", "children": children})
+            for child in children:
+                main.JOB_STORE.create(child["job_id"], user, child["title"], "file",
+                                      {"input_path": child["input_path"], "title": child["title"], "parent": parent})
+                job_ids.append(child["job_id"])
+            main.enqueue_job(parent, main.run_batch_job, parent, user, user=user, **main.batch_shape(user, len(children)))
+        else:
+            for path, name, _ in inputs:
+                job_id = str(uuid.uuid4())
+                main.JOB_STORE.create(job_id, user, name, "file", {"input_path": str(path), "title": name})
+                main.enqueue_job(job_id, main.run_file_job, job_id, path, name, user, user=user)
+                job_ids.append(job_id)
+
+        pending = set(job_ids)
+        while pending:
+            time.sleep(0.05)
+            for job_id in list(pending):
+                if main.JOB_STORE.get(job_id)["status"] in main.JOB_DONE_STATES:
+                    pending.discard(job_id)
+        wall = time.perf_counter() - started
+
+        records = [main.JOB_STORE.get(j) for j in job_ids]
+        batch = main.JOB_STORE.get(parent)["result"] if album else None
+        done = [r for r in records if r["status"] == "completed"]
+        stages = {}
+        for r in done:
+            for name, secs in r["timings"].items():
+                stages.setdefault(name, []).append(secs)
+        audio_seconds = sum(length for _, _, length in inputs)
+        return {
+            "level": level,
+            "jobs": jobs,
+            "completed": len(done),
+            "failed": [r["error"] for r in records if r["status"] != "completed"],
+            "model_load_seconds": round(model_load, 4),
+            "wall_seconds": round(wall, 4),
+            "jobs_per_minute": round(len(done) * 60 / wall, 3),
+            "audio_seconds_per_second": round(audio_seconds / wall, 3),
+            "latency": _common.percentiles([r["timings"]["total"] for r in done]),
+            "stages": {name: _common.percentiles(values) for name, values in sorted(stages.items())},
+            "peak_rss_bytes": _common.peak_rss_bytes(),
+            **({"inference_batches": batch["engine"]} if batch else {}),
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--levels", default="1,2,4,8", help="comma-separated concurrent job counts")
+    parser.add_argument("--jobs", type=int, default=0, help="jobs per level (default: 2 x level)")
+    parser.add_argument("--seconds", default="10,30", help="comma-separated track lengths, cycled")
+    parser.add_argument("--model", default="stub", choices=("stub", "real"))
+    parser.add_argument("--encode", action="store_true", help="also run the FLAC/Opus delivery encodes")
+    parser.add_argument("--album", action="store_true", help="one batch job per level instead of one job per track")
+    parser.add_argument("--out", help="also write the JSON report here")
+    parser.add_argument("--level", type=int, help=argparse.SUPPRESS)  # Child process mode
+    args = parser.parse_args()
+    seconds = [float(s) for s in args.seconds.split(",")]
+
+    if args.level:
+        jobs = args.jobs or 2 * args.level
+        print(json.dumps(run_level(args.level, jobs, seconds, args.model, args.encode, args.album)))
+        return
+
+    report = {"benchmark": "pipeline", "environment": _common.environment(),
+              "config": {"model": args.model, "seconds": seconds, "encode": args.encode, "album": args.album},
+              "levels": []}
+    for level in [int(x) for x in args.levels.split(",")]:
+        cmd = [sys.executable, str(Path(__file__).resolve()), "--level", str(level),
+               "--jobs", str(args.jobs), "--seconds", args.seconds, "--model", args.model]
+        if args.encode:
+            cmd.append("--encode")
+        if args.album:
+            cmd.append("--album")
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        if proc.returncode != 0:
+            report["levels"].append({"level": level, "error": proc.stderr.strip().splitlines()[-1:]})
+            continue
+        report["levels"].append(json.loads(proc.stdout.strip().splitlines()[-1]))
+    _common.emit(report, args.out)
+
+
+if __name__ == "__main__":
+    main_cli()
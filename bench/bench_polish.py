@@ -0,0 +1,115 @@
+"""Stem polish benchmark: in-memory torch path vs the legacy ffmpeg-per-stem path.
+
+Both paths start from the same four separated stems held in memory and end with
+polished float32 WAVs on disk:
+
+  legacy    write each stem, run `ffmpeg -af highpass=f=50 -ar 44100` on it,
+            replace the original with the .polished.wav (one process + two
+            extra file rewrites per stem)
+  in-memory polish_stems() on the tensors, then a single write per stem
+
+The legacy chain also asked for `norm=0`, which is not an ffmpeg filter (ffmpeg
+exits with "No such filter"), so it is left out here to time the work the old
+path was meant to do.
+
+Usage:
+    python bench/bench_polish.py [--seconds 180] [--repeat 3]
+"""
+import argparse
+import json
+import shutil
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+import _common
+
+main = None  # Scratch copy of main.py, imported in main_cli()
+STEMS = ("vocals", "drums", "bass", "other")
+
+
+def synthetic_stems(seconds, samplerate):
+    import torch
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * samplerate)) / samplerate
+    stems = {}
+    for i, name in enumerate(STEMS):
+        tone = 0.4 * np.sin(2 * np.pi * (55 * (i + 1)) * t)
+        noise = 0.05 * rng.standard_normal(t.shape)
+        rumble = 0.1 * np.sin(2 * np.pi * 20 * t)
+        mono = (tone + noise + rumble).astype(np.float32)
+        stems[name] = torch.from_numpy(np.stack([mono, mono * 0.9]))
+    return stems
+
+
+def run_legacy(stems, samplerate, folder, ffmpeg):
+    main.write_stems(stems, folder, samplerate)
+    for f in folder.glob("*.wav"):
+        polished = f.with_suffix(".polished.wav")
+        chain = "highpass=f=50" if f.stem not in main.NO_HIGHPASS_STEMS else "anull"
+        subprocess.run([ffmpeg, "-y", "-i", str(f), "-af", chain, "-ar", "44100", str(polished)],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        f.unlink()
+        polished.rename(f)
+
+
+def run_in_memory(stems, samplerate, folder):
+    polished, sr = main.polish_stems(stems, samplerate)
+    main.write_stems(polished, folder, sr)
+
+
+def timed(fn, repeat):
+    runs = []
+    for _ in range(repeat):
+        tmp = Path(tempfile.mkdtemp(prefix="aura-polish-"))
+        try:
+            started = time.perf_counter()
+            fn(tmp)
+            runs.append(time.perf_counter() - started)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+    return {"runs": [round(r, 4) for r in runs], "best": round(min(runs), 4)}
+
+
+def main_cli():
+    global main
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=180.0)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    workdir = _common.scratch_workspace()
+    try:
+        main = _common.import_main(workdir)
+        run(args)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run(args):
+    samplerate = main.POLISH_SAMPLERATE
+    stems = synthetic_stems(args.seconds, samplerate)
+    report = {"seconds": args.seconds, "stems": len(stems)}
+
+    report["in_memory"] = timed(lambda d: run_in_memory(stems, samplerate, d), args.repeat)
+
+    try:
+        import static_ffmpeg
+        static_ffmpeg.add_paths()
+    except Exception:
+        pass
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg:
+        report["legacy_ffmpeg"] = timed(lambda d: run_legacy(stems, samplerate, d, ffmpeg), args.repeat)
+        report["speedup"] = round(report["legacy_ffmpeg"]["best"] / report["in_memory"]["best"], 2)
+    else:
+        report["legacy_ffmpeg"] = "skipped (ffmpeg not found)"
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,130 @@
+"""Cold-start benchmark: `import main` time and time-to-first-response.
+
+Each run copies main.py and static/ into a scratch directory (so data.db,
+input/ and output/ are private to the run) and measures, in fresh processes:
+
+  import        wall time of `import main`, plus which heavy modules it pulled in
+  first_boot    uvicorn spawn -> first 200 from GET / on an empty directory
+                (schema migrations run)
+  reboot        the same against the database left by first_boot (migrations
+                skipped via PRAGMA user_version)
+  first_login   latency of the first POST /api/login after the server is up
+
+Usage:
+    python bench/bench_startup.py [--repeat 5] [--warmup off|model|full]
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import _common
+
+HEAVY = ("torch", "demucs", "yt_dlp", "requests", "firebase_admin", "dns", "numpy", "soundfile")
+
+IMPORT_PROBE = """
+import json, os, sys, time
+sys.path.insert(0, os.getcwd())  # The scratch copy, never the checkout
+started = time.perf_counter()
+import main
+elapsed = time.perf_counter() - started
+print(json.dumps({"seconds": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY,)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def time_import(workdir):
+    out = subprocess.run([sys.executable, "-c", IMPORT_PROBE], cwd=workdir,
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def time_first_response(workdir, env, timeout=60.0):
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+                             "--port", str(port), "--log-level", "warning"],
+                            cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            if proc.poll() is not None:
+                raise RuntimeError("server exited before answering")
+            if time.perf_counter() - started > timeout:
+                raise RuntimeError("server did not answer in time")
+            try:
+                with urllib.request.urlopen(base + "/", timeout=1) as r:
+                    r.read()
+                break
+            except OSError:
+                time.sleep(0.01)
+        first_response = time.perf_counter() - started
+
+        body = json.dumps({"username": "admin", "password": "admin123"}).encode()
+        req = urllib.request.Request(base + "/api/login", data=body, headers={"Content-Type": "application/json"})
+        login_started = time.perf_counter()
+        with urllib.request.urlopen(req, timeout=10) as r:
+            r.read()
+        return first_response, time.perf_counter() - login_started
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def summary(values):
+    values = sorted(values)
+    return {"runs": [round(v, 4) for v in values], "best": round(values[0], 4),
+            "median": round(values[len(values) // 2], 4)}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--warmup", default="off", choices=("off", "model", "full"))
+    args = parser.parse_args()
+
+    env = dict(os.environ, AURA_WARMUP=args.warmup)
+    imports, loaded, first_boot, reboot, login = [], set(), [], [], []
+    for _ in range(args.repeat):
+        workdir = _common.scratch_workspace(prefix="aura-startup-")
+        try:
+            probe = time_import(workdir)  # Also creates + migrates data.db
+            imports.append(probe["seconds"])
+            loaded.update(probe["loaded"])
+            (workdir / "data.db").unlink()
+            for suffix in ("-wal", "-shm"):
+                (workdir / f"data.db{suffix}").unlink(missing_ok=True)
+            ttfr, first_login = time_first_response(workdir, env)
+            first_boot.append(ttfr)
+            login.append(first_login)
+            reboot.append(time_first_response(workdir, env)[0])
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "python": sys.version.split()[0],
+        "warmup": args.warmup,
+        "import": summary(imports),
+        "heavy_modules_at_import": sorted(loaded),
+        "first_boot": summary(first_boot),
+        "reboot": summary(reboot),
+        "first_login": summary(login),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,83 @@
+"""Compare two bench JSON reports (same benchmark, e.g. two commits) and flag regressions.
+
+Matches levels/endpoints by their `level` / `concurrency`, then compares the
+headline numbers: latency percentiles, stage means, wall time and peak RSS
+(lower is better) and throughput (higher is better). Exits 1 when any of them
+got worse by more than --threshold.
+
+Usage:
+    python bench/compare.py before.json after.json [--threshold 0.10]
+"""
+import argparse
+import json
+import sys
+
+LOWER_IS_BETTER = ("p50", "p95", "p99", "mean", "wall_seconds", "peak_rss_bytes", "model_load_seconds",
+                   "import", "first_boot", "reboot", "first_login", "best", "median")
+HIGHER_IS_BETTER = ("jobs_per_minute", "audio_seconds_per_second", "requests_per_second", "speedup")
+MATCH_KEYS = ("level", "concurrency")
+
+
+def _key(item):
+    for k in MATCH_KEYS:
+        if isinstance(item, dict) and k in item:
+            return f"{k}={item[k]}"
+    return None
+
+
+def walk(before, after, path=()):
+    """Yield (path, before, after) for every numeric leaf present in both reports."""
+    if isinstance(before, dict) and isinstance(after, dict):
+        for k in before:
+            if k in after and k not in ("environment", "config"):
+                yield from walk(before[k], after[k], path + (k,))
+    elif isinstance(before, list) and isinstance(after, list):
+        if before and all(_key(x) for x in before):
+            by_key = {_key(x): x for x in after}
+            for item in before:
+                if _key(item) in by_key:
+                    yield from walk(item, by_key[_key(item)], path + (_key(item),))
+    elif isinstance(before, (int, float)) and isinstance(after, (int, float)) and not isinstance(before, bool):
+        yield path, before, after
+
+
+def direction(path):
+    name = path[-1]
+    if name in HIGHER_IS_BETTER:
+        return 1
+    if name in LOWER_IS_BETTER or "latency" in path or "stages" in path:
+        return -1 if name not in ("n", "min", "max") else 0
+    return 0
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative change counted as a regression")
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    if before.get("benchmark") != after.get("benchmark"):
+        sys.exit(f"different benchmarks: {before.get('benchmark')} vs {after.get('benchmark')}")
+
+    print(f"before: {before.get('environment', {}).get('commit')}  after: {after.get('environment', {}).get('commit')}")
+    regressions = 0
+    for path, old, new in walk(before, after):
+        sign = direction(path)
+        if not sign or not old:
+            continue
+        change = (new - old) / abs(old)
+        worse = change * sign < -args.threshold
+        regressions += worse
+        flag = "REGRESSION" if worse else ("improved" if change * sign > args.threshold else "")
+        print(f"{'/'.join(path):60} {old:>12.5g} -> {new:>12.5g}  {change:+7.1%}  {flag}")
+    print(f"{regressions} regression(s) beyond {args.threshold:.0%}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main_cli()
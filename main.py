@@ -1,15 +1,22 @@
+import asyncio
+import base64
+import collections
+import contextlib
 import os
 import shutil
+import re
 import sqlite3
+import struct
 import subprocess
 import uuid
 import datetime
+import hashlib
+import json
 import math
-import wave
+import time
+import threading
 from pathlib import Path
 from typing import Optional, List
-import firebase_admin
-from firebase_admin import credentials, firestore
 import logging
 
 # --- CONSTANTS (Early Init) ---
@@ -23,25 +30,262 @@ class DatabaseInterface:
     def create_session(self, token, user_id): pass
     def get_session(self, token): pass
     # Add other methods as needed...
+
+DB_POOL_SIZE = int(os.getenv("AURA_DB_POOL", "16"))
+DB_BUSY_TIMEOUT_MS = 5000
+DB_MMAP_BYTES = 256 * 1024 * 1024
+DB_STATEMENT_CACHE = 256  # Per connection; pooled connections keep it warm
+
+def user_from_row(row):
+    return {
+        "id": row[0], "username": row[1], "password": row[2],
+        "is_admin": bool(row[3]), "credits": row[4], "plan": row[5],
+        "email": row[7] if len(row) > 7 else ""
+    }
+
+class SQLiteDatabase(DatabaseInterface):
+    """Pooled SQLite access shared by handlers, job workers and helpers.
+
+    Connections are long-lived (so sqlite3's prepared-statement cache is
+    actually reused), opened with the same pragmas, and bounded by
+    `pool_size`; callers beyond that wait for a free one. A thread that
+    nests `connect()` blocks shares the connection it already holds, and
+    the outermost block commits (or rolls back on error).
+    """
+
+    PRAGMAS = (
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}",
+        f"PRAGMA mmap_size={DB_MMAP_BYTES}",
+        "PRAGMA temp_store=MEMORY",
+    )
+
+    def __init__(self, path: Path, pool_size: int = DB_POOL_SIZE):
+        self.path = path
+        self.pool_size = max(1, pool_size)
+        self._idle = []  # LIFO: the most recently used connection has the hottest caches
+        self._slots = threading.BoundedSemaphore(self.pool_size)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.opened = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.statements = 0
+        self.requests = 0
+
+    def _count_statement(self, _sql):
+        self.statements += 1  # Approximate under contention; only used for stats
+
+    def _open(self):
+        conn = sqlite3.connect(str(self.path), check_same_thread=False,
+                               timeout=DB_BUSY_TIMEOUT_MS / 1000, cached_statements=DB_STATEMENT_CACHE)
+        conn.row_factory = sqlite3.Row
+        for pragma in self.PRAGMAS:
+            conn.execute(pragma)
+        conn.set_trace_callback(self._count_statement)
+        with self._lock:
+            self.opened += 1
+        return conn
+
+    @contextlib.contextmanager
+    def connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            yield conn
+            return
+        if not self._slots.acquire(blocking=False):
+            started = time.time()
+            self._slots.acquire()
+            with self._lock:
+                self.waits += 1
+                self.wait_seconds += time.time() - started
+        try:
+            with self._lock:
+                self.checkouts += 1
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                conn = self._open()
+        except BaseException:
+            self._slots.release()
+            raise
+        self._local.conn = conn
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._local.conn = None
+            with self._lock:
+                self._idle.append(conn)
+            self._slots.release()
+
+    def query(self, sql: str, params=()):
+        with self.connect() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def query_one(self, sql: str, params=()):
+        with self.connect() as conn:
+            return conn.execute(sql, params).fetchone()
+
+    def execute(self, sql: str, params=()):
+        """Run one write statement and commit. Returns the affected row count."""
+        with self.connect() as conn:
+            return conn.execute(sql, params).rowcount
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    # DatabaseInterface
+    def get_user(self, user_id):
+        row = self.query_one("SELECT * FROM users WHERE id = ?", (user_id,))
+        return user_from_row(row) if row else None
+
+    def get_user_by_email(self, email):
+        row = self.query_one("SELECT * FROM users WHERE email = ?", (email,))
+        return user_from_row(row) if row else None
+
+    def create_user(self, user_id, username, password, email, credits=3):
+        self.execute("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                     (user_id, username, password, 0, credits, 'free', str(datetime.datetime.now()), email))
+
+    def create_session(self, token, user_id):
+        self.execute("INSERT INTO sessions VALUES (?, ?, ?)", (token, user_id, str(datetime.datetime.now())))
+
+    def get_session(self, token):
+        row = self.query_one("SELECT user_id FROM sessions WHERE token = ?", (token,))
+        return row[0] if row else None
+
+    def delete_session(self, token):
+        self.execute("DELETE FROM sessions WHERE token = ?", (token,))
+
+    def stats(self):
+        with self._lock:
+            idle = len(self._idle)
+            requests = self.requests
+            return {
+                "pool_size": self.pool_size,
+                "connections_opened": self.opened,
+                "connections_idle": idle,
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "avg_wait_ms": round(1000 * self.wait_seconds / self.waits, 2) if self.waits else 0.0,
+                "statements": self.statements,
+                "http_requests": requests,
+                "checkouts_per_request": round(self.checkouts / requests, 2) if requests else None,
+                "statements_per_request": round(self.statements / requests, 2) if requests else None,
+            }
     
+# --- AUTH CACHE ---
+# get_current_user runs on every API call (and every poll); with Firebase on, the
+# user lookup is a Firestore round trip. Both lookups are cached per process and
+# invalidated explicitly wherever this process changes a user or session; the TTL
+# bounds staleness for changes made by other workers.
+SESSION_CACHE_TTL = int(os.getenv("AURA_SESSION_CACHE_TTL", "300"))
+USER_CACHE_TTL = int(os.getenv("AURA_USER_CACHE_TTL", "30"))
+AUTH_CACHE_SIZE = int(os.getenv("AURA_AUTH_CACHE_SIZE", "10000"))
+
+class TTLCache:
+    """Thread-safe LRU map whose entries also expire `ttl` seconds after being set."""
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data = collections.OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            if self._data.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def invalidate_value(self, value):
+        """Drop every key mapping to `value` (e.g. all sessions of a deleted user)."""
+        with self._lock:
+            stale = [k for k, (_, v) in self._data.items() if v == value]
+            for k in stale:
+                del self._data[k]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "invalidations": self.invalidations,
+            }
+
+SESSION_CACHE = TTLCache(SESSION_CACHE_TTL, AUTH_CACHE_SIZE)  # token -> user_id
+USER_CACHE = TTLCache(USER_CACHE_TTL, AUTH_CACHE_SIZE)  # user_id -> user record
+
 # --- CONFIG ---
 SERVICE_KEY = BASE_DIR / "serviceAccountKey.json"
 HAS_FIREBASE = SERVICE_KEY.exists()
-
-db_client = None
-
 if HAS_FIREBASE:
     print("BOOT: Found serviceAccountKey.json. Using FIRESTORE.")
-    try:
-        cred = credentials.Certificate(str(SERVICE_KEY))
-        firebase_admin.initialize_app(cred)
-        db_client = firestore.client()
-    except Exception as e:
-        print(f"BOOT ERROR: Failed to init Firestore: {e}")
-        HAS_FIREBASE = False
+
+# firebase_admin (grpc, google-cloud) is imported and initialised on first use,
+# not at boot: most requests never touch Firestore.
+_db_client = None
+_firebase_lock = threading.Lock()
+
+def firestore_client():
+    """The Firestore client, or None when Firebase is not configured / failed to init."""
+    global _db_client, HAS_FIREBASE
+    if _db_client is not None or not HAS_FIREBASE:
+        return _db_client
+    with _firebase_lock:
+        if _db_client is None and HAS_FIREBASE:
+            install_network_patches()
+            try:
+                import firebase_admin
+                from firebase_admin import credentials, firestore
+                firebase_admin.initialize_app(credentials.Certificate(str(SERVICE_KEY)))
+                _db_client = firestore.client()
+            except Exception as e:
+                print(f"FIREBASE ERROR: Failed to init Firestore: {e}")
+                HAS_FIREBASE = False
+    return _db_client
 
 # ... Only defined if HAS_FIREBASE is True
 def firestore_get_user(user_id):
+    db_client = firestore_client()
     if not db_client: return None
     try:
         doc = db_client.collection('users').document(user_id).get()
@@ -59,57 +303,45 @@ def get_user_compat(user_id):
         # Fallback to SQLite
     
     # SQLite Legacy
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-    row = c.fetchone()
-    conn.close()
-    if row:
-         return {
-            "id": row[0], "username": row[1], "password": row[2],
-            "is_admin": bool(row[3]), "credits": row[4], "plan": row[5],
-            "email": row[7] if len(row)>7 else ""
-        }
-    return None
+    return DB.get_user(user_id)
 
 def deduct_credit(user_id):
+    # Invalidate after the write: a reader in between would re-cache the old record for the full TTL
     if HAS_FIREBASE:
         try:
-            ref = db_client.collection('users').document(user_id)
+            from firebase_admin import firestore
+            ref = firestore_client().collection('users').document(user_id)
             ref.update({"credits": firestore.Increment(-1)})
+            USER_CACHE.invalidate(user_id)
             return
         except: pass # Fallback to SQLite just in case?
 
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute("UPDATE users SET credits = credits - 1 WHERE id = ?", (user_id,))
-    conn.commit()
-    conn.close()
+    DB.execute("UPDATE users SET credits = credits - 1 WHERE id = ?", (user_id,))
+    USER_CACHE.invalidate(user_id)
 
 def set_subscription(user_id, plan, credits):
     if HAS_FIREBASE:
         try:
-            ref = db_client.collection('users').document(user_id)
+            ref = firestore_client().collection('users').document(user_id)
             ref.update({"plan": plan, "credits": credits})
+            USER_CACHE.invalidate(user_id)
             return
         except: pass
 
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute("UPDATE users SET credits = ?, plan = ? WHERE id = ?", (credits, plan, user_id))
-    conn.commit()
-    conn.close()
+    DB.execute("UPDATE users SET credits = ?, plan = ? WHERE id = ?", (credits, plan, user_id))
+    USER_CACHE.invalidate(user_id)
 
 
 
 
 # --- YOUTUBE DOWNLOADER ---
 
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Depends, Header, BackgroundTasks
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Depends, Header, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 import shutil
-import yt_dlp
 import sys
 
 # --- Constants & Config ---
@@ -117,12 +349,26 @@ import sys
 INPUT_DIR = BASE_DIR / "input"
 OUTPUT_DIR = BASE_DIR / "output"
 DB_PATH = BASE_DIR / "data.db"
+DB = SQLiteDatabase(DB_PATH)
 
 INPUT_DIR.mkdir(exist_ok=True)
 OUTPUT_DIR.mkdir(exist_ok=True)
 
 app = FastAPI()
 
+class RequestCounter:
+    """Counts HTTP requests so DB checkouts/statements can be reported per request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            DB.requests += 1
+        await self.app(scope, receive, send)
+
+app.add_middleware(RequestCounter)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -132,14 +378,11 @@ app.add_middleware(
 )
 
 # --- Database Setup ---
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    # OPTIMIZATION for "Thousands of Users": Write-Ahead Logging
-    conn.execute("PRAGMA journal_mode=WAL;") 
-    conn.execute("PRAGMA synchronous=NORMAL;")
-    
-    c = conn.cursor()
-    
+# Bump whenever the DDL / migrations below change. A database already at this
+# version skips them entirely, so a boot costs one PRAGMA read.
+SCHEMA_VERSION = 3
+
+def migrate_db(c):
     # Users Table (Updated with Email)
     c.execute('''CREATE TABLE IF NOT EXISTS users (
         id TEXT PRIMARY KEY,
@@ -151,20 +394,20 @@ def init_db():
         created_at TEXT,
         email TEXT
     )''')
-    
+
     # Migration: Add email column if it doesn't exist (for existing DBs)
     try:
         c.execute("ALTER TABLE users ADD COLUMN email TEXT")
     except:
         pass # Column likely exists
-    
+
     # Sessions Table
     c.execute('''CREATE TABLE IF NOT EXISTS sessions (
         token TEXT PRIMARY KEY,
         user_id TEXT,
         created_at TEXT
     )''')
-    
+
     # Projects Table (Link files to users)
     c.execute('''CREATE TABLE IF NOT EXISTS projects (
         id TEXT PRIMARY KEY,
@@ -174,15 +417,87 @@ def init_db():
         created_at TEXT
     )''')
 
-    # Create default admin if not exists
-    c.execute("SELECT * FROM users WHERE username = 'admin'")
-    if not c.fetchone():
-        admin_id = str(uuid.uuid4())
-        c.execute("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                  (admin_id, 'admin', 'admin123', 1, 9999, 'unlimited', str(datetime.datetime.now()), 'admin@aura.com'))
-    
-    conn.commit()
-    conn.close()
+    # Jobs Table (durable job state, shared by all workers)
+    c.execute('''CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        owner TEXT,
+        user_id TEXT,
+        name TEXT,
+        status TEXT,
+        progress REAL DEFAULT 0,
+        result TEXT,
+        error TEXT,
+        kind TEXT,
+        payload TEXT,
+        instance TEXT,
+        start_time REAL,
+        updated_at REAL
+    )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_owner ON jobs(owner, start_time)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status)")
+
+    # Migration: Per-stage timings of each job (JSON: stage -> seconds)
+    try:
+        c.execute("ALTER TABLE jobs ADD COLUMN timings TEXT")
+    except:
+        pass # Column likely exists
+
+    # Migration: Per-project manifest (JSON: stems, formats, sizes, thumbnail, analysis)
+    try:
+        c.execute("ALTER TABLE projects ADD COLUMN manifest TEXT")
+    except:
+        pass # Column likely exists
+
+    c.execute("CREATE INDEX IF NOT EXISTS idx_projects_user ON projects(user_id, created_at, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_projects_folder ON projects(folder_path)")
+
+    # Migration: Storage accounting (bytes on disk, LRU by last_access) for quotas
+    for column in ("bytes INTEGER", "last_access REAL"):
+        try:
+            c.execute(f"ALTER TABLE projects ADD COLUMN {column}")
+        except:
+            pass # Column likely exists
+    c.execute("CREATE INDEX IF NOT EXISTS idx_projects_access ON projects(last_access)")
+
+    # Separation Cache Index (content hash -> cached stems, LRU by last_used)
+    c.execute('''CREATE TABLE IF NOT EXISTS separation_cache (
+        key TEXT PRIMARY KEY,
+        size INTEGER,
+        hits INTEGER DEFAULT 0,
+        created_at REAL,
+        last_used REAL,
+        meta TEXT
+    )''')
+    try:
+        c.execute("ALTER TABLE separation_cache ADD COLUMN meta TEXT")
+    except:
+        pass # Column likely exists
+
+    # YouTube metadata per video id (title/thumbnail + the separation cache key of its audio)
+    c.execute('''CREATE TABLE IF NOT EXISTS youtube_media (
+        video_id TEXT PRIMARY KEY,
+        title TEXT,
+        thumbnail_url TEXT,
+        duration REAL,
+        cache_key TEXT,
+        updated_at REAL
+    )''')
+
+def init_db():
+    # OPTIMIZATION for "Thousands of Users": WAL & friends come from the pool (SQLiteDatabase.PRAGMAS)
+    with DB.connect() as conn:
+        c = conn.cursor()
+        if c.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            print(f"DB: Migrating schema to v{SCHEMA_VERSION}")
+            migrate_db(c)
+            c.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+        # Create default admin if not exists
+        c.execute("SELECT * FROM users WHERE username = 'admin'")
+        if not c.fetchone():
+            admin_id = str(uuid.uuid4())
+            c.execute("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                      (admin_id, 'admin', 'admin123', 1, 9999, 'unlimited', str(datetime.datetime.now()), 'admin@aura.com'))
 
 init_db()
 
@@ -206,14 +521,6 @@ class UserResponse(BaseModel):
     email: Optional[str]
 
 # --- Dependencies ---
-def get_db():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    try:
-        yield conn
-    finally:
-        conn.close()
-
 def get_current_user(authorization: Optional[str] = Header(None)):
     if not authorization:
         raise HTTPException(status_code=401, detail="Missing Token")
@@ -225,59 +532,45 @@ def get_current_user(authorization: Optional[str] = Header(None)):
     # But for now let's keep sessions in sqlite to avoid 1000s of reads on Firestore per request.
     # We only fetch USER DATA from Firestore.
     
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT user_id FROM sessions WHERE token = ?", (token,))
-    row = c.fetchone()
-    conn.close()
-    
-    if not row:
-        raise HTTPException(status_code=401, detail="Invalid Token")
-    
-    user_id = row[0]
+    user_id = SESSION_CACHE.get(token)
+    if user_id is None:
+        user_id = DB.get_session(token)
+        if not user_id:
+            raise HTTPException(status_code=401, detail="Invalid Token")
+        SESSION_CACHE.set(token, user_id)
     
-    # 2. Get User Data (Compat)
-    user = get_user_compat(user_id)
-    if not user:
-         raise HTTPException(status_code=401, detail="User Not Found")
+    # 2. Get User Data (Compat), cached; handlers get their own copy to mutate
+    user = USER_CACHE.get(user_id)
+    if user is None:
+        user = get_user_compat(user_id)
+        if not user:
+             raise HTTPException(status_code=401, detail="User Not Found")
+        USER_CACHE.set(user_id, user)
          
-    return user
+    return dict(user)
 
 # --- Auth Routes ---
 @app.post("/api/signup")
 def signup(auth: UserAuth):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
     try:
         user_id = str(uuid.uuid4())
         email = auth.email if auth.email else ""
         # Give 3 free credits
-        c.execute("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                  (user_id, auth.username, auth.password, 0, 3, 'free', str(datetime.datetime.now()), email))
-        conn.commit()
+        DB.create_user(user_id, auth.username, auth.password, email, credits=3)
         return {"message": "User created", "username": auth.username}
     except sqlite3.IntegrityError:
         raise HTTPException(status_code=400, detail="Username already exists")
-    finally:
-        conn.close()
 
 @app.post("/api/login")
 def login(auth: UserAuth):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT * FROM users WHERE username = ? AND password = ?", (auth.username, auth.password))
-    row = c.fetchone()
+    row = DB.query_one("SELECT * FROM users WHERE username = ? AND password = ?", (auth.username, auth.password))
     
     if not row:
-        conn.close()
         raise HTTPException(status_code=400, detail="Invalid credentials")
     
     user_id = row[0]
     token = str(uuid.uuid4())
-    c.execute("INSERT INTO sessions VALUES (?, ?, ?)", (token, user_id, str(datetime.datetime.now())))
-    conn.commit()
-    conn.close()
+    DB.create_session(token, user_id)
     
     return {
         "token": token,
@@ -305,7 +598,7 @@ def firebase_sync(auth: FireAuth):
     if HAS_FIREBASE:
         # FIRESTORE LOGIC with Fallback
         try:
-            doc_ref = db_client.collection('users').document(user_id)
+            doc_ref = firestore_client().collection('users').document(user_id)
             doc = doc_ref.get()
             
             if not doc.exists:
@@ -324,11 +617,8 @@ def firebase_sync(auth: FireAuth):
                 pass
                 
             # Create Session (Local)
-            conn = sqlite3.connect(DB_PATH)
             token = str(uuid.uuid4())
-            conn.execute("INSERT INTO sessions VALUES (?, ?, ?)", (token, user_id, str(datetime.datetime.now())))
-            conn.commit()
-            conn.close()
+            DB.create_session(token, user_id)
             
             u = doc_ref.get().to_dict()
             return {"token": token, "user": u}
@@ -339,36 +629,32 @@ def firebase_sync(auth: FireAuth):
             pass
 
     # SQLITE LEGACY LOGIC (Fallback)
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT * FROM users WHERE email = ?", (auth.email,))
-    row = c.fetchone()
-    
-    if not row:
-        # Check by Username to prevent IntegrityError (Duplicate Username)
-        c.execute("SELECT * FROM users WHERE username = ?", (final_user,))
-        existing_chk = c.fetchone()
+    with DB.connect() as conn:
+        c = conn.cursor()
+        c.execute("SELECT * FROM users WHERE email = ?", (auth.email,))
+        row = c.fetchone()
         
-        if existing_chk:
-             # Link existing user to this Firebase Email
-             user_id = existing_chk[0]
-             c.execute("UPDATE users SET email = ? WHERE id = ?", (auth.email, user_id))
-             conn.commit()
+        if not row:
+            # Check by Username to prevent IntegrityError (Duplicate Username)
+            c.execute("SELECT * FROM users WHERE username = ?", (final_user,))
+            existing_chk = c.fetchone()
+            
+            if existing_chk:
+                 # Link existing user to this Firebase Email
+                 user_id = existing_chk[0]
+                 c.execute("UPDATE users SET email = ? WHERE id = ?", (auth.email, user_id))
+                 USER_CACHE.invalidate(user_id)
+            else:
+                # Create Shadow User
+                DB.create_user(user_id, final_user, "firebase_managed", auth.email, credits=3)
         else:
-            # Create Shadow User
-            c.execute("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                      (user_id, final_user, "firebase_managed", 0, 3, 'free', str(datetime.datetime.now()), auth.email))
-            conn.commit()
-    else:
-        user_id = row[0]
-    
-    token = str(uuid.uuid4())
-    c.execute("INSERT INTO sessions VALUES (?, ?, ?)", (token, user_id, str(datetime.datetime.now())))
-    conn.commit()
-    
-    c.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-    row = c.fetchone()
-    conn.close()
+            user_id = row[0]
+        
+        token = str(uuid.uuid4())
+        DB.create_session(token, user_id)
+        
+        c.execute("SELECT * FROM users WHERE id = ?", (user_id,))
+        row = c.fetchone()
     
     return {
         "token": token,
@@ -390,749 +676,3545 @@ def get_me(user: dict = Depends(get_current_user)):
 
 @app.put("/api/me")
 def update_me(update: UserUpdate, user: dict = Depends(get_current_user)):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+    with DB.connect() as conn:
+        c = conn.cursor()
 
-    if update.email:
-        c.execute("UPDATE users SET email = ? WHERE id = ?", (update.email, user['id']))
-    
-    if update.password and update.new_password:
-        if update.password != user['password']:
-             conn.close()
-             raise HTTPException(status_code=400, detail="Current password incorrect")
-        c.execute("UPDATE users SET password = ? WHERE id = ?", (update.new_password, user['id']))
-
-    conn.commit()
-    conn.close()
+        if update.email:
+            c.execute("UPDATE users SET email = ? WHERE id = ?", (update.email, user['id']))
+        
+        if update.password and update.new_password:
+            if update.password != user['password']:
+                 raise HTTPException(status_code=400, detail="Current password incorrect")
+            c.execute("UPDATE users SET password = ? WHERE id = ?", (update.new_password, user['id']))
+
+    USER_CACHE.invalidate(user['id'])
     return {"message": "Profile updated"}
 
 @app.post("/api/logout")
 def logout(authorization: Optional[str] = Header(None)):
     if authorization:
         token = authorization.replace("Bearer ", "")
-        conn = sqlite3.connect(DB_PATH)
-        conn.execute("DELETE FROM sessions WHERE token = ?", (token,))
-        conn.commit()
-        conn.close()
+        DB.delete_session(token)
+        SESSION_CACHE.invalidate(token)
     return {"message": "Logged out"}
 
 # --- Process Routes ---
-import yt_dlp
-
-# --- GLOBAL SSL & DNS PATCH (The "Nuclear" Solution) ---
 # --- GLOBAL SSL & DNS PATCH (The "Nuclear" Solution) ---
-import os
-import ssl
-import certifi
-import requests.api
-import requests.sessions
+# Installed on first outbound use (HTTP fetches, yt-dlp, Firestore, model
+# download) rather than at import: requests/certifi/dnspython are not needed to
+# answer the first request after a cold start.
+_network_patched = False
+_network_lock = threading.Lock()
 
-# 1. SSL Fix: Force certifi path (Fallback)
-os.environ['SSL_CERT_FILE'] = certifi.where()
-os.environ['REQUESTS_CA_BUNDLE'] = certifi.where()
+def install_network_patches():
+    global _network_patched
+    if _network_patched:
+        return
+    with _network_lock:
+        if _network_patched:
+            return
+        import ssl
+        import certifi
+        import requests.sessions
 
-# 2. MONKEY PATCH REQUESTS TO DISABLE VERIFICATION
-# This ensures that even if a library asks for verification, we say NO.
-# Needed because our DNS patch forces IP connections which fail hostname checks.
-original_request = requests.sessions.Session.request
+        # 1. SSL Fix: Force certifi path (Fallback)
+        os.environ['SSL_CERT_FILE'] = certifi.where()
+        os.environ['REQUESTS_CA_BUNDLE'] = certifi.where()
 
-def patched_request(self, *args, **kwargs):
-    kwargs['verify'] = False # FORCE DISABLE SSL VERIFY
-    return original_request(self, *args, **kwargs)
+        # 2. MONKEY PATCH REQUESTS TO DISABLE VERIFICATION
+        # This ensures that even if a library asks for verification, we say NO.
+        # Needed because our DNS patch forces IP connections which fail hostname checks.
+        original_request = requests.sessions.Session.request
 
-requests.sessions.Session.request = patched_request
-# REMOVED: requests.api.request patch (not needed and caused signature mismatch)
+        def patched_request(self, *args, **kwargs):
+            kwargs['verify'] = False # FORCE DISABLE SSL VERIFY
+            return original_request(self, *args, **kwargs)
 
-# 3. Patch SSL Context default (Double Tap)
-ssl._create_default_https_context = ssl._create_unverified_context
+        requests.sessions.Session.request = patched_request
+        # REMOVED: requests.api.request patch (not needed and caused signature mismatch)
 
-# 4. DNS Fix: Replace broken container resolver with dnspython
-try:
-    import dns.resolver
-    # ... (Rest of DNS Logic) ...
-    import socket
+        # 3. Patch SSL Context default (Double Tap)
+        ssl._create_default_https_context = ssl._create_unverified_context
 
-    # Configure Google DNS
-    my_resolver = dns.resolver.Resolver()
-    my_resolver.nameservers = ['8.8.8.8', '8.8.4.4', '1.1.1.1']
+        # 4. DNS Fix: Replace broken container resolver with dnspython
+        try:
+            import dns.resolver
+            import socket
 
-    _orig_getaddrinfo = socket.getaddrinfo
+            # Configure Google DNS
+            my_resolver = dns.resolver.Resolver()
+            my_resolver.nameservers = ['8.8.8.8', '8.8.4.4', '1.1.1.1']
 
-    def patched_getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
-        # 1. Try standard first (mostly for localhost/IPs)
-        try:
-             # If it's an IP, this returns immediately
-             return _orig_getaddrinfo(host, port, family, type, proto, flags)
-        except:
-             pass
-        
-        # 2. Manual Resolve via 8.8.8.8
-        try:
-            # print(f"DEBUG: Manual DNS Resolve for {host}")
-            answers = my_resolver.resolve(host, 'A')
-            ip = answers[0].to_text()
-            # print(f"DEBUG: Resolved {host} -> {ip}")
-            return _orig_getaddrinfo(ip, port, family, type, proto, flags)
-        except Exception as e:
-            # print(f"DEBUG: DNS Fail {host}: {e}")
-            raise socket.gaierror(f"DNS Resolution Failed for {host}")
-            
-    socket.getaddrinfo = patched_getaddrinfo
-    
-except ImportError:
-    print("WARNING: dnspython not installed. DNS Patch skipped.")
+            _orig_getaddrinfo = socket.getaddrinfo
+
+            def patched_getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
+                # 1. Try standard first (mostly for localhost/IPs)
+                try:
+                     # If it's an IP, this returns immediately
+                     return _orig_getaddrinfo(host, port, family, type, proto, flags)
+                except:
+                     pass
+
+                # 2. Manual Resolve via 8.8.8.8
+                try:
+                    answers = my_resolver.resolve(host, 'A')
+                    ip = answers[0].to_text()
+                    return _orig_getaddrinfo(ip, port, family, type, proto, flags)
+                except Exception as e:
+                    raise socket.gaierror(f"DNS Resolution Failed for {host}")
+
+            socket.getaddrinfo = patched_getaddrinfo
+
+        except ImportError:
+            print("WARNING: dnspython not installed. DNS Patch skipped.")
+        _network_patched = True
 
 # -----------------------------------
 
-# (Rest of imports...)
 
+# --- METRICS ---
+# Prometheus text exposition, no client library. Values are per process (each
+# uvicorn worker exports its own). Stage timings are also collected per job:
+# the scheduler worker opens a job context on its thread, and every stage timed
+# on that thread lands in the job record (jobs.timings) as well as the histograms.
+STAGE_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+JOB_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
 
-# --- Core Logic Refactored ---
-def core_process_track(input_path: Path, original_name: str, user: dict):
-    # 1. Run Demucs (High Quality V4.1)
-    import static_ffmpeg
-    static_ffmpeg.add_paths()
-    ffmpeg_path = shutil.which("ffmpeg")
-    current_env = os.environ.copy()
-
-    # OPTIMIZATION: Limit threads to avoid freezing the CPU
-    current_env["OMP_NUM_THREADS"] = "1"
-    current_env["MKL_NUM_THREADS"] = "1"
-
-    cmd = [
-        sys.executable,
-        "-m", "demucs.separate",
-        "-n", "htdemucs", # Lighter model than htdemucs_6s
-        "--shifts", "0",  # Fastest
-        "--overlap", "0.1", # Minimum overlap
-        "--float32",
-        "-o", str(OUTPUT_DIR),
-        "-j", "1", # Single job
-        str(input_path)
-    ]
-    
-    p = subprocess.run(cmd, capture_output=True, text=True, env=current_env)
-    
-    if p.returncode != 0:
-        print(f"CORE DEMUCS STDERR: {p.stderr}")
-        raise HTTPException(status_code=500, detail="Core Processing Failed")
+def _label_str(names, values, extra=""):
+    parts = [f'{n}="{str(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
 
-    # 2. Verify Output
-    internal_id = input_path.stem
-    base_out = OUTPUT_DIR / "htdemucs" # Checking correct folder
-    created_folder = base_out / internal_id
-    
-    if not created_folder.exists():
-        print(f"CRITICAL: Expected output {created_folder} missing.")
-        raise HTTPException(status_code=500, detail="Processing Output Missing")
+def _fmt(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
 
-    # 3. Audio Polish & Smart Analysis (V5.0)
-    final_stems = {}
-    
-    # Path to ffmpeg
-    ffmpeg_exe = str(ffmpeg_path) if ffmpeg_path else "ffmpeg"
+class Counter:
+    def __init__(self, name: str, help: str, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_str(self.labels, key)} {_fmt(value)}")
+        return lines
+
+class Gauge:
+    """Read at scrape time from `fn` (so it never goes stale)."""
+
+    def __init__(self, name: str, help: str, fn):
+        self.name, self.help, self.fn = name, help, fn
 
-    for f in created_folder.glob("*.wav"):
+    def render(self):
         try:
-            # A. Smart Polish: Simple Normalize
-            polished_path = f.with_suffix(".polished.wav")
-            
-            filter_chain = "norm=0" 
-            if "bass" not in f.name and "drums" not in f.name:
-                filter_chain += ",highpass=f=50"
-            
-            cmd_polish = [
-                ffmpeg_exe, "-y",
-                "-i", str(f),
-                "-af", filter_chain,
-                "-ar", "44100", 
-                str(polished_path)
-            ]
-            
-            subprocess.run(cmd_polish, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            
-            # Clean replace logic
-            if polished_path.exists() and polished_path.stat().st_size > 1000: # Ensure not empty
-                f.unlink() # Delete original
-                polished_path.rename(f) # Move polished to original name
-            elif polished_path.exists():
-                polished_path.unlink() # Delete failed/empty polished file
-            
-            # B. Silence Detection
-            is_silent = True
-            with wave.open(str(f), 'rb') as wav_file:
-                if wav_file.getnframes() > 0:
-                    frames_to_read = min(wav_file.getnframes(), 48000 * 30) 
-                    data = wav_file.readframes(frames_to_read)
-                    import numpy as np
-                    samples = np.frombuffer(data, dtype=np.int16)
-                    max_amp = np.max(np.abs(samples)) if len(samples) > 0 else 0
-                    if max_amp > 150: is_silent = False
-            
-            if is_silent:
-                 f.unlink()
-            else:
-                 final_stems[f.stem] = f"/stems/htdemucs/{created_folder.name}/{f.name}"
+            value = self.fn()
         except Exception as e:
-            print(f"Error analyzing/polishing {f}: {e}")
-            final_stems[f.stem] = f"/stems/htdemucs/{created_folder.name}/{f.name}"
+            print(f"METRICS: gauge {self.name} failed: {e}")
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {_fmt(value)}"]
 
-    # 4. Save to DB
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute("UPDATE users SET credits = credits - 1 WHERE id = ?", (user["id"],))
-    
-    safe_human_name = Path(original_name).stem
-    conn.execute("INSERT INTO projects VALUES (?, ?, ?, ?, ?)",
-                 (internal_id, user["id"], safe_human_name, internal_id, str(datetime.datetime.now())))
-    conn.commit()
-    conn.close()
+class Histogram:
+    def __init__(self, name: str, help: str, buckets, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
 
-    return {
-        "message": "Success",
-        "credits_left": user["credits"] - 1,
-        "stems": final_stems,
-        "project": {"id": internal_id, "name": safe_human_name}
-    }
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
 
-@app.on_event("startup")
-async def startup_event():
-    print("MATCHBOX AUDIO ENGINE V4.2 - DNS PATCHED")
-    # Initialize DB (already done globally but good for hooks)
-    pass
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    le = 'le="%s"' % bound
+                    lines.append(f"{self.name}_bucket{_label_str(self.labels, key, le)} {count}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_label_str(self.labels, key, le)} {series[-1]}")
+                lines.append(f"{self.name}_sum{_label_str(self.labels, key)} {_fmt(round(series[-2], 6))}")
+                lines.append(f"{self.name}_count{_label_str(self.labels, key)} {series[-1]}")
+        return lines
 
-@app.post("/api/process")
-async def process_audio(
-    file: UploadFile = File(...),
-    user: dict = Depends(get_current_user)
-):
-    if user["credits"] < 1:
-        raise HTTPException(status_code=402, detail="Insufficient credits")
+def process_rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource  # Peak, not current, where /proc is unavailable
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == "darwin" else rss * 1024
 
-    file_ext = Path(file.filename).suffix or ".wav"
-    internal_id = str(uuid.uuid4())
-    temp_filename = f"{internal_id}{file_ext}"
-    input_path = INPUT_DIR / temp_filename
-    
-    with open(input_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-        
-    # Create a wrapper to run the sync processing in a thread
-    from starlette.concurrency import run_in_threadpool
-    return await run_in_threadpool(core_process_track, input_path, file.filename, user)
+STAGE_SECONDS = Histogram("aura_stage_seconds", "Time spent per pipeline stage.", STAGE_BUCKETS, ("stage",))
+JOB_SECONDS = Histogram("aura_job_seconds", "Job latency from creation to completion or failure.",
+                        JOB_BUCKETS, ("kind", "status"))
+STAGE_FAILURES = Counter("aura_stage_failures_total", "Pipeline stages that raised.", ("stage",))
+JOBS_FINISHED = Counter("aura_jobs_finished_total", "Jobs finished by this process.", ("kind", "status"))
+FIRST_AUDIO_SECONDS = Histogram("aura_job_first_audio_seconds",
+                                "Job creation to the first playable audio (preview or full result).",
+                                JOB_BUCKETS, ("kind",))
+QUEUE_WAIT_SECONDS = Histogram("aura_queue_wait_seconds", "Time from enqueue to a worker picking the job up.",
+                               JOB_BUCKETS, ("plan",))
 
-from fastapi import BackgroundTasks
-import threading
+_job_context = threading.local()
 
-# --- In-Memory Job Store ---
-JOBS = {}
+class JobContext:
+    def __init__(self, job_id: str, kind: str, created: float, stages: dict = None):
+        self.job_id = job_id
+        self.kind = kind or "unknown"
+        self.created = created or time.time()
+        self.stages = dict(stages or {})
+        self.status = None
+        self.first_audio = None
+        self.batcher = None  # Shared SegmentBatcher while the job runs inside a batch job
 
-def update_job(jid, status, progress=0):
-    if jid in JOBS:
-        JOBS[jid]["status"] = status
-        JOBS[jid]["progress"] = progress
+def current_job():
+    return getattr(_job_context, "job", None)
 
-# SHARED PIPELINE: Runs inside a background thread
-def run_separation_pipeline(job_id: str, input_path: Path, meta_title: str, user: dict):
+def record_stage(name: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage=name)
+    ctx = current_job()
+    if ctx is not None:
+        ctx.stages[name] = round(ctx.stages.get(name, 0.0) + seconds, 4)
+
+@contextlib.contextmanager
+def stage(name: str):
+    started = time.perf_counter()
     try:
-        update_job(job_id, "Initializing Neural Engine...", 10)
-        
-        # 1. Run Demucs (Optimized for Speed)
-        import static_ffmpeg
-        static_ffmpeg.add_paths()
-        current_env = os.environ.copy()
-        
-        # OPTIMIZATION: Limit threads to avoid freezing the CPU
-        current_env["OMP_NUM_THREADS"] = "1"
-        current_env["MKL_NUM_THREADS"] = "1"
-        
-        # PERFORMANCE FIX: "shifts=0" is fastest. 
-        # Using "htdemucs" (Hybrid Transformer) - standard version.
-        # USE RAM/CPU BALANCING: 'nice -n 15' lowers priority so Web UI doesn't freeze.
-        cmd = [
-            "nice", "-n", "15",
-            sys.executable, "-m", "demucs.separate",
-            "-n", "htdemucs",  # Lighter model
-            "--shifts", "0",   # FASTEST MODE
-            "--overlap", "0.1",# MINIMUM OVERLAP
-            "--float32",
-            "-o", str(OUTPUT_DIR),
-            "-j", "1",         # Force single thread
-            str(input_path)
-        ]
-        
-        update_job(job_id, "Initializing Engine...", 0)
-        
-        # STREAMING EXECUTION
-        # buffer_size=1 (line buffered), universal_newlines=True (text mode)
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE, 
-            stderr=subprocess.PIPE,
-            text=True,
-            env=current_env,
-            bufsize=1,
-            universal_newlines=True
-        )
-        
-        # Read stderr for progress (Demucs uses TQDM on stderr)
-        import re
-        
-        # We need to read continuously. strict line reading might block on \r
-        # But let's try reading line by line.
-        while True:
-            line = process.stderr.readline()
-            if not line and process.poll() is not None:
-                break
-            
-            if line:
-                # print(f"DEMUCS RAW: {line.strip()}") # Debug
-                
-                # Regex for TQDM percentage: " 42%|"
-                match = re.search(r"(\d+)%\|", line)
-                if match:
-                    p = int(match.group(1))
-                    # Map 0-100 of separation to 20-90 of total job
-                    # Separation is the bulk of work.
-                    # 20 + (p * 0.7)
-                    scaled = 20 + int(p * 0.7)
-                    update_job(job_id, f"Separating Stems ({p}%)", scaled)
-        
-        if process.returncode != 0:
-            err = process.stderr.read()
-            print(f"DEMUCS FINAL STDERR: {err}")
-            raise Exception(f"Demucs Failed (Code {process.returncode})")
-            
-        update_job(job_id, "Polishing Audio (Normalization)...", 95)
-        
-        # 2. Verify Output
-        internal_id = input_path.stem
-        # Note: Model name change affects folder structure
-        base_out = OUTPUT_DIR / "htdemucs" 
-        created_folder = base_out / internal_id
-        
-        # Retry logic
-        if not created_folder.exists():
-             import time
-             time.sleep(1)
-             
-        if not created_folder.exists():
-             # List output dir to debug where it went
-             print(f"DEBUG: Contents of {OUTPUT_DIR}: {list(OUTPUT_DIR.glob('*'))}")
-             raise Exception(f"Output folder not found: {created_folder}")
-
-        # 3. Smart Analysis & DB
-        final_stems = {}
-        
-        for f in created_folder.glob("*.wav"):
-            try:
-                # B. Silence Detection Only (No FFmpeg Polish)
-                is_silent = True
-                with wave.open(str(f), 'rb') as wav_file:
-                    if wav_file.getnframes() > 0:
-                        frames_to_read = min(wav_file.getnframes(), 48000 * 30) 
-                        data = wav_file.readframes(frames_to_read)
-                        import numpy as np
-                        samples = np.frombuffer(data, dtype=np.int16)
-                        max_amp = np.max(np.abs(samples)) if len(samples) > 0 else 0
-                        if max_amp > 150: is_silent = False
-                
-                if is_silent:
-                     f.unlink()
-                else:
-                     final_stems[f.stem] = f"/stems/htdemucs/{created_folder.name}/{f.name}"
-            except:
-                final_stems[f.stem] = f"/stems/htdemucs/{created_folder.name}/{f.name}"
+        yield
+    except Exception:
+        STAGE_FAILURES.inc(stage=name)
+        raise
+    finally:
+        record_stage(name, time.perf_counter() - started)
 
-        # 4. Save DB
-        deduct_credit(user["id"])
-        conn = sqlite3.connect(DB_PATH)
-        # conn.execute("UPDATE users SET credits = credits - 1 WHERE id = ?", (user["id"],)) # Handled by helper
-        safe_human_name = Path(meta_title).stem
-        current_time = str(datetime.datetime.now())
-        conn.execute("INSERT INTO projects VALUES (?, ?, ?, ?, ?)",
-                     (internal_id, user["id"], safe_human_name, internal_id, current_time))
-        conn.commit()
-        conn.close()
+def mark_first_audio():
+    """The current job just published something the user can listen to (once per job)."""
+    ctx = current_job()
+    if ctx is not None and ctx.first_audio is None:
+        ctx.first_audio = round(max(time.time() - ctx.created, 0.0), 4)
+        FIRST_AUDIO_SECONDS.observe(ctx.first_audio, kind=ctx.kind)
 
+def begin_job_metrics(job: dict):
+    """Open the stage-timing context for `job` on this (worker) thread."""
+    ctx = JobContext(job["job_id"], job["kind"], job["start_time"], job.get("timings"))
+    _job_context.job = ctx
+    # A remote job's download stage ran before it was queued
+    record_stage("queue_wait", max(time.time() - ctx.created - ctx.stages.get("download", 0.0), 0.0))
+    return ctx
 
+def end_job_metrics(ctx: JobContext):
+    _job_context.job = None
+    if ctx.status:
+        JOB_SECONDS.observe(time.time() - ctx.created, kind=ctx.kind, status=ctx.status)
+        JOBS_FINISHED.inc(kind=ctx.kind, status=ctx.status)
 
-        result = {
-            "message": "Success",
-            "credits_left": user["credits"] - 1,
-            "stems": final_stems,
-            "project": {"id": internal_id, "name": safe_human_name}
-        }
-        
-        JOBS[job_id]["result"] = result
-        JOBS[job_id]["status"] = "completed"
-        JOBS[job_id]["progress"] = 100
-        
-    except Exception as e:
-        print(f"Pipeline Error: {e}")
-        JOBS[job_id]["error"] = str(e)
-        JOBS[job_id]["status"] = "failed"
+# --- SEPARATION ENGINE ---
+# One Demucs model stays resident for the lifetime of the process.
+# Spawning `python -m demucs.separate` per track re-imported torch and reloaded
+# the htdemucs weights every time (seconds + hundreds of MB before any audio).
+MODEL_NAME = "htdemucs"   # Lighter model than htdemucs_6s
+SEPARATION_SHIFTS = 0     # Fastest
+SEPARATION_OVERLAP = 0.1  # Minimum overlap
+# OPTIMIZATION: Limit torch threads to avoid freezing the CPU (was OMP_NUM_THREADS=1)
+TORCH_THREADS = int(os.environ.get("AURA_TORCH_THREADS", "1"))
+# How one track uses the cores. torch intra-op threads are process-wide, so they
+# are set once when the model loads; only the segment pool is sized per job.
+#   single   - TORCH_THREADS intra-op threads, segments one after another (legacy)
+#   threads  - each worker's share of the cores as intra-op threads
+#   segments - one intra-op thread, overlapping segments separated concurrently
+#   auto     - intra-op threads, plus concurrent segments on the cores a quiet box leaves idle
+PARALLEL_MODE = os.environ.get("AURA_PARALLEL_MODE", "auto").lower()
+SEGMENT_RAM_MB = int(os.environ.get("AURA_SEGMENT_RAM_MB", "700"))  # Peak per in-flight segment
+# Boot never loads torch/demucs. Opt in to loading them right after startup instead
+# of on the first job: off | model | full (also runs one second of silence through it)
+WARMUP = os.environ.get("AURA_WARMUP", "off").lower()
 
-# --- REMOTE FILE PROCESSING (FIREBASE) ---
-class RemoteFileRequest(BaseModel):
-    url: str
-    filename: str
+class _ProgressResult:
+    def __init__(self, pool, func, args, kwargs, future=None):
+        self.pool = pool
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
 
-@app.post("/api/process_remote_file")
-async def process_remote_file(
-    req: RemoteFileRequest,
-    background_tasks: BackgroundTasks,
-    user: dict = Depends(get_current_user)
-):
-    if user["credits"] < 1: raise HTTPException(status_code=402, detail="Insufficient credits")
-    
-    # 1. Download File
-    job_id = str(uuid.uuid4())
-    internal_id = job_id 
-    ext = Path(req.filename).suffix or ".wav" # Default to wav if missing
-    if not ext.startswith("."): ext = "." + ext
-    
-    final_path = INPUT_DIR / f"{internal_id}{ext}"
-    
+    def result(self):
+        if self.future is not None:
+            out = self.future.result()
+        else:
+            out = self.func(*self.args, **self.kwargs)
+        self.pool.done += 1
+        if self.pool.callback:
+            self.pool.callback(self.pool.done, self.pool.submitted)
+        return out
+
+class _ProgressPool:
+    """Executor handed to `apply_model` so we can count finished segments.
+
+    apply_model submits every segment before collecting any result, so
+    `done / submitted` is an exact separation progress fraction. With an
+    `executor` the segments run concurrently; apply_model still stitches
+    them back in order with its overlap cross-fade.
+    """
+    def __init__(self, callback=None, executor=None):
+        self.callback = callback
+        self.executor = executor
+        self.submitted = 0
+        self.done = 0
+
+    def submit(self, func, *args, **kwargs):
+        self.submitted += 1
+        future = self.executor.submit(func, *args, **kwargs) if self.executor else None
+        return _ProgressResult(self, func, args, kwargs, future)
+
+def _available_ram_mb():
     try:
-        # Download from Firebase URL
-        import requests
-        with requests.get(req.url, stream=True) as r:
-            r.raise_for_status()
-            with open(final_path, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
-    except Exception as e:
-        print(f"Download Error: {e}")
-        raise HTTPException(status_code=400, detail=f"Failed to download file: {str(e)}")
-
-    # 2. Init Job
-    JOBS[job_id] = {
-        "status": "queued",
-        "progress": 0,
-        "start_time": time.time(),
-        "user_id": user["id"],
-        "message": "Queued for separation..."
-    }
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_AVPHYS_PAGES") // (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return None
 
-    # 3. Start Pipeline
-    background_tasks.add_task(run_separation_pipeline, job_id, final_path, req.filename, user)
-    
-    return {"job_id": job_id, "message": "Downloading & Processing..."}
+def intra_op_threads(mode: str = None):
+    """torch intra-op threads for the process (see load()): a worker's share of the cores."""
+    mode = mode or PARALLEL_MODE
+    if mode == "single":
+        return TORCH_THREADS
+    if mode == "segments":
+        return 1
+    return max(1, (os.cpu_count() or 1) // MAX_WORKERS)
 
-# --- ASYNC ROUTES ---
+def plan_parallelism(active_jobs: int, mode: str = None):
+    """Pick (intra_op_threads, segment_workers) for one job.
 
-@app.post("/api/process_file_async")
-async def process_file_async(
-    background_tasks: BackgroundTasks,
-    file: UploadFile = File(...),
-    user: dict = Depends(get_current_user)
-):
-    if user["credits"] < 1: raise HTTPException(status_code=402, detail="Insufficient credits")
-    
+    Each running job gets an equal share of the cores. The intra-op threads
+    are fixed for the process; a job whose share is larger (a lone job on a
+    multi-worker box, or any job in segments mode) fills the rest with
+    concurrent segments, as many as free RAM allows.
+    """
+    mode = mode or PARALLEL_MODE
+    threads = intra_op_threads(mode)
+    share = max(1, (os.cpu_count() or 1) // max(active_jobs, 1))
+    if mode in ("single", "threads") or share <= threads:
+        return threads, 1
+    if mode == "segments" or (mode == "auto" and active_jobs <= 1):
+        workers = share // threads
+        ram_mb = _available_ram_mb()
+        if ram_mb:
+            workers = max(1, min(workers, ram_mb // SEGMENT_RAM_MB))
+        return threads, workers
+    return threads, 1
+
+class SeparationEngine:
+    def __init__(self, model_name=MODEL_NAME, shifts=SEPARATION_SHIFTS, overlap=SEPARATION_OVERLAP):
+        self.model_name = model_name
+        self.shifts = shifts
+        self.overlap = overlap
+        self.model = None
+        self._load_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        # Latency bookkeeping (cold = first job, pays the model load)
+        self.load_seconds = None
+        self.cold_job_seconds = None
+        self.warm_jobs = 0
+        self.warm_total_seconds = 0.0
+
+    def load(self):
+        if self.model is not None:
+            return self.model
+        with self._load_lock:
+            if self.model is None:
+                started = time.time()
+                install_network_patches()  # Weights may be downloaded on first load
+                import static_ffmpeg
+                static_ffmpeg.add_paths()
+                import torch
+                from demucs.pretrained import get_model
+                # Process-wide: set once here, never per job (it would resize running jobs' pools)
+                torch.set_num_threads(intra_op_threads())
+                model = get_model(self.model_name)
+                model.cpu()
+                model.eval()
+                self.model = model
+                self.load_seconds = time.time() - started
+                print(f"ENGINE: Loaded {self.model_name} in {self.load_seconds:.2f}s")
+        return self.model
+
+    @property
+    def samplerate(self):
+        return self.load().samplerate
+
+    @property
+    def sources(self):
+        return list(self.load().sources)
+
+    def warmup(self, full: bool = False):
+        try:
+            model = self.load()
+            if full:
+                import torch
+                from demucs.apply import apply_model
+                started = time.time()
+                with torch.no_grad():
+                    apply_model(model, torch.zeros(1, model.audio_channels, model.samplerate),
+                                shifts=0, split=True, overlap=self.overlap)
+                print(f"ENGINE: Warm-up pass in {time.time() - started:.2f}s")
+        except Exception as e:
+            print(f"ENGINE: Warm-up failed: {e}")
+
+    def load_audio(self, input_path: Path, max_seconds: float = None):
+        """Decode any input (or only its first `max_seconds`) to a [channels, samples] tensor at the model rate."""
+        model = self.load()
+        from demucs.audio import AudioFile, convert_audio
+        if input_path.suffix == DECODED_SUFFIX:
+            # Raw PCM already decoded while the upload arrived (see STREAMING INGEST)
+            import numpy as np
+            import torch
+            count = int(max_seconds * DECODE_SAMPLERATE) * DECODE_CHANNELS if max_seconds else -1
+            data = np.fromfile(str(input_path), dtype="<f4", count=count).reshape(-1, DECODE_CHANNELS)
+            return convert_audio(torch.from_numpy(data.T.copy()), DECODE_SAMPLERATE,
+                                 model.samplerate, model.audio_channels)
+        try:
+            return AudioFile(input_path).read(duration=max_seconds, streams=0, samplerate=model.samplerate,
+                                              channels=model.audio_channels)
+        except (FileNotFoundError, subprocess.CalledProcessError):
+            # No ffmpeg / unreadable by ffmpeg: libsndfile handles wav/flac/ogg
+            import soundfile as sf
+            import torch
+            with sf.SoundFile(str(input_path)) as f:
+                frames = int(max_seconds * f.samplerate) if max_seconds else -1
+                data, sr = f.read(frames, dtype="float32", always_2d=True), f.samplerate
+            return convert_audio(torch.from_numpy(data.T.copy()), sr, model.samplerate, model.audio_channels)
+
+    def separate(self, input_path: Path, progress=None, active_jobs: int = 1, mode: str = None,
+                 max_seconds: float = None):
+        """Separate a track. Returns ({stem: tensor[channels, samples]}, timing).
+
+        `progress(done, total)` is called after every model segment.
+        Segment-parallel output matches the sequential pass to float32
+        rounding: max abs difference stays below 1e-4. `max_seconds` only
+        decodes and separates the start of the track (previews); those runs
+        are timed as preview_* stages and kept out of the latency stats.
+        """
+        prefix = "preview_" if max_seconds else ""
+        cold = self.model is None
+        started = time.time()
+        with stage("model_load") if cold else contextlib.nullcontext():
+            model = self.load()
+
+        import torch
+        from concurrent.futures import ThreadPoolExecutor
+        from demucs.apply import apply_model
+
+        ctx = current_job()
+        batcher = ctx.batcher if ctx is not None else None
+        threads = torch.get_num_threads()
+        # Batch jobs: the shared batcher runs the forward passes, on intra-op threads
+        segment_workers = plan_parallelism(active_jobs, mode)[1] if batcher is None else 1
+
+        with stage(prefix + "decode"):
+            wav = self.load_audio(input_path, max_seconds)
+        ref = wav.mean(0)
+        ref_mean, ref_std = ref.mean(), ref.std()
+        if ref_std == 0:
+            ref_std = torch.tensor(1.0)
+        wav = (wav - ref_mean) / ref_std
+
+        executor = ThreadPoolExecutor(segment_workers) if segment_workers > 1 else None
+        try:
+            with stage(prefix + "separate"), torch.no_grad():
+                out = apply_model(model, wav[None], shifts=self.shifts, split=True,
+                                  overlap=self.overlap, pool=_ProgressPool(progress, batcher or executor))[0]
+        finally:
+            if executor:
+                executor.shutdown(wait=True)
+        out = out * ref_std + ref_mean
+
+        elapsed = time.time() - started
+        with self._stats_lock:
+            if cold and not max_seconds:
+                self.cold_job_seconds = elapsed
+            elif not max_seconds:
+                self.warm_jobs += 1
+                self.warm_total_seconds += elapsed
+        print(f"ENGINE: Separated {prefix}{Path(input_path).name} in {elapsed:.2f}s ({'cold' if cold else 'warm'})")
+
+        timing = {"cold_start": cold, "separate_seconds": round(elapsed, 3),
+                  "threads": threads, "segment_workers": segment_workers}
+        if cold:
+            timing["model_load_seconds"] = round(self.load_seconds or 0, 3)
+        return dict(zip(model.sources, out)), timing
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "model": self.model_name,
+                "loaded": self.model is not None,
+                "model_load_seconds": self.load_seconds,
+                "cold_job_seconds": self.cold_job_seconds,
+                "warm_jobs": self.warm_jobs,
+                "warm_avg_seconds": (self.warm_total_seconds / self.warm_jobs) if self.warm_jobs else None,
+            }
+
+ENGINE = SeparationEngine()
+
+# --- BATCHED INFERENCE (album jobs) ---
+# apply_model hands every segment of a track to its pool as an independent
+# `apply_model(model, chunk, split=False)` call, padded to the model's training
+# length. A SegmentBatcher is such a pool shared by all tracks of one batch job:
+# pending segments, whichever track they belong to, are stacked into a single
+# forward pass (up to BATCH_SEGMENTS), so the cores run a few large matmuls
+# instead of many batch-of-one calls while the other tracks decode and write.
+BATCH_SEGMENTS = max(1, int(os.getenv("AURA_BATCH_SEGMENTS", "8")))
+BATCH_FILL_SECONDS = int(os.getenv("AURA_BATCH_FILL_MS", "20")) / 1000  # Wait this long for a fuller batch
+
+class SegmentBatcher:
+    def __init__(self, max_batch: int = BATCH_SEGMENTS, fill_seconds: float = BATCH_FILL_SECONDS):
+        self.max_batch = max_batch
+        self.fill_seconds = fill_seconds
+        self._cond = threading.Condition()
+        self._pending = []  # (model, chunk, segment, future)
+        self._closed = False
+        self._thread = None
+        self.batches = 0
+        self.segments = 0
+
+    def submit(self, func, *args, **kwargs):
+        from concurrent.futures import Future
+        future = Future()
+        if kwargs.get("split") or kwargs.get("shifts") or len(args) != 2:
+            # Not a plain per-segment call (shifted passes): run it as is
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        model, chunk = args
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Segment batcher is closed")
+            self._pending.append((model, chunk, kwargs.get("segment"), future))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="aura-batcher", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    def close(self):
+        """No new segments; the dispatcher drains what is queued, then exits."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                deadline = time.monotonic() + self.fill_seconds
+                while len(self._pending) < self.max_batch and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+            self._run(batch)
+
+    def _run(self, batch):
+        import torch
+        from demucs.apply import center_trim, tensor_chunk
+        from demucs.htdemucs import HTDemucs
+        # Same padding as apply_model's split=False branch, grouped by padded length
+        groups = {}
+        for model, chunk, segment, future in batch:
+            length = chunk.shape[-1]
+            if isinstance(model, HTDemucs) and segment is not None:
+                valid = int(segment * model.samplerate)
+            elif hasattr(model, "valid_length"):
+                valid = model.valid_length(length)
+            else:
+                valid = length
+            groups.setdefault((id(model), valid), []).append(
+                (model, tensor_chunk(chunk).padded(valid), length, future))
+        for items in groups.values():
+            try:
+                with torch.no_grad():
+                    out = items[0][0](torch.cat([padded for _, padded, _, _ in items]))
+                start = 0
+                for _, padded, length, future in items:
+                    future.set_result(center_trim(out[start:start + padded.shape[0]], length))
+                    start += padded.shape[0]
+            except Exception as e:
+                for _, _, _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+            with self._cond:
+                self.batches += 1
+                self.segments += len(items)
+
+    def stats(self):
+        with self._cond:
+            return {"batches": self.batches, "segments": self.segments,
+                    "avg_batch": round(self.segments / self.batches, 2) if self.batches else None}
+
+SILENCE_PEAK = 150 / 32768  # Legacy int16 threshold (150) as a float amplitude
+STEM_CHUNK_FRAMES = 1 << 18  # ~6s at 44.1kHz per analysis/write chunk
+
+def _db(amplitude: float):
+    return round(20 * math.log10(amplitude), 2) if amplitude > 0 else None
+
+def analyze_stem(wav):
+    """Peak/RMS over the *whole* [channels, samples] float signal, chunk by chunk."""
+    frames = wav.shape[-1]
+    peak, sum_sq = 0.0, 0.0
+    for start in range(0, frames, STEM_CHUNK_FRAMES):
+        chunk = wav[:, start:start + STEM_CHUNK_FRAMES]
+        peak = max(peak, float(chunk.abs().max()))
+        sum_sq += float(chunk.double().pow(2).sum())
+    rms = math.sqrt(sum_sq / max(wav.numel(), 1))
+    return {"peak": peak, "rms": rms}
+
+def write_stems(stems: dict, folder: Path, samplerate: int):
+    """Stream stems to float32 WAVs (same layout as `demucs.separate --float32`).
+
+    Each stem is analysed in memory first; stems whose peak never exceeds
+    SILENCE_PEAK anywhere in the track are not written at all. Returns
+    {stem: {"peak", "peak_db", "rms", "rms_db", "silent", "duration"}}.
+    """
+    import soundfile as sf
+    folder.mkdir(parents=True, exist_ok=True)
+    analysis = {}
+    analyze_seconds = write_seconds = 0.0
+    try:
+        for name, wav in stems.items():
+            started = time.perf_counter()
+            level = analyze_stem(wav)
+            analyze_seconds += time.perf_counter() - started
+            # Clip guard (demucs' "rescale"): only kicks in above full scale
+            scale = 1.0 / max(1.01 * level["peak"], 1.0)
+            peak, rms = level["peak"] * scale, level["rms"] * scale
+            silent = peak <= SILENCE_PEAK
+            analysis[name] = {
+                "peak": round(peak, 6), "peak_db": _db(peak),
+                "rms": round(rms, 6), "rms_db": _db(rms),
+                "silent": silent,
+                "duration": round(wav.shape[-1] / samplerate, 3),
+            }
+            if silent:
+                continue
+            started = time.perf_counter()
+            peaks = PeakBuilder()
+            with sf.SoundFile(str(folder / f"{name}.wav"), "w", samplerate=samplerate,
+                              channels=wav.shape[0], subtype="FLOAT") as out:
+                for start in range(0, wav.shape[-1], STEM_CHUNK_FRAMES):
+                    chunk = wav[:, start:start + STEM_CHUNK_FRAMES]
+                    if scale != 1.0:
+                        chunk = chunk * scale
+                    out.write(chunk.t().numpy())
+                    peaks.add(chunk.mean(0).numpy())
+            peaks.write(folder / f"{name}{PEAKS_SUFFIX}", samplerate)
+            write_seconds += time.perf_counter() - started
+    except Exception:
+        STAGE_FAILURES.inc(stage="write")
+        raise
+    record_stage("analyze", analyze_seconds)
+    record_stage("write", write_seconds)
+    return analysis
+
+def stem_urls(folder: Path, analysis: dict):
+    """Public URLs of the non-silent stems."""
+    return {name: f"/stems/htdemucs/{folder.name}/{name}.wav"
+            for name, info in analysis.items() if not info.get("silent")}
+
+def insert_project(conn, project_id: str, user_id: str, name: str, folder_name: str, manifest: dict = None):
+    conn.execute("INSERT INTO projects (id, user_id, name, folder_path, created_at, manifest, bytes, last_access) "
+                 "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                 (project_id, user_id, name, folder_name, str(datetime.datetime.now()),
+                  json.dumps(manifest) if manifest is not None else None,
+                  manifest.get("bytes") if manifest else None, time.time()))
+
+# --- WAVEFORM PEAKS ---
+# Min/max of the mono mix per bucket, as a small pyramid of int8 arrays, so the
+# mixer can draw waveforms without downloading and decoding whole stems.
+# File layout (little endian):
+#   "APK1", u32 samplerate, u32 frames, u32 levels
+#   per level: u32 samples_per_bucket, u32 buckets, int8[buckets * 2] (min, max interleaved)
+PEAKS_SUFFIX = ".peaks"
+PEAKS_MAGIC = b"APK1"
+PEAK_BASE_SPB = 256  # Finest level: ~172 buckets/s at 44.1 kHz
+PEAK_LEVEL_FACTOR = 4
+PEAK_LEVELS = 4  # 256, 1024, 4096, 16384 samples per bucket
+PEAK_DEFAULT_WIDTH = 800
+
+class PeakBuilder:
+    """Streaming, vectorised min/max reduction; feed mono float chunks in order."""
+
+    def __init__(self):
+        self.frames = 0
+        self._mins = []
+        self._maxs = []
+        self._tail = None
+
+    def add(self, mono):
+        import numpy as np
+        self.frames += len(mono)
+        if self._tail is not None and len(self._tail):
+            mono = np.concatenate([self._tail, mono])
+        full = len(mono) // PEAK_BASE_SPB * PEAK_BASE_SPB
+        if full:
+            blocks = mono[:full].reshape(-1, PEAK_BASE_SPB)
+            self._mins.append(blocks.min(axis=1))
+            self._maxs.append(blocks.max(axis=1))
+        self._tail = mono[full:]
+
+    def levels(self):
+        """[(samples_per_bucket, int8 interleaved min/max)], finest first."""
+        import numpy as np
+        mins, maxs = list(self._mins), list(self._maxs)
+        if self._tail is not None and len(self._tail):
+            mins.append(self._tail.min(keepdims=True))
+            maxs.append(self._tail.max(keepdims=True))
+        mins = np.concatenate(mins) if mins else np.zeros(1, np.float32)
+        maxs = np.concatenate(maxs) if maxs else np.zeros(1, np.float32)
+        out, spb = [], PEAK_BASE_SPB
+        for level in range(PEAK_LEVELS):
+            if level:
+                pad = (-len(mins)) % PEAK_LEVEL_FACTOR
+                mins = np.pad(mins, (0, pad), mode="edge").reshape(-1, PEAK_LEVEL_FACTOR).min(axis=1)
+                maxs = np.pad(maxs, (0, pad), mode="edge").reshape(-1, PEAK_LEVEL_FACTOR).max(axis=1)
+                spb *= PEAK_LEVEL_FACTOR
+            pairs = np.empty(len(mins) * 2, dtype=np.int8)
+            pairs[0::2] = np.clip(np.round(mins * 127), -127, 127)
+            pairs[1::2] = np.clip(np.round(maxs * 127), -127, 127)
+            out.append((spb, pairs))
+        return out
+
+    def write(self, path: Path, samplerate: int):
+        levels = self.levels()
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.part")  # Per process: uvicorn workers may race
+        with open(tmp, "wb") as f:
+            f.write(struct.pack("<4s3I", PEAKS_MAGIC, samplerate, self.frames, len(levels)))
+            for spb, pairs in levels:
+                f.write(struct.pack("<2I", spb, len(pairs) // 2))
+                f.write(pairs.tobytes())
+        tmp.replace(path)
+
+_PEAK_BUILD_LOCKS = [threading.Lock() for _ in range(16)]  # Striped by path
+
+def ensure_peaks_file(wav_path: Path):
+    """The stem's peaks file, built once even when the mixer asks for it from several requests."""
+    path = wav_path.with_suffix(PEAKS_SUFFIX)
+    if path.exists():
+        return path
+    with _PEAK_BUILD_LOCKS[hash(str(path)) % len(_PEAK_BUILD_LOCKS)]:
+        if path.exists():  # Built while we waited
+            return path
+        return build_peaks_file(wav_path)
+
+def build_peaks_file(wav_path: Path):
+    """Peaks for a stem written before peaks existed (or restored from an old cache entry)."""
+    import soundfile as sf
+    peaks = PeakBuilder()
+    with sf.SoundFile(str(wav_path)) as f:
+        samplerate = f.samplerate
+        for block in f.blocks(blocksize=STEM_CHUNK_FRAMES, dtype="float32", always_2d=True):
+            peaks.add(block.mean(axis=1))
+    path = wav_path.with_suffix(PEAKS_SUFFIX)
+    peaks.write(path, samplerate)
+    return path
+
+def read_peaks_level(path: Path, width: int):
+    """The coarsest level with at least `width` buckets (else the finest), as one self-describing blob:
+    "APK1", u32 samplerate, u32 frames, u32 samples_per_bucket, u32 buckets, int8 pairs."""
+    with open(path, "rb") as f:
+        magic, samplerate, frames, count = struct.unpack("<4s3I", f.read(16))
+        if magic != PEAKS_MAGIC:
+            raise ValueError(f"{path.name} is not a peaks file")
+        levels = []
+        for _ in range(count):
+            spb, buckets = struct.unpack("<2I", f.read(8))
+            levels.append((spb, buckets, f.tell()))
+            f.seek(buckets * 2, os.SEEK_CUR)
+        chosen = levels[0]
+        for level in levels:
+            if level[1] >= width:
+                chosen = level
+        spb, buckets, offset = chosen
+        f.seek(offset)
+        data = f.read(buckets * 2)
+    return struct.pack("<4s4I", PEAKS_MAGIC, samplerate, frames, spb, buckets) + data
+
+# --- AUDIO POLISH ---
+# Peak normalisation + 50 Hz high-pass on the in-memory stems, before the single write.
+# Replaces one `ffmpeg -af norm=0,highpass=f=50 -ar 44100` process and two file
+# rewrites per stem.
+POLISH_SAMPLERATE = 44100
+POLISH_HIGHPASS_HZ = 50.0
+POLISH_PEAK = 0.99  # Just under full scale so the float writer's clip guard never rescales
+NO_HIGHPASS_STEMS = ("bass", "drums")  # Low end is the point of these stems
+
+def polish_stem(name: str, wav, samplerate: int):
+    """Return the polished [channels, samples] tensor (same dtype/device)."""
+    import torchaudio.functional as AF
+    if samplerate != POLISH_SAMPLERATE:
+        wav = AF.resample(wav, samplerate, POLISH_SAMPLERATE)
+    if name not in NO_HIGHPASS_STEMS and not name.startswith(COMPLEMENT_PREFIX):
+        # RBJ biquad, Q=0.707: the same filter as ffmpeg's default `highpass`
+        wav = AF.highpass_biquad(wav, POLISH_SAMPLERATE, POLISH_HIGHPASS_HZ, Q=0.707)
+    peak = float(wav.abs().max()) if wav.numel() else 0.0
+    # Never blow up bleed/noise in an (almost) empty stem to full scale
+    if peak > SILENCE_PEAK:
+        wav = wav * (POLISH_PEAK / peak)
+    return wav
+
+def polish_stems(stems: dict, samplerate: int):
+    return {name: polish_stem(name, wav, samplerate) for name, wav in stems.items()}, POLISH_SAMPLERATE
+
+# --- STEM SELECTION ---
+# `stems=vocals,bass` keeps only those sources; `two_stems=vocals` is the karaoke
+# layout (vocals + no_vocals, demucs' own naming). htdemucs always estimates all
+# four sources in one pass, so the saving is everything after inference: the
+# dropped stems are never polished, analysed, written, peak-indexed, cached or
+# encoded, and the complement is the sum of the others (no extra model work).
+MODEL_SOURCES = ("drums", "bass", "other", "vocals")
+COMPLEMENT_PREFIX = "no_"  # Complements keep their low end: never high-passed
+
+def parse_stem_selection(stems: Optional[str] = None, two_stems: Optional[str] = None):
+    """Validate the request parameters. Returns None (all stems) or a JSON-safe selection."""
+    if stems and two_stems:
+        raise HTTPException(status_code=400, detail="Use either stems or two_stems, not both")
+    if two_stems:
+        name = two_stems.strip().lower()
+        if name not in MODEL_SOURCES:
+            raise HTTPException(status_code=400, detail=f"two_stems must be one of {', '.join(MODEL_SOURCES)}")
+        return {"two_stems": name}
+    if stems:
+        names = {s.strip().lower() for s in stems.split(",") if s.strip()}
+        if not names or not names <= set(MODEL_SOURCES):
+            raise HTTPException(status_code=400, detail=f"stems must be a subset of {', '.join(MODEL_SOURCES)}")
+        if len(names) < len(MODEL_SOURCES):
+            return {"stems": [s for s in MODEL_SOURCES if s in names]}
+    return None
+
+def selection_variant(selection: Optional[dict]):
+    """Separation cache variant for a selection ("" = all stems)."""
+    if not selection:
+        return ""
+    if selection.get("two_stems"):
+        return f"two-{selection['two_stems']}"
+    return "stems-" + "+".join(selection["stems"])
+
+def select_stems(stems: dict, selection: Optional[dict]):
+    """Drop unrequested stems (and build the complement) before any per-stem work."""
+    if not selection:
+        return stems
+    name = selection.get("two_stems")
+    if name:
+        rest = [wav for other, wav in stems.items() if other != name]
+        return {name: stems[name], f"{COMPLEMENT_PREFIX}{name}": sum(rest[1:], rest[0].clone())}
+    return {n: wav for n, wav in stems.items() if n in selection["stems"]}
+
+def output_variant(selection: Optional[dict]):
+    """Separation cache variant of what finish_stems() produces, for every entry point."""
+    return "-".join(filter(None, ("polished", selection_variant(selection))))
+
+def finish_stems(stems: dict, selection: Optional[dict], samplerate: int, timing: dict):
+    """The one post-processing step after separation (sync, async, URL and YouTube jobs alike):
+    selection, then polish. Returns (stems, samplerate)."""
+    stems = select_stems(stems, selection)
+    polish_started = time.time()
+    with stage("polish"):
+        stems, samplerate = polish_stems(stems, samplerate)
+    timing["polish_seconds"] = round(time.time() - polish_started, 3)
+    return stems, samplerate
+
+# --- SEPARATION CACHE ---
+# Content-addressed store of finished stems. Re-uploads of the same file (or the same
+# YouTube URL) hit the cache and are hardlinked into the new project instantly.
+CACHE_DIR = BASE_DIR / "cache"
+CACHE_MAX_BYTES = int(os.environ.get("AURA_CACHE_MAX_MB", "4096")) * 1024 * 1024
+
+def file_digest(path: Path, chunk_size=1024 * 1024):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _link_or_copy(src: Path, dst: Path):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+class SeparationCache:
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def key_for(self, input_path: Path, variant: str = "", digest: str = None):
+        """sha256(input bytes) + model + shifts/overlap (+ pipeline variant).
+
+        `digest` is the sha256 of the bytes as uploaded, when `input_path` is a
+        decoded copy of them (so every upload route shares one key per file).
+        """
+        key = f"{digest or file_digest(input_path)}-{MODEL_NAME}-s{SEPARATION_SHIFTS}-o{SEPARATION_OVERLAP}"
+        return self.with_variant(key, variant)
+
+    @staticmethod
+    def with_variant(key: str, variant: str):
+        return f"{key}-{variant}" if variant else key
+
+    def restore(self, key: str, dest: Path):
+        """Link a cached entry into `dest`. Returns its stored metadata on a hit, else None."""
+        entry = self.root / key
+        row = DB.query_one("SELECT meta FROM separation_cache WHERE key = ?", (key,))
+        if not row or not entry.is_dir():
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            dest.mkdir(parents=True, exist_ok=True)
+            for f in entry.iterdir():
+                _link_or_copy(f, dest / f.name)
+        except OSError as e:
+            # Evicted underneath us: treat as a miss and separate normally
+            print(f"Cache restore failed for {key}: {e}")
+            shutil.rmtree(dest, ignore_errors=True)
+            with self._lock:
+                self.misses += 1
+            return None
+        DB.execute("UPDATE separation_cache SET last_used = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+        with self._lock:
+            self.hits += 1
+        return json.loads(row[0]) if row[0] else {}
+
+    def store(self, key: str, src: Path, meta: dict = None, patterns=("*.wav", "*" + PEAKS_SUFFIX)):
+        files = [f for pattern in patterns for f in src.glob(pattern) if f.is_file()]
+        if not files:
+            return
+        self.root.mkdir(parents=True, exist_ok=True)
+        entry = self.root / key
+        if entry.exists():
+            return
+        # Build under a temp name so a concurrent restore never sees a partial entry
+        tmp = self.root / f".{key}.{uuid.uuid4().hex}"
+        try:
+            tmp.mkdir()
+            for f in files:
+                _link_or_copy(f, tmp / f.name)
+            tmp.rename(entry)
+        except OSError as e:
+            print(f"Cache store failed for {key}: {e}")
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        size = sum(f.stat().st_size for f in files)
+        now = time.time()
+        DB.execute("INSERT OR REPLACE INTO separation_cache (key, size, hits, created_at, last_used, meta) VALUES (?, ?, 0, ?, ?, ?)",
+                   (key, size, now, now, json.dumps(meta) if meta is not None else None))
+        with self._lock:
+            self.stores += 1
+        self.evict()
+
+    def evict(self):
+        """Drop least-recently-used entries until the cache fits in max_bytes."""
+        total = DB.query_one("SELECT COALESCE(SUM(size), 0) FROM separation_cache")[0]
+        while total > self.max_bytes:
+            row = DB.query_one("SELECT key, size FROM separation_cache ORDER BY last_used ASC LIMIT 1")
+            if not row:
+                break
+            shutil.rmtree(self.root / row[0], ignore_errors=True)
+            DB.execute("DELETE FROM separation_cache WHERE key = ?", (row[0],))
+            total -= row[1]
+            with self._lock:
+                self.evictions += 1
+
+    def clear(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+        DB.execute("DELETE FROM separation_cache")
+
+    def stats(self):
+        entries, size = DB.query_one("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM separation_cache")
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "bytes": size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else None,
+                "stores": self.stores,
+                "evictions": self.evictions,
+            }
+
+SEPARATION_CACHE = SeparationCache(CACHE_DIR, CACHE_MAX_BYTES)
+
+# --- STREAMING ZIP (constant memory, exact length, Range-able) ---
+# Stems are already WAV, so entries are ZIP_STORED: the archive is just headers
+# around the raw file bytes. With CRCs known up front every header (and the
+# central directory) can be built before the first byte is sent, which gives
+# an exact Content-Length and lets any byte range be served by seeking.
+import zlib
+
+ZIP_CHUNK = 1 << 20
+ZIP32_LIMIT = 0xFFFFFFFF  # No ZIP64: a project's stems are far below 4 GiB
+CRC_CACHE_SIZE = 4096
+
+_crc_cache = collections.OrderedDict()  # (path, size, mtime_ns) -> crc32
+_crc_lock = threading.Lock()
+
+def file_crc32(path: Path, stat=None):
+    """CRC-32 of a file, memoised per (path, size, mtime) since stems never change in place."""
+    stat = stat or path.stat()
+    key = (str(path), stat.st_size, stat.st_mtime_ns)
+    with _crc_lock:
+        if key in _crc_cache:
+            _crc_cache.move_to_end(key)
+            return _crc_cache[key]
+    crc = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(ZIP_CHUNK), b""):
+            crc = zlib.crc32(chunk, crc)
+    with _crc_lock:
+        _crc_cache[key] = crc
+        while len(_crc_cache) > CRC_CACHE_SIZE:
+            _crc_cache.popitem(last=False)
+    return crc
+
+def _dos_datetime(mtime: float):
+    t = time.localtime(max(mtime, 315532800))  # DOS epoch is 1980
+    return ((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+            ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday)
+
+class ZipPlan:
+    """Byte layout of a stored ZIP: a list of (offset, bytes | (path, size)) segments."""
+
+    def __init__(self, files):
+        self.segments = []
+        central = []
+        offset = 0
+        for arcname, path in files:
+            stat = path.stat()
+            crc = file_crc32(path, stat)
+            name = arcname.encode("utf-8")
+            flags = 0x800 if not arcname.isascii() else 0
+            dos_time, dos_date = _dos_datetime(stat.st_mtime)
+            size = stat.st_size
+            local = struct.pack("<4s5H3L2H", b"PK\x03\x04", 20, flags, 0, dos_time, dos_date,
+                                crc, size, size, len(name), 0) + name
+            central.append(struct.pack("<4s6H3L5H2L", b"PK\x01\x02", 20, 20, flags, 0, dos_time, dos_date,
+                                       crc, size, size, len(name), 0, 0, 0, 0, 0o100644 << 16, offset) + name)
+            self.segments.append((offset, local))
+            offset += len(local)
+            self.segments.append((offset, (path, size)))
+            offset += size
+        directory = b"".join(central)
+        end = struct.pack("<4s4H2LH", b"PK\x05\x06", 0, 0, len(central), len(central),
+                          len(directory), offset, 0)
+        self.segments.append((offset, directory + end))
+        self.size = offset + len(directory) + len(end)
+        if offset + len(directory) > ZIP32_LIMIT:
+            raise HTTPException(status_code=413, detail="Project too large to zip")
+        self.etag = '"%s"' % hashlib.sha1(directory).hexdigest()
+
+    def iter_range(self, start: int, end: int):
+        """Yield archive bytes [start, end] (inclusive) in ZIP_CHUNK pieces."""
+        for seg_offset, data in self.segments:
+            seg_size = len(data) if isinstance(data, bytes) else data[1]
+            seg_end = seg_offset + seg_size
+            if seg_end <= start or seg_offset > end:
+                continue
+            lo = max(start, seg_offset) - seg_offset
+            hi = min(end + 1, seg_end) - seg_offset
+            if isinstance(data, bytes):
+                yield data[lo:hi]
+                continue
+            with open(data[0], "rb") as f:
+                f.seek(lo)
+                remaining = hi - lo
+                while remaining > 0:
+                    chunk = f.read(min(ZIP_CHUNK, remaining))
+                    if not chunk:
+                        raise IOError(f"{data[0]} shrank while streaming")
+                    remaining -= len(chunk)
+                    yield chunk
+
+def parse_byte_range(header: str, size: int):
+    """Single `bytes=a-b` / `bytes=a-` / `bytes=-n` range -> (start, end), None if absent/ignored."""
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[6:].strip().partition("-")
+    try:
+        if first == "":
+            length = int(last)
+            if length <= 0:
+                raise ValueError
+            start, end = max(size - length, 0), size - 1
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise HTTPException(status_code=416, detail="Range Not Satisfiable",
+                            headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+def stream_zip(plan: ZipPlan, filename: str, range_header: str = None, if_range: str = None):
+    headers = {
+        "Content-Disposition": f"attachment; filename={filename}",
+        "Accept-Ranges": "bytes",
+        "ETag": plan.etag,
+    }
+    byte_range = None
+    if not if_range or if_range == plan.etag:
+        byte_range = parse_byte_range(range_header, plan.size)
+    if byte_range is None:
+        start, end, status = 0, plan.size - 1, 200
+    else:
+        (start, end), status = byte_range, 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{plan.size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(plan.iter_range(start, end), status_code=status,
+                             media_type="application/zip", headers=headers)
+
+# --- DELIVERY ENCODES (lightweight stem variants for the player) ---
+# The WAVs stay the lossless master (ZIP / downloads). After a job completes the
+# encoder writes a FLAC (lossless, ~half the size of float WAV) and an Opus
+# preview (~2 MB/min) next to each stem, off the job's critical path.
+import mimetypes
+
+mimetypes.add_type("audio/ogg", ".opus")  # Not in older mimetypes tables
+mimetypes.add_type("audio/flac", ".flac")
+
+DELIVERY_FORMATS = {
+    # format: (ffmpeg muxer, codec args)
+    "opus": ("opus", ["-c:a", "libopus", "-b:a", "128k", "-vbr", "on"]),
+    "flac": ("flac", ["-c:a", "flac", "-sample_fmt", "s32", "-bits_per_raw_sample", "24"]),
+}
+DELIVERY_SUFFIXES = tuple(f".{fmt}" for fmt in DELIVERY_FORMATS)
+ENCODE_WORKERS = max(1, int(os.getenv("AURA_ENCODE_WORKERS", "1")))
+
+THUMBNAIL_SUFFIXES = ('.jpg', '.jpeg', '.png', '.webp')
+
+def build_manifest(folder: Path, analysis: dict = None):
+    """Everything /api/history shows for a project, from a single directory listing.
+
+    Stored in projects.manifest at completion (and refreshed when encodes or a
+    thumbnail land) so history never has to touch the filesystem.
+    """
+    files = {}
+    if folder.is_dir():
+        with os.scandir(folder) as it:
+            files = {e.name: e.stat().st_size for e in it if e.is_file()}
+    url = f"/stems/htdemucs/{folder.name}"
+    names = sorted(n[:-4] for n in files if n.endswith(".wav"))
+    master = ".wav"
+    if not names:  # Legacy projects were MP3 only
+        names = sorted(n[:-4] for n in files if n.endswith(".mp3"))
+        master = ".mp3"
+    stems, formats, sizes = {}, {}, {}
+    for name in names:
+        stems[name] = f"{url}/{name}{master}"
+        formats[name], sizes[name] = {}, {}
+        for suffix in (master,) + DELIVERY_SUFFIXES:
+            if f"{name}{suffix}" in files:
+                formats[name][suffix[1:]] = f"{url}/{name}{suffix}"
+                sizes[name][suffix[1:]] = files[f"{name}{suffix}"]
+    thumbnail = next((f"{url}/{n}" for n in sorted(files)
+                      if n.startswith("thumbnail.") and Path(n).suffix in THUMBNAIL_SUFFIXES), None)
+    analysis = analysis or {}
+    return {
+        "stems": stems,
+        "formats": formats,
+        "sizes": sizes,
+        "durations": {n: analysis[n]["duration"] for n in names if "duration" in analysis.get(n, {})},
+        "thumbnail": thumbnail,
+        "analysis": analysis or None,
+        "bytes": sum(files.values()),
+    }
+
+def refresh_manifest(folder: Path):
+    """Rebuild a stored manifest after files were added to the project (encodes, thumbnail)."""
+    row = DB.query_one("SELECT manifest FROM projects WHERE folder_path = ?", (folder.name,))
+    if not row:
+        return None
+    previous = json.loads(row[0]) if row[0] else {}
+    manifest = build_manifest(folder, previous.get("analysis"))
+    DB.execute("UPDATE projects SET manifest = ?, bytes = ? WHERE folder_path = ?",
+               (json.dumps(manifest), manifest["bytes"], folder.name))
+    return manifest
+
+def ffmpeg_binary():
+    """Path to ffmpeg (the bundled static build when available), or None."""
+    try:
+        import static_ffmpeg
+        static_ffmpeg.add_paths()
+    except Exception:
+        pass
+    return shutil.which("ffmpeg")
+
+def pending_encodes(manifest: dict):
+    """Delivery formats the encoder will still add to a fresh project ([] without ffmpeg)."""
+    if not manifest["formats"] or not ffmpeg_binary():
+        return []
+    return [fmt for fmt in DELIVERY_FORMATS if not all(fmt in f for f in manifest["formats"].values())]
+
+class StemEncoder:
+    """Background FLAC/Opus encodes, one ffmpeg process per stem (both outputs at once).
+
+    Given a job id, the finished encodes are published on the job's result
+    (formats, encoding=[]), so an open player can switch to them.
+    """
+
+    def __init__(self, workers: int = ENCODE_WORKERS):
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.encoded = 0
+        self.failed = 0
+        self.total_seconds = 0.0
+
+    def submit(self, folder: Path, job_id: str = None):
+        with self._lock:
+            if self._executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="aura-encode")
+            self.pending += 1
+        self._executor.submit(self._run, folder, job_id)
+
+    def _run(self, folder: Path, job_id: str = None):
+        try:
+            try:
+                self.encode(folder)
+            finally:
+                if job_id:  # Even after a failure: the job must stop waiting
+                    publish_encodes(job_id, folder)
+        except Exception as e:
+            print(f"ENCODE ERROR ({folder.name}): {e}")
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def encode(self, folder: Path):
+        ffmpeg = ffmpeg_binary()
+        if not ffmpeg:
+            print("ENCODE: ffmpeg not found, serving WAV only")
+            return
+        for wav in sorted(folder.glob("*.wav")):
+            cmd = [ffmpeg, "-nostdin", "-v", "error", "-y", "-threads", "1", "-i", str(wav)]
+            targets = []
+            for fmt, (muxer, args) in DELIVERY_FORMATS.items():
+                final = wav.with_suffix(f".{fmt}")
+                if final.exists():
+                    continue
+                # Written under a temp name so history never advertises a partial file
+                part = final.with_name(final.name + ".part")
+                cmd += args + ["-f", muxer, str(part)]
+                targets.append((part, final))
+            if not targets:
+                continue
+            started = time.time()
+            try:
+                subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            except subprocess.CalledProcessError as e:
+                for part, _ in targets:
+                    part.unlink(missing_ok=True)
+                with self._lock:
+                    self.failed += 1
+                print(f"ENCODE FAILED {wav.name}: {e.stderr.decode(errors='ignore').strip()[:200]}")
+                continue
+            if not folder.exists():  # Project deleted mid-encode
+                return
+            for part, final in targets:
+                part.replace(final)
+            with self._lock:
+                self.encoded += 1
+                self.total_seconds += time.time() - started
+        refresh_manifest(folder)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "formats": list(DELIVERY_FORMATS),
+                "workers": self.workers,
+                "pending": self.pending,
+                "encoded_stems": self.encoded,
+                "failed_stems": self.failed,
+                "avg_stem_seconds": round(self.total_seconds / self.encoded, 3) if self.encoded else None,
+            }
+
+STEM_ENCODER = StemEncoder()
+
+def publish_encodes(job_id: str, folder: Path):
+    """Put the formats that exist now on a completed job's result and tell its subscribers."""
+    job = JOB_STORE.get(job_id)
+    if not job or job["status"] != "completed" or not job["result"]:
+        return
+    row = DB.query_one("SELECT manifest FROM projects WHERE folder_path = ?", (folder.name,))
+    formats = json.loads(row[0])["formats"] if row and row[0] else build_manifest(folder)["formats"]
+    result = dict(job["result"], formats=formats, encoding=[])
+    JOB_STORE.update(job_id, result=result)
+    JOB_EVENTS.publish(job_id, {"job_id": job_id, "status": "completed", "progress": 100, "result": result})
+
+# --- STORAGE LIFECYCLE ---
+# Inputs are deleted as soon as a project's stems are committed (only the project
+# folder and the separation cache are ever read again), and failed jobs leave
+# nothing behind. Project folders can count against a per-user and a global
+# quota (both off unless the operator sets them); over quota,
+# least-recently-used projects are evicted. A background sweeper
+# reconciles the projects table with the disk, one bounded batch per tick.
+USER_QUOTA_BYTES = int(os.getenv("AURA_USER_QUOTA_MB", "0")) * 1024 * 1024  # 0 = unlimited
+STORAGE_QUOTA_BYTES = int(os.getenv("AURA_STORAGE_QUOTA_MB", "0")) * 1024 * 1024  # 0 = unlimited
+SWEEP_INTERVAL = int(os.getenv("AURA_SWEEP_INTERVAL", "300"))  # seconds; 0 disables the sweeper
+SWEEP_BATCH = int(os.getenv("AURA_SWEEP_BATCH", "200"))  # rows / directory entries per pass per tick
+SWEEP_GRACE = int(os.getenv("AURA_SWEEP_GRACE_HOURS", "6")) * 3600  # Never sweep anything younger
+ACCESS_RESOLUTION = 3600  # last_access is rewritten at most hourly per project
+LEGACY_OUTPUT_DIRS = ("htdemucs_6s",)
+
+def folder_bytes(folder: Path):
+    total = 0
+    with os.scandir(folder) as it:
+        for e in it:
+            if e.is_file(follow_symlinks=False):
+                total += e.stat().st_size
+    return total
+
+class StorageManager:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sweep_lock = threading.Lock()
+        self._row_cursor = 0  # Last projects.rowid checked
+        self._dir_entries = None  # Generators resumed across ticks
+        self._input_entries = None
+        self._thread = None
+        self.counts = collections.Counter()
+
+    def _count(self, key: str, n: int = 1):
+        with self._lock:
+            self.counts[key] += n
+
+    def release_inputs(self, internal_id: str):
+        """Delete every input file of a job (original upload, decoded .f32, yt-dlp leftovers)."""
+        for f in INPUT_DIR.glob(f"{internal_id}.*"):
+            try:
+                f.unlink()
+                self._count("inputs_removed")
+            except OSError:
+                pass
+
+    def discard_failed(self, internal_id: str):
+        """After a failed job: its inputs, and its output folder unless a project owns it."""
+        self.release_inputs(internal_id)
+        folder = OUTPUT_DIR / MODEL_NAME / internal_id
+        if folder.exists() and not DB.query_one("SELECT 1 FROM projects WHERE folder_path = ?", (internal_id,)):
+            shutil.rmtree(folder, ignore_errors=True)
+            self._count("failed_outputs_removed")
+
+    def touch(self, folder_name: str):
+        now = time.time()
+        DB.execute("UPDATE projects SET last_access = ? WHERE folder_path = ? AND (last_access IS NULL OR last_access < ?)",
+                   (now, folder_name, now - ACCESS_RESOLUTION))
+
+    def remove_project(self, project_id: str, folder_name: str):
+        DB.execute("DELETE FROM projects WHERE id = ?", (project_id,))
+        shutil.rmtree(OUTPUT_DIR / MODEL_NAME / folder_name, ignore_errors=True)
+        self.release_inputs(folder_name)
+
+    def usage(self, user_id: str = None):
+        if user_id:
+            return DB.query_one("SELECT COALESCE(SUM(bytes), 0) FROM projects WHERE user_id = ?", (user_id,))[0]
+        return DB.query_one("SELECT COALESCE(SUM(bytes), 0) FROM projects")[0]
+
+    def enforce_quotas(self, user_id: str, keep: str = None):
+        """Evict least-recently-used projects until the user (then the box) fits its quota.
+
+        `keep` (the project just created) is never evicted.
+        """
+        if USER_QUOTA_BYTES:
+            self._evict("user_id = ?", (user_id,), USER_QUOTA_BYTES, keep)
+        if STORAGE_QUOTA_BYTES:
+            self._evict("1 = 1", (), STORAGE_QUOTA_BYTES, keep)
+
+    def _evict(self, where: str, params: tuple, limit: int, keep: str):
+        used = DB.query_one(f"SELECT COALESCE(SUM(bytes), 0) FROM projects WHERE {where}", params)[0]
+        while used > limit:
+            row = DB.query_one(f"SELECT id, folder_path, COALESCE(bytes, 0) FROM projects WHERE {where} AND id != ? "
+                               "ORDER BY COALESCE(last_access, 0), created_at LIMIT 1", (*params, keep or ""))
+            if not row:
+                break
+            self.remove_project(row[0], row[1])
+            used -= row[2]
+            self._count("evicted")
+            self._count("evicted_bytes", row[2])
+            print(f"STORAGE: Evicted project {row[0]} ({row[2] // 1024} KiB, over quota)")
+
+    # Sweeper passes: each handles at most SWEEP_BATCH items and resumes where it left off
+    def _sweep_rows(self):
+        """projects -> disk: drop rows whose folder is gone, backfill missing sizes."""
+        rows = DB.query("SELECT rowid, id, folder_path, bytes FROM projects WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                        (self._row_cursor, SWEEP_BATCH))
+        self._row_cursor = rows[-1][0] if len(rows) == SWEEP_BATCH else 0
+        for rowid, project_id, folder_name, size in rows:
+            folder = OUTPUT_DIR / MODEL_NAME / folder_name
+            if folder.is_dir():
+                if size is None:
+                    DB.execute("UPDATE projects SET bytes = ? WHERE id = ?", (folder_bytes(folder), project_id))
+            elif not any((OUTPUT_DIR / d / folder_name).is_dir() for d in LEGACY_OUTPUT_DIRS):
+                DB.execute("DELETE FROM projects WHERE id = ?", (project_id,))
+                self._count("orphan_rows")
+
+    def _output_entries(self):
+        # Unregistered legacy folders are what /api/sync imports: never garbage
+        if (OUTPUT_DIR / MODEL_NAME).is_dir():
+            with os.scandir(OUTPUT_DIR / MODEL_NAME) as it:
+                yield from it
+
+    def _input_entries_gen(self):
+        with os.scandir(INPUT_DIR) as it:
+            yield from it
+
+    def _next_batch(self, attr: str, factory):
+        entries = getattr(self, attr) or factory()
+        batch = []
+        for entry in entries:
+            batch.append(entry)
+            if len(batch) >= SWEEP_BATCH:
+                setattr(self, attr, entries)
+                return batch
+        setattr(self, attr, None)  # Exhausted: start over next tick
+        return batch
+
+    def _sweep_dirs(self):
+        """disk -> projects: remove old output folders no project references."""
+        cutoff = time.time() - SWEEP_GRACE
+        for entry in self._next_batch("_dir_entries", self._output_entries):
+            try:
+                if not entry.is_dir() or entry.stat().st_mtime > cutoff:
+                    continue
+            except OSError:
+                continue
+            if not DB.query_one("SELECT 1 FROM projects WHERE folder_path = ?", (entry.name,)):
+                shutil.rmtree(entry.path, ignore_errors=True)
+                self._count("orphan_dirs")
+
+    def _sweep_inputs(self):
+        """Inputs older than the grace period that no unfinished job still needs."""
+        cutoff = time.time() - SWEEP_GRACE
+        needed = set()
+        for row in DB.query("SELECT payload FROM jobs WHERE status NOT IN (?, ?)", JOB_DONE_STATES):
+            payload = json.loads(row[0]) if row[0] else {}
+            if payload.get("input_path"):
+                needed.add(Path(payload["input_path"]).name)
+        for entry in self._next_batch("_input_entries", self._input_entries_gen):
+            try:
+                if not entry.is_file() or entry.name in needed or entry.stat().st_mtime > cutoff:
+                    continue
+                os.unlink(entry.path)
+                self._count("stale_inputs")
+            except OSError:
+                continue
+
+    def _sweep_thumbnails(self):
+        """YouTube thumbnail cache: drop entries unused for YOUTUBE_THUMB_MAX_AGE, then
+        least-recently-used ones until it fits in YOUTUBE_THUMB_CACHE_BYTES."""
+        if not YOUTUBE_THUMB_DIR.is_dir():
+            return
+        cutoff = time.time() - YOUTUBE_THUMB_MAX_AGE
+        entries = []
+        with os.scandir(YOUTUBE_THUMB_DIR) as it:
+            for entry in it:
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                if entry.name.startswith(".") and st.st_mtime > cutoff:
+                    continue  # Download in progress
+                if entry.is_file(follow_symlinks=False):
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in entries:
+            if mtime > cutoff and total <= YOUTUBE_THUMB_CACHE_BYTES:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+                self._count("thumbnails_evicted")
+            except OSError:
+                continue
+
+    def sweep_once(self):
+        with self._sweep_lock:
+            self._sweep_rows()
+            self._sweep_dirs()
+            self._sweep_inputs()
+            self._sweep_thumbnails()
+            self._count("sweeps")
+
+    def _run(self):
+        while True:
+            time.sleep(SWEEP_INTERVAL)
+            try:
+                self.sweep_once()
+            except Exception as e:
+                print(f"STORAGE: Sweep failed: {e}")
+
+    def start(self):
+        if SWEEP_INTERVAL > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="aura-sweeper", daemon=True)
+            self._thread.start()
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.counts)
+        return {"bytes": self.usage(), "user_quota_bytes": USER_QUOTA_BYTES or None,
+                "storage_quota_bytes": STORAGE_QUOTA_BYTES or None, **counts}
+
+STORAGE = StorageManager()
+
+# --- Core Logic Refactored ---
+def core_process_track(input_path: Path, original_name: str, user: dict, selection: dict = None,
+                       job_id: str = None, digest: str = None):
+    # 1. Run Demucs (High Quality V4.1) on the resident engine
+    internal_id = input_path.stem
+    created_folder = OUTPUT_DIR / MODEL_NAME / internal_id
+
+    # Identical input already separated (and polished)? Reuse its stems.
+    with stage("cache"):
+        cache_key = SEPARATION_CACHE.key_for(input_path, variant=output_variant(selection), digest=digest)
+        cached = SEPARATION_CACHE.restore(cache_key, created_folder)
+
+    if cached is not None:
+        timing = {"cache_hit": True}
+        analysis = cached.get("analysis") or {f.stem: {"silent": False} for f in created_folder.glob("*.wav")}
+    else:
+        try:
+            if job_id:  # Async jobs can publish a preview first
+                publish_preview(job_id, input_path, created_folder, selection)
+            stems, timing = ENGINE.separate(input_path, active_jobs=SCHEDULER.active_count())
+            # A. Smart Polish in memory, then a single write per stem
+            stems, samplerate = finish_stems(stems, selection, ENGINE.samplerate, timing)
+            # B. Silence/level analysis over the full signal, during write-out
+            analysis = write_stems(stems, created_folder, samplerate)
+            del stems
+        except Exception as e:
+            print(f"CORE ENGINE ERROR: {e}")
+            raise HTTPException(status_code=500, detail="Core Processing Failed")
+        SEPARATION_CACHE.store(cache_key, created_folder, meta={"analysis": analysis})
+
+    # 2. Verify Output
+    if not created_folder.exists():
+        print(f"CRITICAL: Expected output {created_folder} missing.")
+        raise HTTPException(status_code=500, detail="Processing Output Missing")
+
+    # 3. Smart Analysis (V5.0): silent stems were never written
+    final_stems = stem_urls(created_folder, analysis)
+    manifest = build_manifest(created_folder, analysis)
+
+    # 4. Save to DB
+    safe_human_name = Path(original_name).stem
+    with stage("db_write"), DB.connect() as conn:
+        conn.execute("UPDATE users SET credits = credits - 1 WHERE id = ?", (user["id"],))
+        insert_project(conn, internal_id, user["id"], safe_human_name, internal_id, manifest)
+    USER_CACHE.invalidate(user["id"])
+    STORAGE.release_inputs(internal_id)
+    STORAGE.enforce_quotas(user["id"], keep=internal_id)
+    drop_preview(created_folder)
+    if job_id is None:  # Async callers queue the encodes once the job is completed
+        STEM_ENCODER.submit(created_folder)
+
+    return {
+        "message": "Success",
+        "credits_left": user["credits"] - 1,
+        "stems": final_stems,
+        "formats": manifest["formats"],
+        "encoding": pending_encodes(manifest),
+        "analysis": analysis,
+        "project": {"id": internal_id, "name": safe_human_name},
+        "engine": timing
+    }
+
+@app.on_event("startup")
+async def startup_event():
+    print("MATCHBOX AUDIO ENGINE V4.2 - DNS PATCHED")
+    # Initialize DB (already done globally but good for hooks)
+    JOB_STORE.prune()
+    recover_jobs()
+    start_job_leases()
+    STORAGE.start()
+    if WARMUP in ("model", "full"):
+        threading.Thread(target=ENGINE.warmup, args=(WARMUP == "full",), name="aura-warmup", daemon=True).start()
+
+@app.post("/api/process")
+async def process_audio(
+    file: UploadFile = File(...),
+    stems: Optional[str] = Form(None),
+    two_stems: Optional[str] = Form(None),
+    user: dict = Depends(get_current_user)
+):
+    if user["credits"] < 1:
+        raise HTTPException(status_code=402, detail="Insufficient credits")
+    selection = parse_stem_selection(stems, two_stems)
+
+    file_ext = Path(file.filename).suffix or ".wav"
+    internal_id = str(uuid.uuid4())
+    temp_filename = f"{internal_id}{file_ext}"
+    input_path = INPUT_DIR / temp_filename
+    
+    with stage("upload"), open(input_path, "wb") as buffer:
+        shutil.copyfileobj(file.file, buffer)
+    validate_upload(input_path)
+        
+    # Create a wrapper to run the sync processing in a thread
+    from starlette.concurrency import run_in_threadpool
+    try:
+        return await run_in_threadpool(core_process_track, input_path, file.filename, user, selection)
+    except Exception:
+        await run_in_threadpool(STORAGE.discard_failed, internal_id)
+        raise
+
+
+# --- Persistent Job Store ---
+# Jobs live in SQLite so they survive restarts and are visible to every uvicorn worker.
+JOB_TTL_SECONDS = int(os.environ.get("AURA_JOB_TTL_HOURS", "24")) * 3600
+JOB_DONE_STATES = ("completed", "failed")
+# Identifies this process as the owner of the jobs it queued (crash recovery)
+INSTANCE_ID = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+# Owners renew updated_at on their unfinished jobs every JOB_LEASE_SECONDS / 4;
+# a job not renewed for JOB_LEASE_SECONDS belongs to a dead process. (PIDs are
+# no proof of life: after a container restart they are handed out again.)
+JOB_LEASE_SECONDS = int(os.environ.get("AURA_JOB_LEASE_SECONDS", "60"))
+
+class JobStore:
+    PRUNE_INTERVAL = 600
+
+    def __init__(self, db: SQLiteDatabase, ttl_seconds: int, lease_seconds: int = JOB_LEASE_SECONDS):
+        self.db = db
+        self.ttl_seconds = ttl_seconds
+        self.lease_seconds = lease_seconds
+        self._last_prune = 0.0
+
+    @staticmethod
+    def _to_job(row):
+        return {
+            "job_id": row["id"],
+            "status": row["status"],
+            "progress": row["progress"],
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "start_time": row["start_time"],
+            "updated_at": row["updated_at"],
+            "owner": row["owner"],
+            "user_id": row["user_id"],
+            "name": row["name"],
+            "kind": row["kind"],
+            "payload": json.loads(row["payload"]) if row["payload"] else {},
+            "timings": json.loads(row["timings"]) if row["timings"] else {},
+        }
+
+    def create(self, job_id: str, user: dict, name: str, kind: str, payload: dict, timings: dict = None):
+        now = time.time()
+        self.db.execute(
+            "INSERT INTO jobs (id, owner, user_id, name, status, progress, kind, payload, instance, start_time, updated_at, timings) "
+            "VALUES (?, ?, ?, ?, 'queued', 0, ?, ?, ?, ?, ?, ?)",
+            (job_id, user["username"], user["id"], name, kind, json.dumps(payload), INSTANCE_ID, now, now,
+             json.dumps(timings) if timings else None))
+        if now - self._last_prune > self.PRUNE_INTERVAL:
+            self.prune()
+
+    def get(self, job_id: str):
+        row = self.db.query_one("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        return self._to_job(row) if row else None
+
+    def get_many(self, job_ids):
+        """Jobs by id, in the given order (missing ones skipped)."""
+        if not job_ids:
+            return []
+        rows = self.db.query(f"SELECT * FROM jobs WHERE id IN ({', '.join('?' * len(job_ids))})", tuple(job_ids))
+        by_id = {row["id"]: self._to_job(row) for row in rows}
+        return [by_id[j] for j in job_ids if j in by_id]
+
+    def update(self, job_id: str, **fields):
+        for key in ("result", "timings", "payload"):
+            if key in fields:
+                fields[key] = json.dumps(fields[key])
+        fields["updated_at"] = time.time()
+        cols = ", ".join(f"{k} = ?" for k in fields)
+        self.db.execute(f"UPDATE jobs SET {cols} WHERE id = ?", (*fields.values(), job_id))
+
+    def delete(self, job_id: str):
+        self.db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def list_for_owner(self, owner: str, limit: int = 50):
+        rows = self.db.query("SELECT * FROM jobs WHERE owner = ? ORDER BY start_time DESC LIMIT ?",
+                             (owner, limit))
+        return [self._to_job(r) for r in rows]
+
+    def count(self):
+        return self.db.query_one("SELECT COUNT(*) FROM jobs")[0]
+
+    def prune(self):
+        """Drop finished jobs older than the TTL."""
+        self._last_prune = time.time()
+        return self.db.execute("DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                               (*JOB_DONE_STATES, time.time() - self.ttl_seconds))
+
+    def heartbeat(self):
+        """Renew the lease on every unfinished job this process owns."""
+        return self.db.execute("UPDATE jobs SET updated_at = ? WHERE instance = ? AND status NOT IN (?, ?)",
+                               (time.time(), INSTANCE_ID, *JOB_DONE_STATES))
+
+    def claim_orphans(self):
+        """Take ownership of unfinished jobs whose lease ran out (crash/restart).
+
+        Jobs of live sibling workers are renewed by their heartbeat and left
+        alone; the UPDATE guard makes the claim atomic when several workers
+        boot at once, and loses to a renewal that lands in between.
+        """
+        claimed = []
+        with self.db.connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE status NOT IN (?, ?) AND instance IS NOT ? "
+                "AND (updated_at IS NULL OR updated_at < ?)",
+                (*JOB_DONE_STATES, INSTANCE_ID, time.time() - self.lease_seconds)).fetchall()
+            for row in rows:
+                cur = conn.execute("UPDATE jobs SET instance = ?, updated_at = ? "
+                                   "WHERE id = ? AND instance IS ? AND updated_at IS ?",
+                                   (INSTANCE_ID, time.time(), row["id"], row["instance"], row["updated_at"]))
+                if cur.rowcount:
+                    claimed.append(self._to_job(row))
+        return claimed
+
+    def clear(self):
+        self.db.execute("DELETE FROM jobs")
+
+JOB_STORE = JobStore(DB, JOB_TTL_SECONDS, JOB_LEASE_SECONDS)
+
+# --- Job Scheduler ---
+# Fixed worker pool in front of the separation pipeline, fed by a bounded
+# per-user fair queue. Without it a burst of uploads started one Demucs run per
+# request and thrashed small boxes.
+JOB_RAM_MB = int(os.environ.get("AURA_JOB_RAM_MB", "3072"))  # Rough htdemucs peak per job
+
+def default_worker_count():
+    cores = os.cpu_count() or 1
+    try:
+        ram_mb = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return max(1, cores // max(TORCH_THREADS, 1))
+    by_cpu = cores // max(TORCH_THREADS, 1)
+    by_ram = ram_mb // JOB_RAM_MB
+    return max(1, min(by_cpu, by_ram))
+
+MAX_WORKERS = int(os.environ.get("AURA_WORKERS", "0")) or default_worker_count()
+MAX_QUEUE = int(os.environ.get("AURA_QUEUE_SIZE", "20"))
+QUEUE_RETRY_AFTER = 30  # seconds, sent as Retry-After when the queue is full
+
+# Scheduling terms per plan (/api/subscribe sells pro and studio; the seeded
+# admin is 'unlimited'). Plans missing from a table get the free terms.
+#   weight      - share of dispatches while several users have jobs waiting
+#   max_active  - jobs of one user running at once (0 = no cap)
+#   max_queued  - jobs of one user waiting at once (0 = only the global MAX_QUEUE)
+DEFAULT_PLAN = "free"
+
+def parse_plan_table(raw: str):
+    """'free=1,pro=4' -> {'free': 1.0, 'pro': 4.0}"""
+    table = {}
+    for part in raw.split(","):
+        name, _, value = part.partition("=")
+        if name.strip() and value.strip():
+            table[name.strip()] = float(value)
+    return table
+
+PLAN_WEIGHTS = parse_plan_table(os.getenv("AURA_PLAN_WEIGHTS", "free=1,pro=4,studio=8,unlimited=8"))
+PLAN_MAX_ACTIVE = parse_plan_table(os.getenv("AURA_PLAN_MAX_ACTIVE", "free=1,pro=2,studio=4,unlimited=0"))
+PLAN_MAX_QUEUED = parse_plan_table(os.getenv("AURA_PLAN_MAX_QUEUED", "free=5,pro=10,studio=20,unlimited=0"))
+WAIT_WINDOW = 1000  # Recent queue waits kept per plan for the admin percentiles
+
+def plan_terms(plan: str):
+    """(weight, max_active, max_queued) for `plan`."""
+    def term(table):
+        return table.get(plan, table.get(DEFAULT_PLAN, 0))
+    return max(term(PLAN_WEIGHTS), 0.01), int(term(PLAN_MAX_ACTIVE)), int(term(PLAN_MAX_QUEUED))
+
+def wait_percentiles(waits):
+    if not waits:
+        return {"n": 0}
+    ordered = sorted(waits)
+    def pick(p):
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))], 3)
+    return {"n": len(ordered), "p50": pick(50), "p90": pick(90), "p99": pick(99), "max": round(ordered[-1], 3)}
+
+class QueueFull(Exception):
+    def __init__(self, depth):
+        super().__init__(f"Queue full ({depth} waiting)")
+        self.depth = depth
+
+class UserQueueFull(QueueFull):
+    """The submitting user already has their plan's share of the queue."""
+
+    def __init__(self, depth, limit):
+        super().__init__(depth)
+        self.limit = limit
+
+# tracks: separations the job stands for (queue share and fair-share cost; > 1 for batch parents)
+# slots:  separations it runs at once (counted against the owner's max_active)
+QueuedJob = collections.namedtuple("QueuedJob", "seq job_id fn args owner plan enqueued tracks slots")
+
+class JobScheduler:
+    """Weighted fair queuing across users.
+
+    Each user has a FIFO of waiting jobs and a virtual clock. A worker takes the
+    head job of the eligible user (whose slots still fit under their plan's
+    max_active) whose clock plus tracks/weight is smallest, then advances that
+    clock by tracks/weight: with everyone backlogged a studio user (8) gets eight
+    tracks per free user's one, and twenty tracks from one account take turns
+    with everybody else instead of running back to back. A user whose queue was
+    empty starts at the current clock, so idle time does not bank credit.
+    """
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._queues = {}   # owner -> deque of QueuedJob
+        self._vtime = {}    # owner -> virtual clock
+        self._weight = {}   # owner -> weight of their latest plan
+        self._running = {}  # owner -> slots in use
+        self._active = {}   # job_id -> QueuedJob
+        self._clock = 0.0
+        self._seq = 0
+        self._waits = {}    # plan -> recent queue waits (seconds)
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def _ensure_started(self):
+        # Caller holds self._cond
+        if self._threads:
+            return
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"aura-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _depth(self):
+        return sum(len(q) for q in self._queues.values())
+
+    def _queued_tracks(self, owner: str):
+        return sum(entry.tracks for entry in self._queues.get(owner, ()))
+
+    def submit(self, job_id: str, fn, *args, owner: str = "", plan: str = DEFAULT_PLAN,
+               tracks: int = 1, slots: int = 1, check_user_cap: bool = True):
+        """Queue `fn(*args)` for user `owner` on `plan`.
+
+        Returns the 1-based queue position or raises QueueFull/UserQueueFull.
+        The caller passes the owner from the user it already holds, so nothing
+        here touches the store (submit runs on the event loop for async handlers).
+        Recovered jobs were admitted before the restart and skip the per-user cap.
+        """
+        plan = plan or DEFAULT_PLAN
+        weight, _, max_queued = plan_terms(plan)
+        with self._cond:
+            depth = self._depth()
+            if depth >= self.max_queue:
+                raise QueueFull(depth)
+            queued = self._queued_tracks(owner)
+            if check_user_cap and max_queued and queued + tracks > max_queued:
+                raise UserQueueFull(queued, max_queued)
+            queue = self._queues.get(owner)
+            self._ensure_started()
+            if queue is None:
+                queue = self._queues[owner] = collections.deque()
+                self._vtime[owner] = max(self._vtime.get(owner, 0.0), self._clock)
+            self._weight[owner] = weight
+            self._seq += 1
+            queue.append(QueuedJob(self._seq, job_id, fn, args, owner, plan, time.time(), max(tracks, 1), max(slots, 1)))
+            self._cond.notify()
+            return self._order().index(job_id) + 1
+
+    def is_full(self, owner: str = None, plan: str = None, tracks: int = 1):
+        """Global queue full, or (with `owner`) no room left in that user's share for `tracks` more."""
+        with self._cond:
+            if self._depth() >= self.max_queue:
+                return True
+            if owner is None:
+                return False
+            max_queued = plan_terms(plan or DEFAULT_PLAN)[2]
+            return bool(max_queued) and self._queued_tracks(owner) + tracks > max_queued
+
+    def queued_for(self, owner: str):
+        with self._cond:
+            return self._queued_tracks(owner)
+
+    def depth(self):
+        with self._cond:
+            return self._depth()
+
+    def active_count(self):
+        with self._cond:
+            return len(self._active)
+
+    def position(self, job_id: str):
+        """1-based predicted dispatch position, None once picked up (or unknown).
+
+        The prediction replays the fair-share order; it does not know when
+        running jobs will finish, so per-user caps are ignored.
+        """
+        with self._cond:
+            order = self._order()
+        return order.index(job_id) + 1 if job_id in order else None
+
+    def _order(self):
+        # Caller holds self._cond. Dispatch order if nothing were capped.
+        vtime = dict(self._vtime)
+        heads = {owner: 0 for owner in self._queues}
+        order = []
+        while heads:
+            owner = min(heads, key=lambda o: (vtime[o] + self._queues[o][heads[o]].tracks / self._weight[o],
+                                              self._queues[o][heads[o]].seq))
+            entry = self._queues[owner][heads[owner]]
+            order.append(entry.job_id)
+            vtime[owner] += entry.tracks / self._weight[owner]
+            heads[owner] += 1
+            if heads[owner] == len(self._queues[owner]):
+                del heads[owner]
+        return order
+
+    def _next(self):
+        # Caller holds self._cond
+        best = None
+        for owner, queue in self._queues.items():
+            head = queue[0]
+            max_active = plan_terms(head.plan)[1]
+            # A job wider than the cap (plan changed since) still runs, alone
+            if max_active and self._running.get(owner, 0) + min(head.slots, max_active) > max_active:
+                continue
+            key = (self._vtime[owner] + head.tracks / self._weight[owner], head.seq)
+            if best is None or key < best[0]:
+                best = (key, owner)
+        if best is None:
+            return None
+        owner = best[1]
+        entry = self._queues[owner].popleft()
+        if not self._queues[owner]:
+            del self._queues[owner]
+        self._clock = max(self._clock, self._vtime[owner])
+        self._vtime[owner] += entry.tracks / self._weight[owner]
+        self._running[owner] = self._running.get(owner, 0) + entry.slots
+        self._active[entry.job_id] = entry
+        return entry
+
+    def _finish(self, entry: QueuedJob):
+        # Caller holds self._cond
+        self._active.pop(entry.job_id, None)
+        self._running[entry.owner] -= entry.slots
+        if not self._running[entry.owner]:
+            del self._running[entry.owner]
+            if entry.owner not in self._queues:
+                self._vtime.pop(entry.owner, None)
+                self._weight.pop(entry.owner, None)
+        self._cond.notify_all()  # A capped user may be eligible again
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                entry = self._next()
+                while entry is None:
+                    self._cond.wait()
+                    entry = self._next()
+                waited = max(time.time() - entry.enqueued, 0.0)
+                self._waits.setdefault(entry.plan, collections.deque(maxlen=WAIT_WINDOW)).append(waited)
+            QUEUE_WAIT_SECONDS.observe(waited, plan=entry.plan)
+            job_id = entry.job_id
+            job = JOB_STORE.get(job_id)
+            ctx = begin_job_metrics(job) if job else None
+            try:
+                entry.fn(*entry.args)
+            except Exception as e:
+                # Pipelines record their own failures; this only guards the worker thread
+                print(f"Worker Error ({job_id}): {e}")
+            finally:
+                if ctx:
+                    end_job_metrics(ctx)
+                with self._cond:
+                    self._finish(entry)
+
+    def stats(self):
+        with self._cond:
+            plans = {}
+            for plan in set(PLAN_WEIGHTS) | set(self._waits):
+                weight, max_active, max_queued = plan_terms(plan)
+                plans[plan] = {"weight": weight, "max_active": max_active, "max_queued": max_queued,
+                               "queued": 0, "active": 0, "queue_wait": wait_percentiles(self._waits.get(plan))}
+            for queue in self._queues.values():
+                for entry in queue:
+                    plans.setdefault(entry.plan, {"queued": 0, "active": 0})["queued"] += 1
+            for entry in self._active.values():
+                plans.setdefault(entry.plan, {"queued": 0, "active": 0})["active"] += 1
+            return {"workers": self.workers, "max_queue": self.max_queue, "queued": self._depth(),
+                    "active": len(self._active), "users_waiting": len(self._queues), "plans": plans}
+
+SCHEDULER = JobScheduler(MAX_WORKERS, MAX_QUEUE)
+
+def queue_full_error(depth: int):
+    return HTTPException(
+        status_code=503,
+        detail={
+            "message": "Server busy: the processing queue is full. Please retry shortly.",
+            "queue_depth": depth,
+            "queue_position": depth + 1,
+        },
+        headers={"Retry-After": str(QUEUE_RETRY_AFTER)},
+    )
+
+def user_queue_full_error(queued: int, limit: int):
+    return HTTPException(
+        status_code=429,
+        detail={
+            "message": f"Your plan allows {limit} tracks waiting at once and you already have {queued}. "
+                       "Wait for some to start, send fewer tracks or upgrade your plan.",
+            "queued": queued,
+            "limit": limit,
+        },
+        headers={"Retry-After": str(QUEUE_RETRY_AFTER)},
+    )
+
+def ensure_queue_capacity(user: dict = None, tracks: int = 1):
+    # Cheap pre-check so we don't download/copy inputs we can't schedule
+    if SCHEDULER.is_full():
+        raise queue_full_error(SCHEDULER.depth())
+    if user and SCHEDULER.is_full(user["id"], user.get("plan"), tracks):
+        raise user_queue_full_error(SCHEDULER.queued_for(user["id"]), plan_terms(user.get("plan") or DEFAULT_PLAN)[2])
+
+def enqueue_job(job_id: str, fn, *args, user: dict, tracks: int = 1, slots: int = 1):
+    try:
+        position = SCHEDULER.submit(job_id, fn, *args, owner=user["id"], plan=user.get("plan"),
+                                    tracks=tracks, slots=slots)
+    except UserQueueFull as e:
+        JOB_STORE.delete(job_id)
+        raise user_queue_full_error(e.depth, e.limit)
+    except QueueFull as e:
+        JOB_STORE.delete(job_id)
+        raise queue_full_error(e.depth)
+    return {"job_id": job_id, "queue_position": position, "queue_depth": SCHEDULER.depth()}
+
+def recover_jobs():
+    """Re-queue (or fail) jobs left unfinished by a crashed or restarted process."""
+    # Batch children first: they wait for their parent, which re-runs (or fails) them
+    for job in sorted(JOB_STORE.claim_orphans(), key=lambda j: not j["payload"].get("parent")):
+        jid, kind, payload = job["job_id"], job["kind"], job["payload"]
+        user = get_user_compat(job["user_id"]) if job["user_id"] else None
+        input_path = Path(payload["input_path"]) if payload.get("input_path") else None
+        selection = payload.get("selection")
+
+        if payload.get("parent"):
+            update_job(jid, "queued", 0)
+            continue
+        shape = {}
+        if user and kind == "batch":
+            fn, args = run_batch_job, (jid, user)
+            shape = batch_shape(user, len(payload.get("children") or []) or payload.get("max_tracks") or 1)
+        elif user and kind == "youtube":
+            fn, args = run_youtube_job, (jid, payload["url"], user, selection)
+        elif user and kind == "remote" and input_path and input_path.exists():
+            fn, args = run_separation_pipeline, (jid, input_path, payload["title"], user, None, selection)
+        elif user and kind == "remote":
+            # Download never finished: back to the download stage, not a scheduler slot
+            update_job(jid, "queued", 0)
+            REMOTE_FETCHER.submit(jid, payload["url"], payload["title"], user, selection)
+            print(f"RECOVERY: Re-fetching job {jid} ({kind})")
+            continue
+        elif user and kind == "file" and input_path and input_path.exists():
+            fn, args = run_file_job, (jid, input_path, payload["title"], user, selection, payload.get("digest"))
+        elif user and kind == "separation" and input_path and input_path.exists():
+            fn, args = run_separation_pipeline, (jid, input_path, payload["title"], user, None, selection)
+        else:
+            fail_recovered(job)
+            continue
+
+        update_job(jid, "queued", 0)
+        try:
+            SCHEDULER.submit(jid, fn, *args, owner=job["user_id"], plan=user.get("plan"), check_user_cap=False,
+                             **shape)
+            print(f"RECOVERY: Re-queued job {jid} ({kind})")
+        except QueueFull:
+            fail_recovered(job)
+
+_LEASE_THREAD = None
+
+def _renew_leases():
+    # Keep our jobs' leases fresh and pick up ones a dead process left behind
+    while True:
+        time.sleep(JOB_LEASE_SECONDS / 4)
+        try:
+            JOB_STORE.heartbeat()
+            recover_jobs()
+        except Exception as e:
+            print(f"RECOVERY: Lease renewal failed: {e}")
+
+def start_job_leases():
+    global _LEASE_THREAD
+    if JOB_LEASE_SECONDS > 0 and _LEASE_THREAD is None:
+        _LEASE_THREAD = threading.Thread(target=_renew_leases, name="aura-leases", daemon=True)
+        _LEASE_THREAD.start()
+
+def fail_recovered(job: dict):
+    fail_job(job["job_id"], "Interrupted by server restart")
+    children = [c["job_id"] for c in job["payload"].get("children") or []]
+    for child in JOB_STORE.get_many(children):
+        if child["status"] not in JOB_DONE_STATES:
+            fail_job(child["job_id"], "Interrupted by server restart")
+
+# --- Job Event Bus (push progress to SSE subscribers) ---
+class JobEventBus:
+    """In-process fan-out of job transitions with a short per-job replay log.
+
+    Event ids are per-job sequence numbers, so a reconnecting EventSource can
+    resume from Last-Event-ID. Subscribers are asyncio queues fed thread-safely
+    from the worker threads that call update_job.
+    """
+    def __init__(self, max_jobs=1000, history=64):
+        self.max_jobs = max_jobs
+        self.history = history
+        self._lock = threading.Lock()
+        self._log = collections.OrderedDict()  # job_id -> (last_seq, deque[(seq, event)])
+        self._subscribers = {}  # job_id -> set[(loop, asyncio.Queue)]
+
+    def publish(self, job_id: str, event: dict):
+        with self._lock:
+            seq, log = self._log.pop(job_id, (0, collections.deque(maxlen=self.history)))
+            seq += 1
+            log.append((seq, event))
+            self._log[job_id] = (seq, log)
+            while len(self._log) > self.max_jobs:
+                self._log.popitem(last=False)
+            subscribers = list(self._subscribers.get(job_id, ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(queue.put_nowait, (seq, event))
+
+    def subscribe(self, job_id: str):
+        queue = asyncio.Queue()
+        entry = (asyncio.get_running_loop(), queue)
+        with self._lock:
+            self._subscribers.setdefault(job_id, set()).add(entry)
+        return entry
+
+    def unsubscribe(self, job_id: str, entry):
+        with self._lock:
+            subs = self._subscribers.get(job_id)
+            if subs:
+                subs.discard(entry)
+                if not subs:
+                    del self._subscribers[job_id]
+
+    def last_seq(self, job_id: str):
+        with self._lock:
+            return self._log.get(job_id, (0, None))[0]
+
+    def replay(self, job_id: str, after_seq: int):
+        """Events newer than `after_seq`, or None if the log can't cover the gap."""
+        with self._lock:
+            seq, log = self._log.get(job_id, (0, None))
+            if not log or after_seq > seq or log[0][0] > after_seq + 1:
+                return None
+            return [(s, e) for s, e in log if s > after_seq]
+
+JOB_EVENTS = JobEventBus()
+SSE_HEARTBEAT_SECONDS = 15
+
+def update_job(jid, status, progress=0, preview=None):
+    """Progress transition; `preview` publishes a partial result while the job keeps running."""
+    if preview is None:
+        JOB_STORE.update(jid, status=status, progress=progress)
+        JOB_EVENTS.publish(jid, {"job_id": jid, "status": status, "progress": progress})
+        return
+    JOB_STORE.update(jid, status=status, progress=progress, result={"preview": preview})
+    JOB_EVENTS.publish(jid, {"job_id": jid, "status": status, "progress": progress, "preview": preview})
+
+def _finish_fields(jid, status):
+    ctx = current_job()
+    if ctx is None or ctx.job_id != jid:
+        return {}
+    ctx.status = status
+    timings = dict(ctx.stages, total=round(time.time() - ctx.created, 4))
+    if status == "completed":
+        mark_first_audio()
+    if ctx.first_audio is not None:
+        timings["first_audio"] = ctx.first_audio
+    return {"timings": timings}
+
+def complete_job(jid, result):
+    JOB_STORE.update(jid, status="completed", progress=100, result=result, **_finish_fields(jid, "completed"))
+    JOB_EVENTS.publish(jid, {"job_id": jid, "status": "completed", "progress": 100, "result": result})
+
+def fail_job(jid, error):
+    JOB_STORE.update(jid, status="failed", error=str(error), **_finish_fields(jid, "failed"))
+    JOB_EVENTS.publish(jid, {"job_id": jid, "status": "failed", "error": str(error)})
+
+# --- PREVIEW-FIRST ---
+# On a cache miss the opening PREVIEW_SECONDS are separated on their own first
+# (decode stops there too) and published on the still-running job as
+# result.preview: 16-bit WAVs under <project>/preview/ the player can audition
+# while the full-quality pass runs. The completed result replaces it and the
+# preview files are dropped once the project is committed.
+PREVIEW_SECONDS = float(os.getenv("AURA_PREVIEW_SECONDS", "30"))  # 0 disables previews
+PREVIEW_MIN_TRACK_SECONDS = 2 * PREVIEW_SECONDS  # Shorter tracks: the full pass is almost as quick
+PREVIEW_DIR_NAME = "preview"
+
+def audio_seconds(path: Path):
+    """Track length from the container header (or raw PCM size), None if unknown."""
+    if path.suffix == DECODED_SUFFIX:
+        return path.stat().st_size / (4 * DECODE_CHANNELS * DECODE_SAMPLERATE)
+    try:
+        import soundfile as sf
+        return sf.info(str(path)).duration
+    except Exception:
+        return None  # e.g. MP3/M4A on an older libsndfile
+
+def publish_preview(job_id: str, input_path: Path, folder: Path, selection: dict = None):
+    """Separate, write and publish the opening of the track. Never fails the job."""
+    ctx = current_job()
+    if PREVIEW_SECONDS <= 0 or (ctx is not None and ctx.batcher is not None):
+        return None  # Album tracks go for throughput, not first audio
+    length = audio_seconds(input_path)
+    if length is not None and length < PREVIEW_MIN_TRACK_SECONDS:
+        return None
+    try:
+        import soundfile as sf
+        update_job(job_id, "Preparing Preview...", 17)
+        stems, _ = ENGINE.separate(input_path, active_jobs=SCHEDULER.active_count(), max_seconds=PREVIEW_SECONDS)
+        stems = select_stems(stems, selection)
+        out = folder / PREVIEW_DIR_NAME
+        out.mkdir(parents=True, exist_ok=True)
+        urls, seconds = {}, 0.0
+        with stage("preview_write"):
+            for name, wav in stems.items():
+                peak = float(wav.abs().max()) if wav.numel() else 0.0
+                if peak <= SILENCE_PEAK:
+                    continue
+                if peak > 1.0:
+                    wav = wav / (1.01 * peak)
+                sf.write(str(out / f"{name}.wav"), wav.t().numpy(), ENGINE.samplerate, subtype="PCM_16")
+                urls[name] = f"/stems/htdemucs/{folder.name}/{PREVIEW_DIR_NAME}/{name}.wav"
+                seconds = wav.shape[-1] / ENGINE.samplerate
+        if not urls:
+            return None
+        preview = {"stems": urls, "seconds": round(seconds, 3)}
+        update_job(job_id, "Preview Ready - Finishing Full Quality...", 20, preview=preview)
+        mark_first_audio()
+        return preview
+    except Exception as e:
+        print(f"PREVIEW failed for {job_id}: {e}")
+        return None
+
+def drop_preview(folder: Path):
+    shutil.rmtree(folder / PREVIEW_DIR_NAME, ignore_errors=True)
+
+# SHARED PIPELINE: Runs inside a background thread
+def run_separation_pipeline(job_id: str, input_path: Path, meta_title: str, user: dict, cache_key: str = None,
+                            selection: dict = None, cached: dict = None):
+    """Separate (or restore from cache), record the project and complete the job.
+
+    Returns the job result, or None if the job failed. A known `cache_key` (of the
+    input, without the stem selection) skips hashing the input, which then only
+    has to exist on a cache miss. `cached` is the metadata of an entry the caller
+    already restored into the output folder.
+    """
+    try:
+        update_job(job_id, "Initializing Neural Engine...", 10)
+
+        # 1. Run Demucs on the resident engine (model is loaded once per process)
+        internal_id = input_path.stem
+        created_folder = OUTPUT_DIR / MODEL_NAME / internal_id
+
+        def on_progress(done, total):
+            p = int(done * 100 / max(total, 1))
+            # Map 0-100 of separation to 20-90 of total job
+            # Separation is the bulk of work.
+            scaled = 20 + int(p * 0.7)
+            update_job(job_id, f"Separating Stems ({p}%)", scaled)
+
+        # Identical audio separated before? Link the cached stems instead.
+        if cached is None:
+            update_job(job_id, "Checking Library...", 15)
+            with stage("cache"):
+                cache_key = SEPARATION_CACHE.with_variant(cache_key or SEPARATION_CACHE.key_for(input_path),
+                                                          output_variant(selection))
+                cached = SEPARATION_CACHE.restore(cache_key, created_folder)
+        if cached is None and not input_path.exists():
+            raise FileNotFoundError("Source audio is no longer available")
+
+        if cached is not None:
+            timing = {"cache_hit": True}
+            analysis = cached.get("analysis") or {f.stem: {"silent": False} for f in created_folder.glob("*.wav")}
+            update_job(job_id, "Found identical track, reusing stems...", 95)
+        else:
+            publish_preview(job_id, input_path, created_folder, selection)
+            update_job(job_id, "Separating Stems (0%)", 20)
+            stems, timing = ENGINE.separate(input_path, progress=on_progress,
+                                            active_jobs=SCHEDULER.active_count())
+            stems, samplerate = finish_stems(stems, selection, ENGINE.samplerate, timing)
+
+            update_job(job_id, "Analyzing & Writing Stems...", 95)
+
+            # 2. Write Output (silence/level analysis over the full signal on the way)
+            analysis = write_stems(stems, created_folder, samplerate)
+            del stems
+            SEPARATION_CACHE.store(cache_key, created_folder, meta={"analysis": analysis})
+
+        # 3. Smart Analysis: silent stems were never written
+        final_stems = stem_urls(created_folder, analysis)
+        manifest = build_manifest(created_folder, analysis)
+
+        # 4. Save DB
+        safe_human_name = Path(meta_title).stem
+        with stage("db_write"):
+            deduct_credit(user["id"])
+            with DB.connect() as conn:
+                insert_project(conn, internal_id, user["id"], safe_human_name, internal_id, manifest)
+        STORAGE.release_inputs(internal_id)
+        STORAGE.enforce_quotas(user["id"], keep=internal_id)
+        drop_preview(created_folder)
+
+        result = {
+            "message": "Success",
+            "credits_left": user["credits"] - 1,
+            "stems": final_stems,
+            "formats": manifest["formats"],
+            "encoding": pending_encodes(manifest),
+            "analysis": analysis,
+            "project": {"id": internal_id, "name": safe_human_name},
+            "engine": timing
+        }
+        
+        complete_job(job_id, result)
+        # Preview/lossless encodes happen after the job is already "completed"
+        STEM_ENCODER.submit(created_folder, job_id)
+        return result
+        
+    except Exception as e:
+        print(f"Pipeline Error: {e}")
+        STORAGE.discard_failed(input_path.stem)
+        fail_job(job_id, e)
+        return None
+
+def run_file_job(jid, path, fname, usr, selection=None, digest=None):
+    try:
+        update_job(jid, "Processing Audio...", 10)
+        res = core_process_track(path, fname, usr, selection, job_id=jid, digest=digest)
+        complete_job(jid, res)
+        STEM_ENCODER.submit(OUTPUT_DIR / MODEL_NAME / path.stem, jid)
+    except Exception as e:
+        STORAGE.discard_failed(path.stem)
+        fail_job(jid, e)
+
+# --- REMOTE FILE PROCESSING (FIREBASE) ---
+class RemoteFileRequest(BaseModel):
+    url: str
+    filename: str
+    stems: Optional[str] = None
+    two_stems: Optional[str] = None
+
+# Downloads run as the job's own stage on RemoteFetcher's I/O pool (never in the
+# request handler or a scheduler slot), over one shared keep-alive pool. One retry layer per failure kind: the adapter
+# retries 5xx/429 responses, fetch_to_file retries (and resumes) dropped or
+# refused connections.
+FETCH_CHUNK = 256 * 1024  # Resume granularity after a dropped connection
+FETCH_TIMEOUT = (10, 60)  # (connect, read between chunks) seconds
+FETCH_ATTEMPTS = 4
+FETCH_BACKOFF = 1.0  # seconds, doubled per attempt
+FETCH_WORKERS = max(1, int(os.getenv("AURA_FETCH_WORKERS", "4")))  # Concurrent remote downloads
+
+_http = None
+_http_lock = threading.Lock()
+
+def http_session():
+    """Process-wide requests.Session (connection reuse + urllib3 retry/backoff on error statuses)."""
+    global _http
+    with _http_lock:
+        if _http is None:
+            install_network_patches()
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+            # connect/read=0: connection errors surface at once to fetch_to_file's resume loop
+            retry = Retry(total=FETCH_ATTEMPTS - 1, connect=0, read=0, other=0, backoff_factor=FETCH_BACKOFF,
+                          status_forcelist=(429, 500, 502, 503, 504), allowed_methods=("GET", "HEAD"))
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=16, max_retries=retry)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _http = session
+        return _http
+
+def fetch_to_file(url: str, dest: Path, max_bytes: int = None, progress=None):
+    """Stream `url` into `dest`, resuming with a Range request if the connection drops mid-body."""
+    import requests
+    max_bytes = max_bytes or MAX_UPLOAD_BYTES
+    written = 0
+    for attempt in range(FETCH_ATTEMPTS):
+        headers = {"Range": f"bytes={written}-"} if written else {}
+        try:
+            with http_session().get(url, stream=True, timeout=FETCH_TIMEOUT, headers=headers) as r:
+                r.raise_for_status()
+                if written and r.status_code != 206:
+                    written = 0  # Server ignored the Range: start over
+                length = r.headers.get("Content-Length")
+                total = written + int(length) if length and length.isdigit() else None
+                if total and total > max_bytes:
+                    raise ValueError(f"Remote file larger than {max_bytes // (1024 * 1024)} MB")
+                with open(dest, "ab" if written else "wb") as f:
+                    for chunk in r.iter_content(chunk_size=FETCH_CHUNK):
+                        written += len(chunk)
+                        if written > max_bytes:
+                            raise ValueError(f"Remote file larger than {max_bytes // (1024 * 1024)} MB")
+                        f.write(chunk)
+                        if progress:
+                            progress(written, total)
+            return written
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            if attempt == FETCH_ATTEMPTS - 1:
+                raise
+            print(f"FETCH: {e}; retrying ({attempt + 1}/{FETCH_ATTEMPTS - 1})")
+            time.sleep(FETCH_BACKOFF * 2 ** attempt)
+
+def download_remote_input(jid, url, filename):
+    """The job's download stage. Returns the input path, or None if the job failed."""
+    ext = Path(filename).suffix or ".wav" # Default to wav if missing
+    input_path = INPUT_DIR / f"{jid}{ext}"
+    try:
+        update_job(jid, "Downloading: 0%", 2)
+        last = [-1]
+
+        def on_progress(done, total):
+            if not total:
+                return
+            pct = int(done * 100 / total)
+            if pct >= last[0] + 5:  # One job update per 5%, not per chunk
+                last[0] = pct
+                update_job(jid, f"Downloading: {pct}%", 2 + pct * 0.08)
+
+        with stage("download"):
+            fetch_to_file(url, input_path, progress=on_progress)
+        try:
+            validate_upload(input_path)
+        except HTTPException as e:
+            raise ValueError(e.detail)
+    except Exception as e:
+        print(f"Download Error: {e}")
+        input_path.unlink(missing_ok=True)
+        fail_job(jid, f"Failed to download file: {e}")
+        return None
+    return input_path
+
+def queue_remote_separation(jid, input_path, filename, usr, selection=None, timings=None):
+    """Hand a downloaded input to the scheduler (its place was checked when the job was accepted)."""
+    job = JOB_STORE.get(jid)
+    if not job:
+        input_path.unlink(missing_ok=True)
+        return
+    JOB_STORE.update(jid, payload=dict(job["payload"], input_path=str(input_path)),
+                     timings=dict(job["timings"], **(timings or {})))
+    update_job(jid, "queued", 10)
+    try:
+        SCHEDULER.submit(jid, run_separation_pipeline, jid, input_path, filename, usr, None, selection,
+                         owner=usr["id"], plan=usr.get("plan"), check_user_cap=False)
+    except QueueFull:
+        input_path.unlink(missing_ok=True)
+        fail_job(jid, "Server busy: the processing queue is full. Please retry shortly.")
+
+class RemoteFetcher:
+    """Download stage of remote-file jobs, on its own small I/O pool.
+
+    A job takes a JobScheduler slot (sized for Demucs RAM) only once its input
+    is on disk, so slow remote servers never hold separation capacity.
+    Downloads in flight count against the user's queue cap like queued jobs.
+    """
+
+    def __init__(self, workers: int = FETCH_WORKERS):
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._inflight = collections.Counter()
+
+    def inflight(self, owner: str):
+        with self._lock:
+            return self._inflight[owner]
+
+    def submit(self, jid, url, filename, usr, selection=None):
+        with self._lock:
+            if self._executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="aura-fetch")
+            self._inflight[usr["id"]] += 1
+        self._executor.submit(self._run, jid, url, filename, usr, selection)
+
+    def _run(self, jid, url, filename, usr, selection):
+        input_path, ctx = None, None
+        try:
+            job = JOB_STORE.get(jid)
+            if job:
+                # Stage timings and failure metrics as if the download ran in the job's worker
+                ctx = JobContext(jid, job["kind"], job["start_time"], job["timings"])
+                _job_context.job = ctx
+                input_path = download_remote_input(jid, url, filename)
+        finally:
+            _job_context.job = None
+            with self._lock:
+                self._inflight[usr["id"]] -= 1
+                if self._inflight[usr["id"]] <= 0:
+                    del self._inflight[usr["id"]]
+        if input_path:
+            queue_remote_separation(jid, input_path, filename, usr, selection, ctx.stages)
+        elif ctx:
+            end_job_metrics(ctx)
+
+REMOTE_FETCHER = RemoteFetcher()
+
+@app.post("/api/process_remote_file")
+def process_remote_file(
+    req: RemoteFileRequest,
+    user: dict = Depends(get_current_user)
+):
+    if user["credits"] < 1: raise HTTPException(status_code=402, detail="Insufficient credits")
+    if not req.url.lower().startswith(("https://", "http://")):
+        raise HTTPException(status_code=400, detail="Unsupported URL")
+    selection = parse_stem_selection(req.stems, req.two_stems)
+    ensure_queue_capacity(user, tracks=1 + REMOTE_FETCHER.inflight(user["id"]))
+
+    # Download is the job's first stage, off the scheduler; answer right away
+    job_id = str(uuid.uuid4())
+    JOB_STORE.create(job_id, user, req.filename, "remote",
+                     {"url": req.url, "title": req.filename, "selection": selection})
+    REMOTE_FETCHER.submit(job_id, req.url, req.filename, user, selection)
+    return {"job_id": job_id, "queue_position": None, "queue_depth": SCHEDULER.depth(),
+            "message": "Downloading & Processing..."}
+
+# --- STREAMING INGEST ---
+# Raw-body uploads are written to disk once, straight from the socket. The first
+# bytes decide early whether the file is audio at all (and, for WAV/FLAC, how
+# long it is); pipe-friendly formats are decoded by ffmpeg to float32 PCM at the
+# model rate while the rest of the body is still arriving.
+MAX_UPLOAD_BYTES = int(os.getenv("AURA_MAX_UPLOAD_MB", "200")) * 1024 * 1024
+MAX_UPLOAD_SECONDS = int(os.getenv("AURA_MAX_UPLOAD_MINUTES", "20")) * 60
+SNIFF_BYTES = 64 * 1024
+UPLOAD_FEED_BYTES = 1 << 20  # Hand the body to the writer thread in ~1 MiB pieces
+DECODED_SUFFIX = ".f32"
+DECODE_SAMPLERATE = 44100
+DECODE_CHANNELS = 2
+# MP4/M4A can keep their index at the end of the file, so they are not decoded from a pipe
+PIPE_DECODABLE = ("wav", "flac", "ogg", "mp3", "aac", "aiff", "webm")
+
+def _wav_duration(head: bytes):
+    pos, byte_rate = 12, None
+    while pos + 8 <= len(head):
+        chunk_id, size = struct.unpack("<4sI", head[pos:pos + 8])
+        if chunk_id == b"fmt " and pos + 16 <= len(head):
+            byte_rate = struct.unpack("<I", head[pos + 16:pos + 20])[0]
+        elif chunk_id == b"data":
+            if byte_rate and 0 < size < 0xFFFFFFFF:
+                return size / byte_rate
+            return None
+        pos += 8 + size + (size & 1)
+    return None
+
+def _flac_duration(head: bytes):
+    # STREAMINFO is always the first metadata block: 20-bit rate, 36-bit sample count
+    if len(head) < 26 or head[4] & 0x7F != 0:
+        return None
+    packed = int.from_bytes(head[18:26], "big")
+    rate, total = packed >> 44, packed & ((1 << 36) - 1)
+    return total / rate if rate and total else None
+
+def sniff_audio(head: bytes):
+    """(format, duration seconds or None) from the first bytes; format is None for non-audio."""
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return "wav", _wav_duration(head)
+    if head[:4] == b"fLaC":
+        return "flac", _flac_duration(head)
+    if head[:4] == b"OggS":
+        return "ogg", None
+    if head[:4] == b"FORM" and head[8:12] in (b"AIFF", b"AIFC"):
+        return "aiff", None
+    if head[:4] == b"\x1a\x45\xdf\xa3":
+        return "webm", None
+    if head[4:8] == b"ftyp":
+        return "m4a", None
+    if head[:3] == b"ID3":
+        return "mp3", None
+    if len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0:
+        # Frame sync: ADTS AAC has layer bits 00, MPEG audio doesn't
+        return ("aac" if head[1] & 0x06 == 0 else "mp3"), None
+    return None, None
+
+def check_audio_head(head: bytes, size: int = None):
+    """Reject non-audio / oversized / overlong uploads from their first bytes."""
+    fmt, duration = sniff_audio(head)
+    if not fmt:
+        raise HTTPException(status_code=415, detail="Unsupported or non-audio file")
+    if size is not None and size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"File larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+    if duration and duration > MAX_UPLOAD_SECONDS:
+        raise HTTPException(status_code=413, detail=f"Audio longer than {MAX_UPLOAD_SECONDS // 60} minutes")
+    return fmt
+
+def validate_upload(path: Path):
+    """Same checks for an upload already on disk (multipart endpoints); deletes it if rejected."""
+    with open(path, "rb") as f:
+        head = f.read(SNIFF_BYTES)
+    try:
+        return check_audio_head(head, path.stat().st_size)
+    except HTTPException:
+        path.unlink(missing_ok=True)
+        raise
+
+class IngestSession:
+    """One upload written to disk exactly once, decoded to f32 PCM on arrival when possible.
+
+    `feed` runs on a worker thread (blocking writes), never on the event loop.
+    """
+
+    def __init__(self, internal_id: str, fmt: str):
+        self.fmt = fmt
+        self.original = INPUT_DIR / f"{internal_id}.{fmt}"
+        self.decoded = INPUT_DIR / f"{internal_id}{DECODED_SUFFIX}"
+        self.error = None
+        self.decoded_bytes = 0
+        self._decode_ok = True
+        self._hash = hashlib.sha256()  # Of the bytes as uploaded: the cache key outlives the original
+        self._out = open(self.original, "wb")
+        self._proc = None
+        self._reader = None
+        ffmpeg = ffmpeg_binary() if fmt in PIPE_DECODABLE else None
+        if ffmpeg:
+            self._proc = subprocess.Popen(
+                [ffmpeg, "-nostdin", "-v", "error", "-i", "pipe:0", "-f", "f32le",
+                 "-ac", str(DECODE_CHANNELS), "-ar", str(DECODE_SAMPLERATE), "pipe:1"],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            self._reader = threading.Thread(target=self._drain, daemon=True)
+            self._reader.start()
+
+    @property
+    def digest(self):
+        return self._hash.hexdigest()
+
+    @property
+    def decoded_seconds(self):
+        return self.decoded_bytes / (4 * DECODE_CHANNELS * DECODE_SAMPLERATE)
+
+    def _drain(self):
+        with open(self.decoded, "wb") as f:
+            for chunk in iter(lambda: self._proc.stdout.read(1 << 16), b""):
+                f.write(chunk)
+                self.decoded_bytes += len(chunk)
+                if self.decoded_seconds > MAX_UPLOAD_SECONDS:
+                    self.error = f"Audio longer than {MAX_UPLOAD_SECONDS // 60} minutes"
+                    self._proc.kill()
+                    break
+
+    def feed(self, data: bytes):
+        if self.error:
+            raise HTTPException(status_code=413, detail=self.error)
+        self._out.write(data)
+        self._hash.update(data)
+        if self._proc and self._decode_ok:
+            try:
+                self._proc.stdin.write(data)
+            except OSError:
+                # Decoder gave up (odd stream): keep the original, the engine decodes it later
+                self._decode_ok = False
+
+    def finish(self):
+        """Close the upload; returns the path the engine should read."""
+        self._out.close()
+        if self._proc:
+            try:
+                self._proc.stdin.close()
+            except OSError:
+                pass
+            code = self._proc.wait()
+            self._reader.join()
+            if self.error:
+                self.abort()
+                raise HTTPException(status_code=413, detail=self.error)
+            if code == 0 and self._decode_ok and self.decoded_bytes:
+                self.original.unlink(missing_ok=True)
+                return self.decoded
+            self.decoded.unlink(missing_ok=True)
+        # Not decoded here: libsndfile can still tell WAV/FLAC/OGG/AIFF lengths cheaply
+        try:
+            import soundfile as sf
+            duration = sf.info(str(self.original)).duration
+        except Exception:
+            duration = None
+        if duration and duration > MAX_UPLOAD_SECONDS:
+            self.abort()
+            raise HTTPException(status_code=413, detail=f"Audio longer than {MAX_UPLOAD_SECONDS // 60} minutes")
+        return self.original
+
+    def abort(self):
+        if not self._out.closed:
+            self._out.close()
+        if self._proc and self._proc.poll() is None:
+            self._proc.kill()
+            self._proc.wait()
+        if self._reader:
+            self._reader.join()
+        self.original.unlink(missing_ok=True)
+        self.decoded.unlink(missing_ok=True)
+
+def open_ingest(internal_id: str, head: bytes, declared_size: int = None):
+    return IngestSession(internal_id, check_audio_head(head, declared_size))
+
+# --- ASYNC ROUTES ---
+
+@app.post("/api/process_file_async")
+async def process_file_async(
+    file: UploadFile = File(...),
+    stems: Optional[str] = Form(None),
+    two_stems: Optional[str] = Form(None),
+    user: dict = Depends(get_current_user)
+):
+    if user["credits"] < 1: raise HTTPException(status_code=402, detail="Insufficient credits")
+    selection = parse_stem_selection(stems, two_stems)
+    ensure_queue_capacity(user)
+    
     # Save Upload
     file_ext = Path(file.filename).suffix or ".wav"
     internal_id = str(uuid.uuid4())
     input_path = INPUT_DIR / f"{internal_id}{file_ext}"
     
+    upload_started = time.perf_counter()
     with open(input_path, "wb") as buffer:
         shutil.copyfileobj(file.file, buffer)
+    validate_upload(input_path)
+    upload_seconds = time.perf_counter() - upload_started
+    record_stage("upload", upload_seconds)
         
     # Start Job
     job_id = str(uuid.uuid4())
-    JOBS[job_id] = {
-        "status": "queued", 
-        "progress": 0, 
-        "result": None, 
-        "start_time": datetime.datetime.now().timestamp(),
-        "owner": user["username"],
-        "name": file.filename
-    }
-    
-    def file_wrapper(jid, path, fname, usr):
-        try:
-            update_job(jid, "Processing Audio...", 10)
-            res = core_process_track(path, fname, usr)
-            JOBS[jid]["result"] = res
-            update_job(jid, "completed", 100)
-        except Exception as e:
-            JOBS[jid]["status"] = "failed"
-            JOBS[jid]["error"] = str(e)
+    JOB_STORE.create(job_id, user, file.filename, "file",
+                     {"input_path": str(input_path), "title": file.filename, "selection": selection},
+                     timings={"upload": round(upload_seconds, 4)})
             
-    background_tasks.add_task(file_wrapper, job_id, input_path, file.filename, user)
-    return {"job_id": job_id}
+    try:
+        return enqueue_job(job_id, run_file_job, job_id, input_path, file.filename, user, selection, user=user)
+    except HTTPException:
+        input_path.unlink(missing_ok=True)
+        raise
+
+@app.post("/api/upload")
+async def upload_stream(
+    request: Request,
+    filename: str = "Upload",
+    stems: Optional[str] = None,
+    two_stems: Optional[str] = None,
+    user: dict = Depends(get_current_user)
+):
+    """Raw-body upload (not multipart): one disk write, early validation, decode on arrival."""
+    if user["credits"] < 1: raise HTTPException(status_code=402, detail="Insufficient credits")
+    selection = parse_stem_selection(stems, two_stems)
+    ensure_queue_capacity(user)
+
+    declared = request.headers.get("content-length")
+    declared = int(declared) if declared and declared.isdigit() else None
+    if declared and declared > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"File larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+
+    from starlette.concurrency import run_in_threadpool
+    internal_id = str(uuid.uuid4())
+    upload_started = time.perf_counter()
+    session, pending, received = None, bytearray(), 0
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > MAX_UPLOAD_BYTES:
+                raise HTTPException(status_code=413, detail=f"File larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+            pending += chunk
+            if session is None:
+                if len(pending) < SNIFF_BYTES:
+                    continue
+                session = await run_in_threadpool(open_ingest, internal_id, bytes(pending[:SNIFF_BYTES]), declared)
+            if len(pending) >= UPLOAD_FEED_BYTES:
+                await run_in_threadpool(session.feed, bytes(pending))
+                pending.clear()
+        if session is None:
+            if not pending:
+                raise HTTPException(status_code=400, detail="Empty upload")
+            session = await run_in_threadpool(open_ingest, internal_id, bytes(pending), declared)
+        if pending:
+            await run_in_threadpool(session.feed, bytes(pending))
+        input_path = await run_in_threadpool(session.finish)
+    except BaseException:
+        # Rejected, client went away, or the write failed: leave nothing behind
+        if session:
+            await run_in_threadpool(session.abort)
+        raise
+    upload_seconds = time.perf_counter() - upload_started
+    record_stage("upload", upload_seconds)
+
+    job_id = str(uuid.uuid4())
+    JOB_STORE.create(job_id, user, filename, "file",
+                     {"input_path": str(input_path), "title": filename, "selection": selection,
+                      "digest": session.digest},
+                     timings={"upload": round(upload_seconds, 4)})
+    try:
+        return enqueue_job(job_id, run_file_job, job_id, input_path, filename, user, selection, session.digest,
+                           user=user)
+    except HTTPException:
+        input_path.unlink(missing_ok=True)
+        raise
 
 @app.get("/api/my_jobs")
 def get_my_jobs(user: dict = Depends(get_current_user)):
     # Return active/recent jobs for this user
     # Sort by time desc
+    # Indexed by (owner, start_time): newest first, no full scan
     my_list = []
-    for jid, info in JOBS.items():
-        if info.get("owner") == user["username"]:
-            # Sanitize (remove sensitive internal paths if any, though result is safe)
-            item = {
-                "job_id": jid,
-                "status": info["status"],
-                "progress": info["progress"],
-                "name": info.get("name", "Untitled"),
-                "start_time": info["start_time"],
-                "error": info.get("error")
-            }
-            if info["status"] == "completed":
-                item["result"] = info["result"]
-            my_list.append(item)
-    
-    # Sort: Newest first
-    my_list.sort(key=lambda x: x["start_time"], reverse=True)
+    for info in JOB_STORE.list_for_owner(user["username"]):
+        # Sanitize (remove sensitive internal paths)
+        item = {
+            "job_id": info["job_id"],
+            "status": info["status"],
+            "progress": info["progress"],
+            "name": info["name"] or "Untitled",
+            "start_time": info["start_time"],
+            "error": info["error"],
+            "queue_position": SCHEDULER.position(info["job_id"]),
+            "kind": info["kind"],
+            "parent": info["payload"].get("parent"),
+        }
+        if info["status"] == "completed":
+            item["result"] = info["result"]
+        my_list.append(item)
     return my_list
 
+def archive_files(folder: Path, prefix: str = ""):
+    """(arcname, path) of what a stem ZIP carries: the masters and thumbnail, no peaks/encodes."""
+    return [(prefix + f.name, f) for f in sorted(folder.glob("*"))
+            if f.is_file() and f.suffix not in ('.zip', '.part', PEAKS_SUFFIX) + DELIVERY_SUFFIXES]
+
 @app.get("/api/download_zip/{project_id}")
-def download_zip(project_id: str):
+def download_zip(project_id: str, range_header: Optional[str] = Header(None, alias="Range"),
+                 if_range: Optional[str] = Header(None)):
     # Security: Ensure project exists
     project_path = OUTPUT_DIR / "htdemucs" / project_id
     if not project_path.exists():
         raise HTTPException(status_code=404, detail="Project not found")
 
-    # Create ZIP in memory
-    import io
-    import zipfile
-    
-    zip_buffer = io.BytesIO()
-    # OPTIMIZATION: Use ZIP_STORED. WAV files do not compress well.
-    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_STORED) as zip_file:
-        for file in project_path.glob("*"):
-            if file.is_file() and file.suffix != '.zip':
-                zip_file.write(file, arcname=file.name)
-    
-    zip_buffer.seek(0)
-    
-    return StreamingResponse(
-        zip_buffer, 
-        media_type="application/zip", 
-        headers={"Content-Disposition": f"attachment; filename=stems_{project_id}.zip"}
-    )
+    plan = ZipPlan(archive_files(project_path))
+    STORAGE.touch(project_id)
+    return stream_zip(plan, f"stems_{project_id}.zip", range_header, if_range)
+
+SAFE_PATH_PART = re.compile(r"[A-Za-z0-9_-]+")
+
+@app.get("/api/peaks/{project_id}/{stem}")
+def get_peaks(project_id: str, stem: str, width: int = PEAK_DEFAULT_WIDTH,
+              if_none_match: Optional[str] = Header(None)):
+    if not SAFE_PATH_PART.fullmatch(project_id) or not SAFE_PATH_PART.fullmatch(stem):
+        raise HTTPException(status_code=404, detail="Stem not found")
+    folder = OUTPUT_DIR / "htdemucs" / project_id
+    peaks_path = folder / f"{stem}{PEAKS_SUFFIX}"
+    if not peaks_path.exists():
+        wav_path = folder / f"{stem}.wav"
+        if not wav_path.exists():
+            raise HTTPException(status_code=404, detail="Stem not found")
+        ensure_peaks_file(wav_path)
+    STORAGE.touch(project_id)
+
+    # Stems never change in place, so (mtime, size, width) identifies the response
+    stat = peaks_path.stat()
+    width = max(1, width)
+    headers = {
+        "ETag": f'"{stat.st_mtime_ns:x}-{stat.st_size:x}-{width}"',
+        "Cache-Control": "public, max-age=86400",
+    }
+    if if_none_match == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    return Response(read_peaks_level(peaks_path, width), media_type="application/octet-stream", headers=headers)
+
+# --- YOUTUBE INGEST ---
+# Fast path: resolve the best audio-only stream without downloading, then let one
+# ffmpeg process read it and decode straight to f32 PCM at the model rate (no WAV
+# transcode, no extra file rewrites). The thumbnail is fetched on a side thread
+# while the audio decodes. Title/thumbnail and the separation cache key are kept
+# per video id, so a repeat URL whose stems are still cached skips yt-dlp entirely.
+YOUTUBE_FAST_PATH = os.getenv("AURA_YOUTUBE_FAST", "1") != "0"
+YOUTUBE_THUMB_DIR = CACHE_DIR / "youtube"
+YOUTUBE_THUMB_MAX_BYTES = 5 * 1024 * 1024
+# The per-video thumbnail cache is bounded by the storage sweeper (projects keep their own copy)
+YOUTUBE_THUMB_CACHE_BYTES = int(os.getenv("AURA_THUMB_CACHE_MB", "64")) * 1024 * 1024
+YOUTUBE_THUMB_MAX_AGE = int(os.getenv("AURA_THUMB_CACHE_DAYS", "30")) * 86400
+YOUTUBE_ID_RE = re.compile(r"(?:youtube\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/|live/|v/)|youtu\.be/)([A-Za-z0-9_-]{11})")
+YOUTUBE_YDL_OPTS = {
+    'format': 'bestaudio/best',
+    'noplaylist': True,
+    'nocheckcertificate': True,
+    'quiet': True,
+    'no_warnings': True,
+    'socket_timeout': 15,
+    'retries': 10,
+    'force_ipv4': True,
+    'extractor_args': {'youtube': {'player_client': ['android', 'web']}},
+}
+
+def youtube_video_id(url: str):
+    m = YOUTUBE_ID_RE.search(url)
+    return m.group(1) if m else None
+
+def youtube_media_get(video_id: str):
+    row = DB.query_one("SELECT title, thumbnail_url, duration, cache_key FROM youtube_media WHERE video_id = ?", (video_id,))
+    if not row:
+        return None
+    return {"title": row[0], "thumbnail": row[1], "duration": row[2], "cache_key": row[3]}
+
+def youtube_media_put(video_id: str, title: str, thumbnail: str, duration, cache_key: str = None):
+    DB.execute("INSERT OR REPLACE INTO youtube_media (video_id, title, thumbnail_url, duration, cache_key, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+               (video_id, title, thumbnail, duration, cache_key, time.time()))
+
+def youtube_extract(url: str):
+    """Metadata + direct stream URL for the best audio format; nothing is downloaded."""
+    install_network_patches()
+    import yt_dlp
+    with yt_dlp.YoutubeDL(YOUTUBE_YDL_OPTS) as ydl:
+        info = ydl.extract_info(url, download=False)
+    if not info:
+        raise ValueError("Could not read video information")
+    if info.get("is_live"):
+        raise ValueError("Live streams are not supported")
+    if info.get("duration") and info["duration"] > MAX_UPLOAD_SECONDS:
+        raise ValueError(f"Audio longer than {MAX_UPLOAD_SECONDS // 60} minutes")
+    return info
+
+def _thumbnail_path(key: str):
+    return YOUTUBE_THUMB_DIR / f"{key}.jpg"
+
+def fetch_thumbnail(key: str, url: str):
+    """Fetch a thumbnail into the per-video cache (once); returns its path or None."""
+    dest = _thumbnail_path(key)
+    if dest.exists():
+        try:
+            os.utime(dest)  # mtime = last use, for the sweeper's LRU
+        except OSError:
+            pass
+        return dest
+    if not url:
+        return None
+    YOUTUBE_THUMB_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = dest.with_name(f".{dest.name}.{uuid.uuid4().hex}")
+    try:
+        fetch_to_file(url, tmp, max_bytes=YOUTUBE_THUMB_MAX_BYTES)
+        tmp.replace(dest)
+        return dest
+    except Exception as e:
+        print(f"YT THUMBNAIL: {e}")
+        tmp.unlink(missing_ok=True)
+        return None
+
+def attach_thumbnail(thumb: Path, folder: Path):
+    if not thumb or not thumb.exists() or not folder.exists():
+        return
+    target = folder / "thumbnail.jpg"
+    target.unlink(missing_ok=True)
+    _link_or_copy(thumb, target)
+    refresh_manifest(folder)
+
+def decode_stream(info: dict, dest: Path, progress=None):
+    """One ffmpeg pass: remote audio stream -> f32le PCM file the engine reads directly."""
+    ffmpeg = ffmpeg_binary()
+    if not ffmpeg:
+        raise RuntimeError("ffmpeg not available")
+    cmd = [ffmpeg, "-nostdin", "-v", "error", "-y"]
+    headers = "".join(f"{k}: {v}\r\n" for k, v in (info.get("http_headers") or {}).items())
+    if headers:
+        cmd += ["-headers", headers]
+    cmd += ["-i", info["url"], "-vn", "-t", str(MAX_UPLOAD_SECONDS + 1),
+            "-f", "f32le", "-ac", str(DECODE_CHANNELS), "-ar", str(DECODE_SAMPLERATE),
+            "-progress", "pipe:1", "-nostats", str(dest)]
+    duration = info.get("duration") or 0
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    try:
+        for line in proc.stdout:
+            if progress and duration and line.startswith("out_time_us="):
+                try:
+                    progress(min(int(line.split("=", 1)[1]) / 1e6 / duration, 1.0))
+                except ValueError:
+                    pass
+        err = proc.stderr.read()
+        if proc.wait() != 0:
+            raise RuntimeError(f"ffmpeg decode failed: {err.strip()[-300:]}")
+    except BaseException:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        dest.unlink(missing_ok=True)
+        raise
+    size = dest.stat().st_size if dest.exists() else 0
+    if not size:
+        dest.unlink(missing_ok=True)
+        raise RuntimeError("ffmpeg decode produced no audio")
+    if size / (4 * DECODE_CHANNELS * DECODE_SAMPLERATE) > MAX_UPLOAD_SECONDS:
+        dest.unlink(missing_ok=True)
+        raise ValueError(f"Audio longer than {MAX_UPLOAD_SECONDS // 60} minutes")
+    return dest
+
+def youtube_download(jid, url: str, internal_id: str):
+    """Fallback: let yt-dlp download the audio stream as-is (the engine decodes it once)."""
+    def ph(d):
+        if d['status'] == 'downloading':
+            str_p = d.get('_percent_str', '0%').strip().replace('%','')
+            try:
+                update_job(jid, f"Downloading: {str_p}%", 10 + float(str_p) * 0.2)
+            except: pass
+
+    opts = dict(YOUTUBE_YDL_OPTS, outtmpl=str(INPUT_DIR / f"{internal_id}.%(ext)s"), progress_hooks=[ph])
+    ffmpeg = ffmpeg_binary()
+    if ffmpeg:
+        opts['ffmpeg_location'] = ffmpeg
+    install_network_patches()
+    import yt_dlp
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        info = ydl.extract_info(url, download=True)
+    if not info:
+        raise Exception("YT-DLP download failed to produce an audio file.")
+    for f in INPUT_DIR.glob(f"{internal_id}.*"):
+        if f.suffix not in ('.part', '.ytdl') + THUMBNAIL_SUFFIXES:
+            return f, info
+    raise Exception("YT-DLP download failed to produce an audio file.")
+
+def run_youtube_job(jid, u, usr, selection=None):
+    internal_id = str(uuid.uuid4())
+    input_path = None
+    try:
+        update_job(jid, "Connecting to YouTube...", 5)
+        video_id = youtube_video_id(u)
+        known = youtube_media_get(video_id) if video_id else None
+        thumb_key = video_id or internal_id
+
+        # Seen before and the stems are still cached: no extraction, no download.
+        # Restore once up front; if the entry was evicted, extract/download as usual.
+        cached = None
+        if known and known["cache_key"]:
+            with stage("cache"):
+                cached = SEPARATION_CACHE.restore(
+                    SEPARATION_CACHE.with_variant(known["cache_key"], output_variant(selection)),
+                    OUTPUT_DIR / MODEL_NAME / internal_id)
+        if cached is not None:
+            JOB_STORE.update(jid, name=known["title"])
+            result = run_separation_pipeline(jid, INPUT_DIR / f"{internal_id}{DECODED_SUFFIX}", known["title"], usr,
+                                             cache_key=known["cache_key"], selection=selection, cached=cached)
+            if result:
+                thumb = fetch_thumbnail(thumb_key, known["thumbnail"])
+                attach_thumbnail(thumb, OUTPUT_DIR / MODEL_NAME / internal_id)
+            return
+
+        info = None
+        if YOUTUBE_FAST_PATH:
+            try:
+                with stage("extract"):
+                    info = youtube_extract(u)
+            except ValueError:
+                raise
+            except Exception as e:
+                print(f"YT EXTRACT failed, falling back to download: {e}")
+
+        from concurrent.futures import ThreadPoolExecutor
+        thumbs = ThreadPoolExecutor(max_workers=1, thread_name_prefix="aura-thumb")
+        thumb_future = None
+        if info and info.get("url"):
+            title = info.get("title") or "Youtube Download"
+            JOB_STORE.update(jid, name=title)
+            thumb_future = thumbs.submit(fetch_thumbnail, thumb_key, info.get("thumbnail"))
+            update_job(jid, "Decoding Audio...", 10)
+
+            def on_decode(frac):
+                update_job(jid, f"Decoding Audio: {int(frac * 100)}%", 10 + frac * 20)
+
+            try:
+                # Network-bound: the stream is fetched and decoded in the same ffmpeg pass
+                with stage("download"):
+                    input_path = decode_stream(info, INPUT_DIR / f"{internal_id}{DECODED_SUFFIX}", on_decode)
+            except ValueError:
+                raise
+            except Exception as e:
+                print(f"YT DECODE failed, falling back to download: {e}")
+
+        if input_path is None:
+            update_job(jid, "Downloading...", 10)
+            with stage("download"):
+                input_path, info = youtube_download(jid, u, internal_id)
+            title = info.get("title") or "Youtube Download"
+            JOB_STORE.update(jid, name=title)
+            if thumb_future is None:
+                thumb_future = thumbs.submit(fetch_thumbnail, thumb_key, info.get("thumbnail"))
+        thumbs.shutdown(wait=False)
+
+        cache_key = SEPARATION_CACHE.key_for(input_path)
+        result = run_separation_pipeline(jid, input_path, title, usr, cache_key=cache_key, selection=selection)
+        if result and video_id:
+            youtube_media_put(video_id, title, info.get("thumbnail"), info.get("duration"), cache_key)
+        thumb = thumb_future.result() if thumb_future else None
+        if result:
+            attach_thumbnail(thumb, OUTPUT_DIR / MODEL_NAME / input_path.stem)
+
+    except Exception as e:
+        print(f"YT-DLP FINAL ERROR: {e}")
+        if input_path is not None:
+            input_path.unlink(missing_ok=True)
+        fail_job(jid, e)
 
 @app.post("/api/process_youtube_async")
 def start_youtube_job(
-    background_tasks: BackgroundTasks, 
     url: str = Form(...), 
+    stems: Optional[str] = Form(None),
+    two_stems: Optional[str] = Form(None),
     user: dict = Depends(get_current_user)
 ):
     if user["credits"] < 1:
         raise HTTPException(status_code=402, detail="Insufficient credits")
+    selection = parse_stem_selection(stems, two_stems)
+    ensure_queue_capacity(user)
         
     job_id = str(uuid.uuid4())
-    JOBS[job_id] = {
-        "status": "queued",
-        "progress": 0, 
-        "result": None, 
-        "start_time": datetime.datetime.now().timestamp(),
-        "owner": user["username"],
-        "name": url # Will update to title later
+    JOB_STORE.create(job_id, user, url, "youtube", {"url": url, "selection": selection}) # Name updates to title later
+
+    return enqueue_job(job_id, run_youtube_job, job_id, url, user, selection, user=user)
+
+# --- BATCH / ALBUM JOBS ---
+# One parent job (kind "batch") per album upload or playlist, one ordinary child
+# job per track. The parent runs its children up to BATCH_PARALLEL_TRACKS at a
+# time on one SegmentBatcher, so segments of different tracks share forward
+# passes while the others decode, analyse and write. In the scheduler it counts
+# as its track count against the owner's queue share and fair-share clock, and
+# as its parallel tracks against the owner's max_active (never above the plan's
+# cap). The finished album is one streaming ZIP (a folder per track).
+BATCH_MAX_TRACKS = int(os.getenv("AURA_BATCH_MAX_TRACKS", "50"))
+BATCH_PARALLEL_TRACKS = max(1, int(os.getenv("AURA_BATCH_TRACKS", "3")))
+
+def batch_parallel_tracks(plan: str):
+    max_active = plan_terms(plan or DEFAULT_PLAN)[1]
+    return min(BATCH_PARALLEL_TRACKS, max_active) if max_active else BATCH_PARALLEL_TRACKS
+
+def playlist_track_limit(user: dict):
+    """Tracks a playlist may expand to: credits, and the plan's queue share (it is admitted as that many)."""
+    max_queued = plan_terms(user.get("plan") or DEFAULT_PLAN)[2]
+    return max(1, min(BATCH_MAX_TRACKS, user["credits"], max_queued or BATCH_MAX_TRACKS))
+
+def batch_shape(user: dict, tracks: int):
+    """Scheduler accounting (tracks=, slots=) of a batch parent."""
+    return {"tracks": tracks, "slots": min(batch_parallel_tracks(user.get("plan")), tracks)}
+
+def youtube_playlist_entries(url: str, limit: int):
+    """(title, [(video url, title)]) of a playlist, without resolving any stream."""
+    install_network_patches()
+    import yt_dlp
+    opts = dict(YOUTUBE_YDL_OPTS, noplaylist=False, extract_flat="in_playlist", playlistend=limit)
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+    entries = []
+    for entry in info.get("entries") or [info]:
+        video = entry.get("url") or entry.get("webpage_url") or entry.get("id")
+        if not video:
+            continue
+        if not video.startswith(("https://", "http://")):
+            video = f"https://www.youtube.com/watch?v={video}"
+        entries.append((video, entry.get("title") or video))
+    return info.get("title"), entries[:limit]
+
+def create_playlist_children(jid: str, url: str, usr: dict, selection: dict = None):
+    user = get_user_compat(usr["id"]) or usr
+    limit = min(JOB_STORE.get(jid)["payload"].get("max_tracks") or BATCH_MAX_TRACKS, max(user["credits"], 0))
+    title, entries = youtube_playlist_entries(url, limit)
+    children = []
+    for video, name in entries:
+        child_id = str(uuid.uuid4())
+        JOB_STORE.create(child_id, usr, name, "youtube", {"url": video, "selection": selection, "parent": jid})
+        children.append({"job_id": child_id, "kind": "youtube", "title": name, "url": video})
+    job = JOB_STORE.get(jid)
+    JOB_STORE.update(jid, name=title or job["name"], payload=dict(job["payload"], children=children))
+    return children
+
+def run_batch_child(child: dict, usr: dict, selection: dict, batcher: SegmentBatcher):
+    job = JOB_STORE.get(child["job_id"])
+    if not job or job["status"] in JOB_DONE_STATES:
+        return  # Finished before a restart
+    ctx = begin_job_metrics(job)
+    ctx.batcher = batcher
+    try:
+        if child["kind"] == "youtube":
+            run_youtube_job(child["job_id"], child["url"], usr, selection)
+        else:
+            run_file_job(child["job_id"], Path(child["input_path"]), child["title"], usr, selection)
+    except Exception as e:
+        fail_job(child["job_id"], e)
+    finally:
+        end_job_metrics(ctx)
+
+def batch_result(jid: str, children: list, usr: dict, batcher: SegmentBatcher):
+    tracks = []
+    jobs = {job["job_id"]: job for job in JOB_STORE.get_many([c["job_id"] for c in children])}
+    for child in children:
+        job = jobs.get(child["job_id"])
+        if job is None:
+            # Purged or never written: report it rather than shifting every later track
+            tracks.append({"job_id": child["job_id"], "name": child["title"], "status": "failed",
+                           "error": "Track job not found"})
+            continue
+        track = {"job_id": child["job_id"], "name": job["name"] or child["title"], "status": job["status"],
+                 "error": job["error"]}
+        if job["status"] == "completed" and job["result"]:
+            track["project"] = job["result"]["project"]
+            track["stems"] = job["result"]["stems"]
+        tracks.append(track)
+    user = get_user_compat(usr["id"]) or usr
+    done = sum(1 for t in tracks if t["status"] == "completed")
+    return {
+        "message": "Success",
+        "credits_left": user["credits"],
+        "tracks": tracks,
+        "completed": done,
+        "failed": len(tracks) - done,
+        "archive": f"/api/batch/{jid}/archive",
+        "engine": batcher.stats(),
     }
-    
-    # Determine the pipeline
-    def youtube_wrapper(jid, u, usr):
-        try:
-            update_job(jid, "Connecting to YouTube...", 5)
-            internal_id = str(uuid.uuid4())
-            input_path = INPUT_DIR / f"{internal_id}"
-            
-            # Progress Hook
-            def ph(d):
-                if d['status'] == 'downloading':
-                    str_p = d.get('_percent_str', '0%').replace('%','')
-                    try:
-                        update_job(jid, f"Downloading: {str_p}%", 10 + float(str_p) * 0.2)
-                    except: pass
-                elif d['status'] == 'finished':
-                    update_job(jid, "Formatting Audio...", 35)
-
-            # --- YT-DLP Standard Logic (Restored) ---
-            import static_ffmpeg
-            static_ffmpeg.add_paths()
-            ffmpeg_path = shutil.which("ffmpeg")
-            
-            ydl_opts = {
-                'format': 'bestaudio/best',
-                'ffmpeg_location': str(ffmpeg_path),
-                'outtmpl': str(input_path), # yt-dlp will add extension
-                'writethumbnail': True, 
-                'postprocessors': [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'wav', 'preferredquality': '192'}],
-                'nocheckcertificate': True,
-                'ignoreerrors': True,
-                'no_warnings': False,
-                'quiet': False, 
-                'verbose': True,
-                'socket_timeout': 15,
-                'retries': 10,
-                'force_ipv4': True,
-                'extractor_args': {'youtube': {'player_client': ['android', 'web']}},
-                'progress_hooks': [ph]
-            }
-            
-            meta_title = "Youtube Download"
-            thumb_url = None
-            
-            try:
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    info = ydl.extract_info(u, download=True)
-                    meta_title = info.get('title', meta_title)
-                    thumb_url = info.get('thumbnail', None)
-            except Exception as e:
-                print(f"YT-DLP FINAL ERROR: {e}")
-                raise e
-                
-            # Find the actual downloaded audio file (yt-dlp adds extension)
-            downloaded_audio_path = None
-            for f in INPUT_DIR.glob(f"{internal_id}.*"):
-                if f.suffix in ['.wav', '.mp3', '.m4a', '.ogg', '.flac']: # Common audio extensions
-                    downloaded_audio_path = f
-                    break
-            
-            if not downloaded_audio_path:
-                raise Exception("YT-DLP download failed to produce an audio file.")
-            
-            # Hand over to main pipeline, passing thumbnail if possible?
-            # We can modify core pipeline later, for now let's just process.
-            # To stick thumbnail to project, we need to move it to output dir later?
-            # Main pipeline handles separation.
-            
-            run_separation_pipeline(jid, final_path, meta_title, usr)
-            
-            # Post-Process: Copy Thumbnail if exists (yt-dlp usually names it same as input)
-            # Input was input_path (no extension). Thumbnail is likely input_path.jpg or .webp
-            # We need to find it and move it to the OUTPUT project folder.
-            base_out = OUTPUT_DIR / "htdemucs" / final_path.stem
-            
-            # Find any image starting with internal_id in INPUT_DIR
-            for img in INPUT_DIR.glob(f"{internal_id}.*"):
-                if img.suffix in ['.jpg', '.jpeg', '.png', '.webp']:
-                    if base_out.exists():
-                        shutil.copy(img, base_out / "thumbnail.jpg")
 
-        except Exception as e:
-            JOBS[jid]["error"] = str(e)
-            JOBS[jid]["status"] = "failed"
-            
-    background_tasks.add_task(youtube_wrapper, job_id, url, user)
-    return {"job_id": job_id}
+def run_batch_job(jid, usr):
+    from concurrent.futures import ThreadPoolExecutor, wait
+    payload = JOB_STORE.get(jid)["payload"]
+    selection = payload.get("selection")
+    children = payload.get("children") or []
+    batcher = SegmentBatcher()
+    try:
+        if not children and payload.get("url"):
+            update_job(jid, "Reading Playlist...", 1)
+            with stage("extract"):
+                children = create_playlist_children(jid, payload["url"], usr, selection)
+        if not children:
+            raise ValueError("No tracks to process")
+
+        total, last = len(children), None
+        # Never more tracks at once than the slots the scheduler charged this job
+        parallel = batch_shape(usr, total)["slots"]
+        with ThreadPoolExecutor(parallel, thread_name_prefix="aura-batch") as pool:
+            pending = {pool.submit(run_batch_child, child, usr, selection, batcher) for child in children}
+            while pending:
+                # Parent progress: mean of the children's, one store read per tick
+                jobs = JOB_STORE.get_many([c["job_id"] for c in children])
+                done = sum(1 for j in jobs if j["status"] in JOB_DONE_STATES)
+                progress = sum(100 if j["status"] in JOB_DONE_STATES else j["progress"] or 0 for j in jobs) / total
+                state = (f"Processing {done}/{total} Tracks", round(min(progress, 99), 1))
+                if state != last:
+                    update_job(jid, *state)
+                    last = state
+                _, pending = wait(pending, timeout=1.0)
+    except Exception as e:
+        print(f"Batch Error: {e}")
+        fail_job(jid, e)
+        return
+    finally:
+        batcher.close()
+
+    result = batch_result(jid, children, usr, batcher)
+    if not result["completed"]:
+        fail_job(jid, "Every track failed")
+        return
+    complete_job(jid, result)
+
+@app.post("/api/process_batch")
+def process_batch(
+    files: List[UploadFile] = File(None),
+    url: Optional[str] = Form(None),
+    name: Optional[str] = Form(None),
+    stems: Optional[str] = Form(None),
+    two_stems: Optional[str] = Form(None),
+    user: dict = Depends(get_current_user)
+):
+    """Album upload (several files) or a playlist URL as one parent job with a child job per track."""
+    files = files or []
+    if bool(files) == bool(url):
+        raise HTTPException(status_code=400, detail="Send either files or a playlist url")
+    if len(files) > BATCH_MAX_TRACKS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_TRACKS} tracks per batch")
+    if user["credits"] < max(len(files), 1):
+        raise HTTPException(status_code=402, detail="Insufficient credits")
+    if url and not url.lower().startswith(("https://", "http://")):
+        raise HTTPException(status_code=400, detail="Unsupported URL")
+    selection = parse_stem_selection(stems, two_stems)
+    # Admitted as its track count: a playlist as the most tracks it may expand to
+    shape = batch_shape(user, len(files) or playlist_track_limit(user))
+    ensure_queue_capacity(user, shape["tracks"])
+
+    job_id = str(uuid.uuid4())
+    children = []
+    upload_started = time.perf_counter()
+    try:
+        for file in files:
+            input_path = INPUT_DIR / f"{uuid.uuid4()}{Path(file.filename).suffix or '.wav'}"
+            with open(input_path, "wb") as buffer:
+                shutil.copyfileobj(file.file, buffer)
+            children.append({"job_id": str(uuid.uuid4()), "kind": "file", "title": file.filename,
+                             "input_path": str(input_path)})
+            validate_upload(input_path)
+    except BaseException:
+        for child in children:
+            Path(child["input_path"]).unlink(missing_ok=True)
+        raise
+    upload_seconds = time.perf_counter() - upload_started
+    if files:
+        record_stage("upload", upload_seconds)
+
+    title = name or (f"{len(files)} Tracks" if files else url)
+    JOB_STORE.create(job_id, user, title, "batch",
+                     {"title": title, "url": url, "selection": selection, "children": children,
+                      "max_tracks": shape["tracks"]},
+                     timings={"upload": round(upload_seconds, 4)} if files else None)
+    for child in children:
+        JOB_STORE.create(child["job_id"], user, child["title"], "file",
+                         {"input_path": child["input_path"], "title": child["title"], "selection": selection,
+                          "parent": job_id})
+    try:
+        queued = enqueue_job(job_id, run_batch_job, job_id, user, user=user, **shape)
+    except HTTPException:
+        for child in children:
+            JOB_STORE.delete(child["job_id"])
+            Path(child["input_path"]).unlink(missing_ok=True)
+        raise
+    return {**queued, "children": [c["job_id"] for c in children]}
+
+@app.get("/api/batch/{job_id}/archive")
+def download_batch_archive(job_id: str, range_header: Optional[str] = Header(None, alias="Range"),
+                           if_range: Optional[str] = Header(None)):
+    """All finished tracks of a batch as one ZIP, streamed (a folder per track)."""
+    job = JOB_STORE.get(job_id)
+    if not job or job["kind"] != "batch":
+        raise HTTPException(status_code=404, detail="Batch not found")
+    if job["status"] != "completed":
+        raise HTTPException(status_code=409, detail="Batch is still processing")
+    files = []
+    for number, track in enumerate(job["result"]["tracks"], 1):
+        folder = OUTPUT_DIR / MODEL_NAME / track["project"]["id"] if track.get("project") else None
+        if folder is None or not folder.is_dir():
+            continue  # Failed, or deleted/evicted since
+        label = re.sub(r'[\\/:*?"<>|]+', "_", track["name"]).strip() or "Track"
+        files += archive_files(folder, f"{number:02d} - {label}/")
+        STORAGE.touch(folder.name)
+    if not files:
+        raise HTTPException(status_code=404, detail="No stems left for this batch")
+    return stream_zip(ZipPlan(files), f"album_{job_id}.zip", range_header, if_range)
 
 @app.get("/api/jobs/{job_id}")
 def get_job_status(job_id: str):
-    if job_id not in JOBS:
+    job = JOB_STORE.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    payload = job.pop("payload")
+    if job["kind"] == "batch":
+        job["children"] = [{k: child[k] for k in ("job_id", "name", "status", "progress", "error")}
+                           for child in JOB_STORE.get_many([c["job_id"] for c in payload.get("children") or []])]
+    job["queue_position"] = SCHEDULER.position(job_id)
+    job["queue_depth"] = SCHEDULER.depth()
+    return job
+
+def _settled(job: dict):
+    """Done, and no encodes left to announce (a completed job keeps its stream until they land)."""
+    return job["status"] in JOB_DONE_STATES and not (job.get("result") or {}).get("encoding")
+
+def _sse(event: dict, seq=None, name="job"):
+    head = f"id: {seq}\n" if seq is not None else ""
+    return f"{head}event: {name}\ndata: {json.dumps(event)}\n\n"
+
+def _job_snapshot(job: dict):
+    event = {k: job[k] for k in ("job_id", "status", "progress", "error", "start_time", "name")}
+    event["queue_position"] = SCHEDULER.position(job["job_id"])
+    event["queue_depth"] = SCHEDULER.depth()
+    if job["status"] == "completed":
+        event["result"] = job["result"]
+    elif job["result"] and job["result"].get("preview"):
+        event["preview"] = job["result"]["preview"]
+    return event
+
+@app.get("/api/jobs/{job_id}/events")
+async def stream_job_events(job_id: str, last_event_id: Optional[str] = Header(None)):
+    """Server-Sent Events feed of a job's update_job transitions.
+
+    Resumes from Last-Event-ID when the replay log still covers the gap and
+    falls back to a full snapshot otherwise. Heartbeats double as a store
+    check, which also picks up jobs running in another worker process.
+    """
+    from starlette.concurrency import run_in_threadpool
+
+    job = await run_in_threadpool(JOB_STORE.get, job_id)
+    if not job:
         raise HTTPException(status_code=404, detail="Job not found")
-    return JOBS[job_id]
+
+    async def stream():
+        entry = JOB_EVENTS.subscribe(job_id)
+        try:
+            yield "retry: 3000\n\n"
+            after = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+            missed = JOB_EVENTS.replay(job_id, after) if after is not None else None
+            if missed is None:
+                # Re-read after subscribing so no transition slips between the two
+                last = _job_snapshot(await run_in_threadpool(JOB_STORE.get, job_id) or job)
+                yield _sse(last, JOB_EVENTS.last_seq(job_id))
+            else:
+                last = None
+                for seq, event in missed:
+                    last = event
+                    yield _sse(event, seq)
+            if (last and _settled(last)) or _settled(job):
+                return
+
+            while True:
+                try:
+                    seq, event = await asyncio.wait_for(entry[1].get(), timeout=SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    current = await run_in_threadpool(JOB_STORE.get, job_id)
+                    if not current:
+                        yield _sse({"job_id": job_id, "status": "gone"}, name="gone")
+                        return
+                    snapshot = _job_snapshot(current)
+                    if last is None or any(snapshot.get(k) != last.get(k)
+                                           for k in ("status", "progress", "queue_position", "result")):
+                        last = snapshot
+                        yield _sse(snapshot, JOB_EVENTS.last_seq(job_id))
+                    else:
+                        yield ": heartbeat\n\n"
+                    if _settled(snapshot):
+                        return
+                    continue
+                last = event
+                yield _sse(event, seq)
+                if _settled(event):
+                    return
+        finally:
+            JOB_EVENTS.unsubscribe(job_id, entry)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",  # Don't let nginx-style proxies buffer the stream
+    })
+
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE = 200
+
+def _encode_cursor(created_at: str, project_id: str):
+    return base64.urlsafe_b64encode(json.dumps([created_at, project_id]).encode()).decode()
+
+def _decode_cursor(cursor: str):
+    try:
+        created_at, project_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(created_at), str(project_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 @app.get("/api/history")
-def get_history(user: dict = Depends(get_current_user)):
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
+def get_history(limit: int = HISTORY_PAGE_SIZE, cursor: Optional[str] = None,
+                user: dict = Depends(get_current_user)):
+    limit = max(1, min(limit, HISTORY_MAX_PAGE))
     
-    # Get user projects
-    c.execute("SELECT * FROM projects WHERE user_id = ? ORDER BY created_at DESC", (user["id"],))
-    rows = c.fetchall()
+    # Get user projects (newest first) straight from idx_projects_user; one extra row tells us if there is more
+    if cursor:
+        created_at, project_id = _decode_cursor(cursor)
+        rows = DB.query("SELECT id, name, folder_path, created_at, manifest FROM projects "
+                        "WHERE user_id = ? AND (created_at < ? OR (created_at = ? AND id < ?)) "
+                        "ORDER BY created_at DESC, id DESC LIMIT ?",
+                        (user["id"], created_at, created_at, project_id, limit + 1))
+    else:
+        rows = DB.query("SELECT id, name, folder_path, created_at, manifest FROM projects "
+                        "WHERE user_id = ? ORDER BY created_at DESC, id DESC LIMIT ?",
+                        (user["id"], limit + 1))
     
     projects = []
-    for r in rows:
-        folder_name = r["folder_path"]
-        folder_path = OUTPUT_DIR / "htdemucs" / folder_name
-        
-        stems = {}
-        thumbnail_url = None
-        
-        if folder_path.exists():
-            for f in folder_path.glob("*.wav"):
-                stems[f.stem] = f"/stems/htdemucs/{folder_name}/{f.name}"
-            if not stems:
-                for f in folder_path.glob("*.mp3"):
-                    stems[f.stem] = f"/stems/htdemucs/{folder_name}/{f.name}"
-            
-            # Find Thumbnail
-            for img in folder_path.glob("thumbnail.*"): 
-                if img.suffix in ['.jpg', '.jpeg', '.png', '.webp']:
-                    thumbnail_url = f"/stems/htdemucs/{folder_name}/{img.name}"
-                    break
-        
+    for r in rows[:limit]:
+        manifest = json.loads(r["manifest"]) if r["manifest"] else {}
+        if "stems" not in manifest:
+            # Project predates manifests: scan its folder once and store the result
+            manifest = build_manifest(OUTPUT_DIR / "htdemucs" / r["folder_path"], manifest.get("analysis"))
+            DB.execute("UPDATE projects SET manifest = ?, bytes = ? WHERE id = ?",
+                       (json.dumps(manifest), manifest["bytes"], r["id"]))
+
         projects.append({
             "id": r["id"],
             "name": r["name"],
             "date": r["created_at"],
-            "stems": stems,
-            "thumbnail": thumbnail_url
+            "stems": manifest["stems"],
+            "formats": manifest["formats"],
+            "sizes": manifest.get("sizes", {}),
+            "durations": manifest.get("durations", {}),
+            "analysis": manifest.get("analysis"),
+            "thumbnail": manifest.get("thumbnail")
         })
-    conn.close()
-    return {"projects": projects}
+    next_cursor = _encode_cursor(rows[limit - 1]["created_at"], rows[limit - 1]["id"]) if len(rows) > limit else None
+    return {"projects": projects, "next_cursor": next_cursor}
 
 @app.delete("/api/projects/{project_id}")
 def delete_project(project_id: str, user: dict = Depends(get_current_user)):
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    c = conn.cursor()
-    
-    c.execute("SELECT folder_path, user_id FROM projects WHERE id = ?", (project_id,))
-    row = c.fetchone()
+    row = DB.query_one("SELECT folder_path, user_id FROM projects WHERE id = ?", (project_id,))
     
     if not row:
-        conn.close()
         raise HTTPException(status_code=404, detail="Project not found")
         
     if row[1] != user["id"] and not user["is_admin"]:
-        conn.close()
         raise HTTPException(status_code=403, detail="Not authorized")
         
-    folder_name = row[0]
-    folder_path = OUTPUT_DIR / "htdemucs" / folder_name
-    
-    c.execute("DELETE FROM projects WHERE id = ?", (project_id,))
-    conn.commit()
-    conn.close()
-    
-    if folder_path.exists() and folder_path.is_dir():
-        shutil.rmtree(folder_path)
-
-    # Cleanup Input Files
-    # The project ID corresponds to the input file stem (internal_id)
-    # We look for any file in INPUT_DIR with that name (ignoring extension)
-    for f in INPUT_DIR.glob(f"{folder_name}.*"):
-        try:
-            f.unlink()
-        except:
-            pass
+    # Row, stems folder and any input files left under the same internal id
+    STORAGE.remove_project(project_id, row[0])
 
     return {"message": "Deleted"}
 
 @app.post("/api/sync")
 def sync_legacy_projects(user: dict = Depends(get_current_user)):
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    c = conn.cursor()
-    
     base_out = OUTPUT_DIR / "htdemucs_6s"
     if not base_out.exists():
-        conn.close()
         return {"added": 0}
         
-    existing_folders = set()
-    rows = c.execute("SELECT folder_path FROM projects").fetchall()
-    for r in rows:
-        existing_folders.add(r[0])
-        
     added_count = 0
-    for folder in base_out.iterdir():
-        if folder.is_dir():
-            if folder.name not in existing_folders:
-                pid = str(uuid.uuid4())
-                c.execute("INSERT INTO projects VALUES (?, ?, ?, ?, ?)",
-                          (pid, user["id"], folder.name, folder.name, str(datetime.datetime.now())))
-                added_count += 1
+    with DB.connect() as conn:
+        existing_folders = set()
+        rows = conn.execute("SELECT folder_path FROM projects").fetchall()
+        for r in rows:
+            existing_folders.add(r[0])
+            
+        for folder in base_out.iterdir():
+            if folder.is_dir():
+                if folder.name not in existing_folders:
+                    pid = str(uuid.uuid4())
+                    insert_project(conn, pid, user["id"], folder.name, folder.name)
+                    added_count += 1
                 
     return {"added": added_count}
 
 @app.post("/api/debug/test_project")
 def create_test_project(user: dict = Depends(get_current_user)):
-    conn = sqlite3.connect(DB_PATH)
     project_id = str(uuid.uuid4())
     folder_name = project_id 
-    folder_path = OUTPUT_DIR / "htdemucs_6s" / folder_name
+    folder_path = OUTPUT_DIR / MODEL_NAME / folder_name
     folder_path.mkdir(parents=True, exist_ok=True)
     
     for stem in ["vocals", "drums", "bass", "other"]:
@@ -1142,10 +4224,8 @@ def create_test_project(user: dict = Depends(get_current_user)):
     with open(folder_path / "thumbnail.jpg", "wb") as f:
         pass # Empty file just for existence check
         
-    conn.execute("INSERT INTO projects VALUES (?, ?, ?, ?, ?)",
-                 (project_id, user["id"], "Debug Project " + project_id[:4], folder_name, str(datetime.datetime.now())))
-    conn.commit()
-    conn.close()
+    with DB.connect() as conn:
+        insert_project(conn, project_id, user["id"], "Debug Project " + project_id[:4], folder_name)
     return {"message": "Test project created", "id": project_id}
 
 # --- Subscription / Admin ---
@@ -1167,7 +4247,7 @@ def admin_users(user: dict = Depends(get_current_user)):
     users = []
     if HAS_FIREBASE:
         try:
-            docs = db_client.collection('users').stream()
+            docs = firestore_client().collection('users').stream()
             for doc in docs:
                 users.append(doc.to_dict())
         except: pass
@@ -1175,11 +4255,7 @@ def admin_users(user: dict = Depends(get_current_user)):
     # Merge with SQLite or just return what we have (Hybrid view?)
     # For now, let's just return what we found in Firestore if available, else SQLite
     if not users:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute("SELECT * FROM users")
-        rows = c.fetchall()
-        conn.close()
+        rows = DB.query("SELECT * FROM users")
         for r in rows:
             users.append({
                 "id": r[0], "username": r[1],
@@ -1211,15 +4287,15 @@ def admin_delete_user(payload: dict, admin: dict = Depends(get_current_user)):
     
     if HAS_FIREBASE:
         try:
-            db_client.collection('users').document(target_id).delete()
+            firestore_client().collection('users').document(target_id).delete()
         except: pass
 
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute("DELETE FROM users WHERE id = ?", (target_id,))
-    conn.execute("DELETE FROM sessions WHERE user_id = ?", (target_id,))
-    conn.execute("DELETE FROM projects WHERE user_id = ?", (target_id,))
-    conn.commit()
-    conn.close()
+    with DB.connect() as conn:
+        conn.execute("DELETE FROM users WHERE id = ?", (target_id,))
+        conn.execute("DELETE FROM sessions WHERE user_id = ?", (target_id,))
+        conn.execute("DELETE FROM projects WHERE user_id = ?", (target_id,))
+    USER_CACHE.invalidate(target_id)
+    SESSION_CACHE.invalidate_value(target_id)
     
     return {"message": "User deleted"}
 
@@ -1228,11 +4304,38 @@ def admin_stats(user: dict = Depends(get_current_user)):
     if not user["is_admin"]:
         raise HTTPException(status_code=403, detail="Admin only")
     
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    total_users = c.execute("SELECT COUNT(*) FROM users").fetchone()[0]
-    conn.close()
-    return {"total_users": total_users}
+    total_users = DB.query_one("SELECT COUNT(*) FROM users")[0]
+    return {"total_users": total_users, "engine": ENGINE.stats(), "separation_cache": SEPARATION_CACHE.stats(),
+            "encoder": STEM_ENCODER.stats(), "db": DB.stats(), "storage": STORAGE.stats(),
+            "scheduler": SCHEDULER.stats(),
+            "auth_cache": {"sessions": SESSION_CACHE.stats(), "users": USER_CACHE.stats()}}
+
+METRICS_TOKEN = os.getenv("AURA_METRICS_TOKEN")  # Optional bearer token for scrapers
+
+METRICS = [
+    STAGE_SECONDS,
+    JOB_SECONDS,
+    STAGE_FAILURES,
+    JOBS_FINISHED,
+    FIRST_AUDIO_SECONDS,
+    QUEUE_WAIT_SECONDS,
+    Gauge("aura_queue_depth", "Jobs waiting for a worker.", lambda: SCHEDULER.depth()),
+    Gauge("aura_active_jobs", "Jobs running on this process.", lambda: SCHEDULER.active_count()),
+    Gauge("aura_workers", "Worker threads configured.", lambda: SCHEDULER.workers),
+    Gauge("aura_jobs_stored", "Job records in the job store.", lambda: JOB_STORE.count()),
+    Gauge("aura_process_rss_bytes", "Resident set size of this process.", process_rss_bytes),
+    Gauge("aura_storage_bytes", "Bytes held by project folders.", lambda: STORAGE.usage()),
+    Gauge("aura_model_loaded", "1 once the separation model is resident.", lambda: int(ENGINE.model is not None)),
+]
+
+@app.get("/metrics")
+def metrics(authorization: Optional[str] = Header(None)):
+    if METRICS_TOKEN and authorization != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return Response("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
 
 @app.delete("/api/admin/clean_system")
 def admin_clean_system(user: dict = Depends(get_current_user)):
@@ -1240,13 +4343,10 @@ def admin_clean_system(user: dict = Depends(get_current_user)):
         raise HTTPException(status_code=403, detail="Admin only")
     
     # 1. Delete Jobs
-    JOBS.clear()
+    JOB_STORE.clear()
     
     # 2. Delete DB Projects
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute("DELETE FROM projects")
-    conn.commit()
-    conn.close()
+    DB.execute("DELETE FROM projects")
     
     # 3. Delete Files (Input/Output)
     def clean_dir(path: Path):
@@ -1258,6 +4358,7 @@ def admin_clean_system(user: dict = Depends(get_current_user)):
     
     clean_dir(INPUT_DIR)
     clean_dir(OUTPUT_DIR)
+    SEPARATION_CACHE.clear()
     
     # Re-create htdemucs folder
     (OUTPUT_DIR / "htdemucs").mkdir(exist_ok=True)
@@ -1267,10 +4368,8 @@ def admin_clean_system(user: dict = Depends(get_current_user)):
 @app.post("/api/dev/make_admin")
 def dev_make_admin(user: dict = Depends(get_current_user)):
     # LOCAL DEV ONLY: Promote current user to admin
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute("UPDATE users SET is_admin = 1 WHERE id = ?", (user["id"],))
-    conn.commit()
-    conn.close()
+    DB.execute("UPDATE users SET is_admin = 1 WHERE id = ?", (user["id"],))
+    USER_CACHE.invalidate(user["id"])
     return {"message": f"User {user['username']} is now Admin"}
 
 # --- Static Mounts ---
@@ -111,7 +111,11 @@ document.addEventListener('DOMContentLoaded', async () => {
 
     // Input file listener
     const fileInput = document.getElementById('file-input');
-    if (fileInput) fileInput.onchange = e => { if (e.target.files.length) processFile(e.target.files[0]); };
+    if (fileInput) fileInput.onchange = e => {
+        const files = e.target.files;
+        if (files.length > 1) processBatch(Array.from(files));
+        else if (files.length) processFile(files[0]);
+    };
 });
 
 // --- View Logic ---
@@ -144,16 +148,152 @@ function switchInput(mode) {
     }
 }
 
-// Shared Polling Logic
+// Shared Job Tracking: push (SSE) first, polling as fallback
+let activeJobTracker = null;
+
 function startJobPolling(job_id) {
     // 1. Persist ID
     localStorage.setItem('active_stem_job', job_id);
 
+    if (activeJobTracker) activeJobTracker.stop();
+    activeJobTracker = window.EventSource ? streamJob(job_id) : pollJob(job_id);
+}
+
+function jobLost() {
+    localStorage.removeItem('active_stem_job');
+    console.warn("Job not found, resetting UI");
+    showToast("Previous active job lost (Server Restart?)");
+    resetWorkspace();
+}
+
+function renderJobTimer(startTime) {
+    const elapsed = Math.max(0, Math.floor(Date.now() / 1000 - startTime));
+    const mins = Math.floor(elapsed / 60).toString().padStart(2, '0');
+    const secs = (elapsed % 60).toString().padStart(2, '0');
+    const timerEl = document.getElementById('process-timer');
+    if (timerEl) timerEl.textContent = `${mins}:${secs}`;
+}
+
+function dashboardVisible() {
+    const dash = document.getElementById('dashboard-jobs');
+    return dash && !dash.classList.contains('hidden');
+}
+
+// Job whose mixer is open while its Opus/FLAC encodes are still running
+let encodingJob = null;
+
+// Apply one job state to the UI. Returns true once the job is finished.
+function applyJobUpdate(job) {
+    // 1. Success Condition
+    if (job.status === 'completed' && job.result && job.result.tracks) {
+        updateCredits(job.result.credits_left);
+        finishBatch(job.result);
+        return true;
+    }
+    if (job.status === 'completed' && job.result) {
+        const encoding = job.result.encoding && job.result.encoding.length;
+        if (encodingJob && encodingJob.id === job.job_id) {
+            // Second completion event: the encodes landed after the mixer opened
+            if (encoding) return false;
+            encodingJob.result.formats = job.result.formats;
+            upgradePlayback(job.result.formats);
+            encodingJob = null;
+            return true;
+        }
+        encodingJob = encoding ? { id: job.job_id, result: job.result } : null;
+        updateCredits(job.result.credits_left);
+
+        const titleEl = document.getElementById('loading-title');
+        if (titleEl) {
+            titleEl.textContent = "Production Ready!";
+            titleEl.style.color = "var(--success)";
+        }
+
+        finishProcessing(job.result);
+        return !encoding;
+    }
+
+    // 2. Fail Condition
+    if (job.status === 'failed') {
+        localStorage.removeItem('active_stem_job');
+        showToast("Treatment Failed: " + (job.error || "Unknown"));
+        resetWorkspace();
+        return true;
+    }
+
+    // 3. Preview published while the full-quality pass keeps running
+    const preview = job.preview || (job.result && job.result.preview);
+    if (preview) showPreview(preview);
+
+    // 4. Update UI Status (REAL SERVER SYNC)
+    if (job.message) updateStatus(job.message);
+    const titleEl = document.getElementById('loading-title');
+    if (titleEl) titleEl.textContent = job.message || job.status.split('...')[0];
+
+    // 5. Sync Timer (Server Side Time)
+    if (job.start_time) renderJobTimer(job.start_time);
+
+    // 6. Update Progress Bar
+    const progContainer = document.getElementById('upload-progress-container');
+    const progBar = document.getElementById('upload-bar');
+    const progText = document.getElementById('upload-percent');
+
+    if (progContainer) {
+        progContainer.classList.remove('hidden');
+        progBar.style.width = (job.progress || 0) + "%";
+
+        let stage = "Processing";
+        if (job.status === 'downloading') stage = "Downloading";
+        if (job.status === 'queued') stage = job.queue_position ? `Queued (#${job.queue_position} of ${job.queue_depth})` : "Queued";
+
+        progText.textContent = `${stage}: ${Math.round(job.progress || 0)}%`;
+    }
+    return false;
+}
+
+// Push: one long-lived SSE connection; EventSource resumes via Last-Event-ID on its own
+function streamJob(job_id) {
+    const es = new EventSource(`${API_BASE}/jobs/${job_id}/events`);
+    let gotEvent = false;
+    let stopped = false;
+    let startTime = null;
+    let lastDash = 0;
+
+    // Keep the timer ticking between pushes without touching the network
+    const ticker = setInterval(() => { if (startTime) renderJobTimer(startTime); }, 1000);
+    const stop = () => { stopped = true; es.close(); clearInterval(ticker); };
+
+    es.addEventListener('job', (e) => {
+        gotEvent = true;
+        const job = JSON.parse(e.data);
+        if (job.start_time) startTime = job.start_time;
+
+        const done = applyJobUpdate(job);
+        if (done) stop();
+
+        // Dashboard refresh rides on pushes (throttled) instead of a timer
+        if (dashboardVisible() && (done || Date.now() - lastDash > 3000)) {
+            lastDash = Date.now();
+            updateDashboard();
+        }
+    });
+    es.addEventListener('gone', () => { stop(); jobLost(); });
+    es.onerror = () => {
+        // Never got a single event (old server, proxy without SSE, 404): poll instead.
+        if (!gotEvent && !stopped) {
+            stop();
+            activeJobTracker = pollJob(job_id);
+        }
+    };
+    return { stop };
+}
+
+// Fallback: interval polling
+function pollJob(job_id) {
     // Status Poll Loop
     const poll = setInterval(async () => {
         try {
-            const dash = document.getElementById('dashboard-jobs');
-            if (dash && !dash.classList.contains('hidden')) {
+            if (dashboardVisible()) {
                 updateDashboard();
             }
 
@@ -168,70 +308,24 @@ function startJobPolling(job_id) {
             if (!res.ok) {
                 // Job is gone (404)
                 clearInterval(poll);
-                localStorage.removeItem('active_stem_job');
-                console.warn("Job not found, resetting UI");
-                showToast("Previous active job lost (Server Restart?)");
-                resetWorkspace();
+                jobLost();
                 return;
             }
             const job = await res.json();
-
-            // 1. Success Condition
-            if (job.status === 'completed' && job.result) {
-                clearInterval(poll);
-                updateCredits(job.result.credits_left);
-
-                const titleEl = document.getElementById('loading-title');
-                if (titleEl) {
-                    titleEl.textContent = "Production Ready!";
-                    titleEl.style.color = "var(--success)";
-                }
-
-                finishProcessing(job.result);
-                return;
-            }
-
-            // 2. Fail Condition
-            if (job.status === 'failed') {
-                clearInterval(poll);
-                localStorage.removeItem('active_stem_job');
-                showToast("Treatment Failed: " + (job.error || "Unknown"));
-                resetWorkspace();
-                return;
-            }
-
-            // 3. Update UI Status (REAL SERVER SYNC)
-            if (job.message) updateStatus(job.message);
-            const titleEl = document.getElementById('loading-title');
-            if (titleEl) titleEl.textContent = job.message || job.status.split('...')[0];
-
-            // 4. Sync Timer (Server Side Time)
-            if (job.start_time) {
-                const elapsed = Math.max(0, Math.floor(Date.now() / 1000 - job.start_time));
-                const mins = Math.floor(elapsed / 60).toString().padStart(2, '0');
-                const secs = (elapsed % 60).toString().padStart(2, '0');
-                const timerEl = document.getElementById('process-timer');
-                if (timerEl) timerEl.textContent = `${mins}:${secs}`;
-            }
-
-            // 5. Update Progress Bar
-            const progContainer = document.getElementById('upload-progress-container');
-            const progBar = document.getElementById('upload-bar');
-            const progText = document.getElementById('upload-percent');
-
-            if (progContainer) {
-                progContainer.classList.remove('hidden');
-                progBar.style.width = (job.progress || 0) + "%";
-
-                let stage = "Processing";
-                if (job.status === 'downloading') stage = "Downloading";
-                if (job.status === 'queued') stage = "Queued";
-
-                progText.textContent = `${stage}: ${Math.round(job.progress || 0)}%`;
-            }
+            if (applyJobUpdate(job)) clearInterval(poll);
 
         } catch (e) { console.error("Poll Error", e); }
     }, 1000);
+    return { stop: () => clearInterval(poll) };
+}
+
+// Readable message for a rejected job submission (e.g. 503 queue full)
+function jobStartError(data, fallback) {
+    const detail = data && data.detail;
+    if (!detail) return fallback;
+    if (typeof detail === 'string') return detail;
+    if (detail.message) return detail.message;
+    return fallback;
 }
 
 // --------------------------------------------------------
@@ -239,6 +333,7 @@ function startJobPolling(job_id) {
 function finishProcessing(result) {
     const wsLoad = document.getElementById('ws-loading');
     localStorage.removeItem('active_stem_job');
+    hidePreview();
 
     // Animation
     const borderEl = document.querySelector('.workspace-center');
@@ -246,7 +341,7 @@ function finishProcessing(result) {
 
     setTimeout(() => {
         try {
-            loadMixer(result.project.name, result.stems);
+            loadMixer(result.project.name, result.stems, result.formats);
             loadLibrary();
         } catch (e) {
             console.error(e);
@@ -256,6 +351,72 @@ function finishProcessing(result) {
 }
 
 
+// --- PREVIEW AUDITION ---
+let previewShown = null; // Stem URLs of the preview currently rendered
+
+function previewLabel(name) {
+    if (name === 'other') return 'INSTRUMENTS';
+    if (name === 'no_vocals') return 'INSTRUMENTAL';
+    return name.toUpperCase();
+}
+
+function showPreview(preview) {
+    const panel = document.getElementById('preview-panel');
+    const list = document.getElementById('preview-stems');
+    const audio = document.getElementById('preview-audio');
+    if (!panel || !list || !audio || !preview.stems) return;
+    const key = JSON.stringify(preview.stems);
+    if (previewShown === key) return;
+    previewShown = key;
+
+    document.getElementById('preview-seconds').textContent = Math.round(preview.seconds || 0);
+    list.innerHTML = '';
+    Object.entries(preview.stems).forEach(([name, url]) => {
+        const btn = document.createElement('button');
+        btn.className = 'preview-stem';
+        btn.style.borderColor = STEM_COLORS[name] || STEM_COLORS.other;
+        btn.innerHTML = `<i class="fa-solid fa-play"></i> ${previewLabel(name)}`;
+        btn.onclick = () => {
+            const playing = !audio.paused && audio.dataset.stem === name;
+            audio.pause();
+            list.querySelectorAll('.preview-stem i').forEach(i => { i.className = 'fa-solid fa-play'; });
+            if (playing) return;
+            if (audio.dataset.stem !== name) {
+                audio.src = url;
+                audio.dataset.stem = name;
+            }
+            audio.play().then(() => { btn.querySelector('i').className = 'fa-solid fa-pause'; })
+                .catch(err => console.warn("Preview playback failed", err));
+        };
+        list.appendChild(btn);
+    });
+    audio.onended = () => list.querySelectorAll('.preview-stem i').forEach(i => { i.className = 'fa-solid fa-play'; });
+    panel.classList.remove('hidden');
+}
+
+function hidePreview() {
+    const panel = document.getElementById('preview-panel');
+    const audio = document.getElementById('preview-audio');
+    if (audio) {
+        audio.pause();
+        audio.removeAttribute('src');
+        delete audio.dataset.stem;
+    }
+    if (panel) panel.classList.add('hidden');
+    previewShown = null;
+}
+
+// Album/playlist batch: one parent job, stems come as a single archive
+function finishBatch(result) {
+    localStorage.removeItem('active_stem_job');
+    hidePreview();
+    loadLibrary();
+    resetWorkspace();
+    const failed = result.failed ? ` (${result.failed} failed)` : '';
+    showToast(`Album ready: ${result.completed} tracks${failed}. Download it from your jobs.`);
+    updateDashboard();
+}
+
 // Remove Fake Loop (Nullify)
 function startProcessingLoop() { }
 
@@ -298,14 +459,20 @@ function renderDashboard(jobs) {
         return b.start_time - a.start_time; // Newest first
     });
 
-    if (sortedJobs.length === 0) {
+    // Album tracks are summarised on their batch card
+    const childCount = {};
+    jobs.forEach(j => { if (j.parent) childCount[j.parent] = (childCount[j.parent] || 0) + 1; });
+    const topJobs = sortedJobs.filter(j => !j.parent);
+
+    if (topJobs.length === 0) {
         container.classList.add('hidden');
         return;
     }
 
-    sortedJobs.forEach(job => {
+    topJobs.forEach(job => {
         const div = document.createElement('div');
         div.className = 'job-card-premium';
+        const trackCount = childCount[job.job_id] ? ` · ${childCount[job.job_id]} tracks` : '';
 
         // Timer Logic
         let timerStr = '';
@@ -335,10 +502,10 @@ function renderDashboard(jobs) {
             </div>
             
             <div class="job-info">
-                <div class="job-title">${job.name || 'Untitled Project'}</div>
+                <div class="job-title">${job.name || 'Untitled Project'}${trackCount}</div>
                 <div class="job-status">
                     <div class="status-dot" style="background:${job.status === 'failed' ? 'red' : 'var(--accent)'}"></div>
-                    ${job.status === 'processing' ? 'SEPARATING STEMS...' : job.status.toUpperCase()}
+                    ${job.status === 'processing' ? 'SEPARATING STEMS...' : job.status.toUpperCase()}${job.status === 'queued' && job.queue_position ? ` #${job.queue_position}` : ''}
                 </div>
             </div>
             
@@ -354,9 +521,12 @@ function renderDashboard(jobs) {
 }
 
 function handleJobClick(job) {
-    if (job.status === 'completed' && job.result) {
+    if (job.status === 'completed' && job.result && job.result.archive) {
+        // Album: one ZIP with a folder per track
+        window.location.href = job.result.archive;
+    } else if (job.status === 'completed' && job.result) {
         // Open Mixer
-        loadMixer(job.result.project.name, job.result.stems);
+        loadMixer(job.result.project.name, job.result.stems, job.result.formats);
     } else if (job.status === 'failed') {
         showToast("Job Failed: " + job.error);
     } else {
@@ -396,6 +566,8 @@ async function processUrl() {
 
     const formData = new FormData();
     formData.append("url", url);
+    const stemMode = selectedStemMode();
+    if (stemMode) formData.append("two_stems", stemMode);
 
     try {
         const res = await fetch(`${API_BASE}/process_youtube_async`, {
@@ -404,7 +576,10 @@ async function processUrl() {
             body: formData
         });
 
-        if (!res.ok) throw new Error("Failed to start job");
+        if (!res.ok) {
+            const err = await res.json().catch(() => null);
+            throw new Error(jobStartError(err, "Failed to start job"));
+        }
         const { job_id } = await res.json();
 
         startJobPolling(job_id);
@@ -505,12 +680,14 @@ async function processFile(file) {
     // FALLTHROUGH TO LOCAL UPLOAD 👇
 
     // FALLBACK (Original Local Upload)
-    const formData = new FormData();
-    formData.append("file", file);
-
+    // Raw body (not multipart): the server writes it once and can reject
+    // non-audio / oversized files after the first few KB.
     const xhr = new XMLHttpRequest();
-    xhr.open("POST", `${API_BASE}/process_file_async`, true);
+    const stemMode = selectedStemMode();
+    const stemQuery = stemMode ? `&two_stems=${encodeURIComponent(stemMode)}` : '';
+    xhr.open("POST", `${API_BASE}/upload?filename=${encodeURIComponent(file.name)}${stemQuery}`, true);
     xhr.setRequestHeader("Authorization", `Bearer ${t}`);
+    xhr.setRequestHeader("Content-Type", file.type || "application/octet-stream");
 
     xhr.upload.onprogress = (e) => {
         if (e.lengthComputable) {
@@ -526,11 +703,59 @@ async function processFile(file) {
             document.getElementById('upload-progress-container').classList.add('hidden');
             startJobPolling(data.job_id);
         } else {
-            showToast("Upload Failed");
+            let err = null;
+            try { err = JSON.parse(xhr.responseText); } catch (e) { }
+            showToast(jobStartError(err, "Upload Failed"));
             resetWorkspace();
         }
     };
 
+    xhr.send(file);
+}
+
+// Several files at once: one batch (album) job, children share the engine's batches
+async function processBatch(files) {
+    if (!currentUser) { showToast("Please login first"); return; }
+    const t = localStorage.getItem('aura_token');
+    if (!t) { showToast("Please login first"); return; }
+
+    document.getElementById('ws-drop').classList.add('hidden');
+    document.getElementById('ws-loading').classList.remove('hidden');
+    document.getElementById('processing-log').innerHTML = '';
+    const timerEl = document.getElementById('process-timer');
+    if (timerEl) timerEl.textContent = "00:00";
+    document.getElementById('loading-title').textContent = `Uploading ${files.length} Tracks...`;
+    document.getElementById('upload-progress-container').classList.remove('hidden');
+    const uBar = document.getElementById('upload-bar');
+    const uText = document.getElementById('upload-percent');
+
+    const formData = new FormData();
+    files.forEach(f => formData.append("files", f, f.name));
+    const stemMode = selectedStemMode();
+    if (stemMode) formData.append("two_stems", stemMode);
+
+    const xhr = new XMLHttpRequest();
+    xhr.open("POST", `${API_BASE}/process_batch`, true);
+    xhr.setRequestHeader("Authorization", `Bearer ${t}`);
+    xhr.upload.onprogress = (e) => {
+        if (e.lengthComputable) {
+            const percent = Math.round((e.loaded / e.total) * 100);
+            uBar.style.width = percent + "%";
+            uText.textContent = percent + "%";
+        }
+    };
+    xhr.onload = () => {
+        if (xhr.status === 200) {
+            const data = JSON.parse(xhr.responseText);
+            document.getElementById('upload-progress-container').classList.add('hidden');
+            startJobPolling(data.job_id);
+        } else {
+            let err = null;
+            try { err = JSON.parse(xhr.responseText); } catch (e) { }
+            showToast(jobStartError(err, "Upload Failed"));
+            resetWorkspace();
+        }
+    };
     xhr.send(formData);
 }
 
@@ -987,6 +1212,7 @@ const wsMixer = document.getElementById('ws-mixer');
 
 function resetWorkspace() {
     stopPlayback();
+    hidePreview();
     // Reset visibility driven by classes
     if (wsDrop) {
         wsDrop.classList.remove('hidden');
@@ -1108,6 +1334,12 @@ const STEM_COLORS = {
     other: '#48C9B0'   // Teal (Instruments)
 };
 
+// Two-stem ("karaoke") mode: the server returns e.g. vocals + no_vocals
+function selectedStemMode() {
+    const el = document.getElementById('stem-mode');
+    return el ? el.value : '';
+}
+
 // Global Transport State
 let globalDuration = 0;
 let seekerInterval = null;
@@ -1129,7 +1361,38 @@ function closeMixer() {
     loadLibrary();
 }
 
-function loadMixer(title, stems) {
+// Playback source: Opus preview if the browser can play it, then FLAC, then the WAV master.
+// Encodes are produced after the job finishes: fresh results start on WAV and
+// upgradePlayback() switches once the job announces them.
+const PLAYBACK_PREFERENCE = [
+    ['opus', 'audio/ogg; codecs="opus"'],
+    ['flac', 'audio/flac'],
+];
+
+function playbackUrl(name, wavUrl, formats) {
+    const variants = formats && formats[name];
+    if (variants) {
+        const probe = document.createElement('audio');
+        for (const [fmt, mime] of PLAYBACK_PREFERENCE) {
+            if (variants[fmt] && probe.canPlayType(mime)) return variants[fmt];
+        }
+    }
+    return wavUrl;
+}
+
+// Switch paused stems of the open project to encodes that finished after it loaded
+function upgradePlayback(formats) {
+    Object.entries(stemsAudio).forEach(([name, s]) => {
+        const src = playbackUrl(name, null, formats);
+        if (!src || !s.audio.paused || s.audio.src.endsWith(src)) return;
+        if (!s.audio.src.includes(`/${src.split('/')[3]}/`)) return; // Another project is open now
+        const at = s.audio.currentTime;
+        s.audio.src = src;
+        s.audio.addEventListener('loadedmetadata', () => { s.audio.currentTime = at; }, { once: true });
+    });
+}
+
+function loadMixer(title, stems, formats) {
     if (!stems) return;
 
     // Extract ID
@@ -1174,7 +1437,7 @@ function loadMixer(title, stems) {
     const tpl = document.getElementById('channel-template');
 
     // Determine Order: Vocals, Drums, Bass, Instruments
-    const sortOrder = ['vocals', 'drums', 'bass', 'other'];
+    const sortOrder = ['vocals', 'no_vocals', 'drums', 'bass', 'other'];
     const sortedKeys = Object.keys(stems).sort((a, b) => sortOrder.indexOf(a) - sortOrder.indexOf(b));
 
     // Global Duration Sync
@@ -1189,8 +1452,8 @@ function loadMixer(title, stems) {
     if (durDisplay) durDisplay.textContent = "00:00";
 
     sortedKeys.forEach((name, index) => {
-        const url = stems[name];
-        const audio = new Audio(url);
+        const url = stems[name]; // WAV master (download link)
+        const audio = new Audio(playbackUrl(name, url, formats));
         audio.preload = 'auto';
         audio.crossOrigin = 'anonymous';
         audio.loop = false; // We handle loop or end manually? Let's just stop at end.
@@ -1250,6 +1513,8 @@ function loadMixer(title, stems) {
         if (name === 'percussion') { displayName = 'DRUMS'; color = STEM_COLORS.drums; } // Handle both names
         if (name === 'bass') { color = STEM_COLORS.bass; }
         if (name === 'other') { displayName = 'INSTRUMENTS'; color = STEM_COLORS.other; }
+        if (name === 'no_vocals') { displayName = 'INSTRUMENTAL'; color = STEM_COLORS.other; }
+        else if (name.startsWith('no_')) { displayName = 'NO ' + name.slice(3).toUpperCase(); }
 
         strip.querySelector('.ch-name').textContent = displayName;
         strip.querySelector('.ch-name').style.color = color;
@@ -1261,7 +1526,7 @@ function loadMixer(title, stems) {
         if (name === 'vocals') iconDiv.innerHTML = '<i class="fa-solid fa-microphone-lines"></i>';
         if (name === 'drums' || name === 'percussion') iconDiv.innerHTML = '<i class="fa-solid fa-drum"></i>';
         if (name === 'bass') iconDiv.innerHTML = '<i class="fa-solid fa-wave-square"></i>';
-        if (name === 'other') iconDiv.innerHTML = '<i class="fa-solid fa-guitar"></i>';
+        if (name === 'other' || name === 'no_vocals') iconDiv.innerHTML = '<i class="fa-solid fa-guitar"></i>';
 
         // Styling the Strip Border to match Stem
         const stripDiv = strip.querySelector('.channel-strip');
@@ -1313,7 +1578,7 @@ function loadMixer(title, stems) {
             drawMockWaveform(cvs.getContext('2d'), cw, ch, color, name); // Ensure name is passed
 
             // 2. Async Real Waveform Generation
-            renderWaveform(url, color).then(bg => {
+            renderWaveform(url, color, `${API_BASE}/peaks/${projectId}/${name}?width=800`).then(bg => {
                 if (stemsAudio[name]) {
                     stemsAudio[name].bgCanvas = bg;
                     // Force a redraw
@@ -1411,7 +1676,53 @@ function loadMixer(title, stems) {
 }
 
 // --- Waveform Service ---
-async function renderWaveform(url, color) {
+// Server-computed peaks ("APK1" blob: u32 samplerate, frames, samplesPerBucket, buckets,
+// then int8 min/max pairs). A few KB instead of a whole stem download + decode.
+async function renderPeaks(peaksUrl, color) {
+    const resp = await fetch(peaksUrl);
+    if (!resp.ok) throw new Error(`Peaks HTTP ${resp.status}`);
+    const buf = await resp.arrayBuffer();
+    const view = new DataView(buf);
+    if (buf.byteLength < 20 || view.getUint32(0, true) !== 0x314B5041) throw new Error('Bad peaks blob'); // "APK1"
+    const buckets = view.getUint32(16, true);
+    const pairs = new Int8Array(buf, 20, buckets * 2);
+
+    const cvs = document.createElement('canvas');
+    cvs.width = 800;
+    cvs.height = 100;
+    const ctx = cvs.getContext('2d');
+    const amp = cvs.height / 2;
+    const step = buckets / cvs.width;
+    ctx.fillStyle = color;
+
+    for (let i = 0; i < cvs.width; i++) {
+        const from = Math.floor(i * step);
+        const to = Math.max(from + 1, Math.floor((i + 1) * step));
+        let min = 127;
+        let max = -127;
+        for (let j = from; j < to && j < buckets; j++) {
+            if (pairs[2 * j] < min) min = pairs[2 * j];
+            if (pairs[2 * j + 1] > max) max = pairs[2 * j + 1];
+        }
+        if (max < min) continue; // Past the end of a short stem
+
+        const h = Math.max(2, ((max - min) / 127) * amp * 1.2);
+        const y = amp - (h / 2);
+        ctx.beginPath();
+        ctx.roundRect(i, y, 2, h, 20);
+        ctx.fill();
+    }
+    return cvs;
+}
+
+async function renderWaveform(url, color, peaksUrl) {
+    if (peaksUrl) {
+        try {
+            return await renderPeaks(peaksUrl, color);
+        } catch (e) {
+            console.warn("Peaks unavailable, decoding audio", e);
+        }
+    }
     try {
         const resp = await fetch(url);
         const arrayBuffer = await resp.arrayBuffer();
@@ -1949,6 +2260,90 @@ function initAdvancedParticles() {
 }
 
 // Override Load Library to use Thumbnails
+function libraryCard(p) {
+    let dateStr = "Unknown Date";
+    try {
+        const safeDate = p.date.replace(" ", "T");
+        dateStr = new Date(safeDate).toLocaleDateString(undefined, { year: 'numeric', month: 'short', day: 'numeric' });
+    } catch (e) { }
+
+    const stemsCount = p.stems ? Object.keys(p.stems).length : 0;
+    const isValid = stemsCount > 0;
+    // Stems the engine found silent (from the stored level analysis)
+    const silentStems = p.analysis
+        ? Object.keys(p.analysis).filter(name => p.analysis[name].silent)
+        : [];
+    const silentTag = silentStems.length
+        ? `<span class="tag" title="No signal in: ${silentStems.join(', ')}">${silentStems.length} SILENT</span>`
+        : '';
+
+    const div = document.createElement('div');
+    div.className = 'lib-item library-card'; // Add library-card for styles
+    if (!isValid) div.style.opacity = '0.6';
+
+    // Thumbnail vs Icon
+    let coverHtml = `<i class="fa-solid fa-record-vinyl"></i>`;
+    let coverStyle = '';
+    if (p.thumbnail) {
+        coverHtml = '';
+        coverStyle = `background-image: url('${p.thumbnail}'); background-size: cover; background-position: center;`;
+    }
+
+    div.innerHTML = `
+    <div class="lib-cover" style="${coverStyle}">
+        ${coverHtml}
+    </div>
+    <div class="delete-btn" title="Delete Project" onclick="deleteProject(event, '${p.id}')">
+        <i class="fa-solid fa-trash"></i>
+    </div>
+    <div class="lib-meta">
+        <div class="lib-title">${p.name}</div>
+        <span class="lib-date">${dateStr}</span>
+        <div class="lib-tags">
+            <span class="tag">${stemsCount} STEMS</span>
+            <span class="tag">${isValid ? 'READY' : 'ERROR'}</span>
+            ${silentTag}
+        </div>
+    </div>
+ `;
+    div.onclick = (e) => {
+        if (!e.target.closest('.delete-btn') && isValid) {
+            navTo('workspace'); loadMixer(p.name, p.stems, p.formats);
+        }
+    };
+    return div;
+}
+
+// History is paginated (next_cursor); append a page of cards plus a "load more" button.
+function appendLibraryPage(box, data) {
+    (data.projects || []).forEach(p => box.appendChild(libraryCard(p)));
+
+    if (!data.next_cursor) return;
+    const more = document.createElement('button');
+    more.className = 'btn-outline';
+    more.style.gridColumn = '1/-1';
+    more.style.justifySelf = 'center';
+    more.textContent = 'Load more';
+    more.onclick = async () => {
+        more.disabled = true;
+        more.textContent = 'Loading...';
+        try {
+            const res = await fetch(`${API_BASE}/history?cursor=${encodeURIComponent(data.next_cursor)}`, {
+                headers: { 'Authorization': `Bearer ${authToken}` }
+            });
+            if (res.status === 401) { logout(); return; }
+            const page = await res.json();
+            more.remove();
+            appendLibraryPage(box, page);
+            setTimeout(initTiltEffect, 100);
+        } catch (e) {
+            more.disabled = false;
+            more.textContent = 'Load more';
+        }
+    };
+    box.appendChild(more);
+}
+
 async function loadLibrary() {
     const box = document.getElementById('library-list');
     if (!box) return;
@@ -1980,51 +2375,7 @@ async function loadLibrary() {
                 return;
             }
 
-            data.projects.forEach(p => {
-                let dateStr = "Unknown Date";
-                try {
-                    const safeDate = p.date.replace(" ", "T");
-                    dateStr = new Date(safeDate).toLocaleDateString(undefined, { year: 'numeric', month: 'short', day: 'numeric' });
-                } catch (e) { }
-
-                const stemsCount = p.stems ? Object.keys(p.stems).length : 0;
-                const isValid = stemsCount > 0;
-
-                const div = document.createElement('div');
-                div.className = 'lib-item library-card'; // Add library-card for styles
-                if (!isValid) div.style.opacity = '0.6';
-
-                // Thumbnail vs Icon
-                let coverHtml = `<i class="fa-solid fa-record-vinyl"></i>`;
-                let coverStyle = '';
-                if (p.thumbnail) {
-                    coverHtml = '';
-                    coverStyle = `background-image: url('${p.thumbnail}'); background-size: cover; background-position: center;`;
-                }
-
-                div.innerHTML = `
-                <div class="lib-cover" style="${coverStyle}">
-                    ${coverHtml}
-                </div>
-                <div class="delete-btn" title="Delete Project" onclick="deleteProject(event, '${p.id}')">
-                    <i class="fa-solid fa-trash"></i>
-                </div>
-                <div class="lib-meta">
-                    <div class="lib-title">${p.name}</div>
-                    <span class="lib-date">${dateStr}</span>
-                    <div class="lib-tags">
-                        <span class="tag">${stemsCount} STEMS</span>
-                        <span class="tag">${isValid ? 'READY' : 'ERROR'}</span>
-                    </div>
-                </div>
-             `;
-                div.onclick = (e) => {
-                    if (!e.target.closest('.delete-btn') && isValid) {
-                        navTo('workspace'); loadMixer(p.name, p.stems);
-                    }
-                };
-                box.appendChild(div);
-            });
+            appendLibraryPage(box, data);
 
             // Apply Tilt
             setTimeout(initTiltEffect, 500);
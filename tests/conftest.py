@@ -0,0 +1,38 @@
+"""Shared fixtures. `main` is imported from a scratch copy of main.py, so data.db,
+input/, output/ and cache/ of the checkout are never read or written (same rule
+as bench/_common.py). Nothing here loads the separation model.
+"""
+import importlib
+import shutil
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture(scope="session")
+def main(tmp_path_factory):
+    workdir = tmp_path_factory.mktemp("aura")
+    shutil.copy2(ROOT / "main.py", workdir / "main.py")
+    shutil.copytree(ROOT / "static", workdir / "static")
+    sys.path.insert(0, str(workdir))
+    sys.modules.pop("main", None)
+    module = importlib.import_module("main")
+    yield module
+    module.DB.close_all()
+    sys.path.remove(str(workdir))
+    sys.modules.pop("main", None)
+
+
+@pytest.fixture
+def make_user(main):
+    """make_user(plan="free", credits=10) -> user dict, as get_current_user returns it."""
+    def make(plan="free", credits=10):
+        user_id = str(uuid.uuid4())
+        main.DB.execute("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (user_id, f"u-{user_id[:8]}", "pw", 0, credits, plan, "now", None))
+        return main.get_user_compat(user_id)
+    return make
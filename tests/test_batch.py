@@ -0,0 +1,20 @@
+import uuid
+
+
+def test_batch_result_keeps_tracks_aligned_with_missing_children(main, make_user):
+    user = make_user()
+    children = [{"job_id": str(uuid.uuid4()), "title": title} for title in ("One", "Two", "Three")]
+    for child in (children[0], children[2]):
+        main.JOB_STORE.create(child["job_id"], user, child["title"], "batch_track", {})
+    main.JOB_STORE.update(children[0]["job_id"], status="completed",
+                          result={"project": "p1", "stems": {"vocals": "/v.wav"}})
+    main.JOB_STORE.update(children[2]["job_id"], status="failed", error="boom")
+
+    result = main.batch_result("parent", children, user, main.SegmentBatcher())
+
+    assert [(t["name"], t["status"]) for t in result["tracks"]] == [
+        ("One", "completed"), ("Two", "failed"), ("Three", "failed")]
+    assert result["tracks"][0]["project"] == "p1"
+    assert result["tracks"][1]["error"] == "Track job not found"
+    assert result["tracks"][2]["error"] == "boom"
+    assert (result["completed"], result["failed"]) == (1, 2)
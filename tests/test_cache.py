@@ -0,0 +1,49 @@
+import pytest
+
+
+@pytest.fixture
+def track(tmp_path):
+    path = tmp_path / "track.wav"
+    path.write_bytes(b"RIFF" + bytes(range(256)) * 64)
+    return path
+
+
+def test_key_is_content_addressed(main, track, tmp_path):
+    copy = tmp_path / "renamed.mp3"
+    copy.write_bytes(track.read_bytes())
+    assert main.SEPARATION_CACHE.key_for(copy) == main.SEPARATION_CACHE.key_for(track)
+    copy.write_bytes(track.read_bytes() + b"\0")
+    assert main.SEPARATION_CACHE.key_for(copy) != main.SEPARATION_CACHE.key_for(track)
+
+
+def test_entry_points_share_keys(main, track):
+    # /api/process hashes with the variant, the async/URL path adds it to a known key
+    for selection in (None, main.parse_stem_selection("vocals,bass", None), main.parse_stem_selection(None, "vocals")):
+        variant = main.output_variant(selection)
+        assert main.SEPARATION_CACHE.key_for(track, variant=variant) == \
+            main.SEPARATION_CACHE.with_variant(main.SEPARATION_CACHE.key_for(track), variant)
+
+
+def test_variants_never_collide(main, track):
+    selections = [None, main.parse_stem_selection("vocals", None), main.parse_stem_selection("vocals,bass", None),
+                  main.parse_stem_selection(None, "vocals"), main.parse_stem_selection(None, "drums")]
+    keys = {main.SEPARATION_CACHE.key_for(track, variant=main.output_variant(s)) for s in selections}
+    assert len(keys) == len(selections)
+    # Every stored entry is the polished output, whichever path wrote it
+    base = main.SEPARATION_CACHE.key_for(track)
+    assert all(key.startswith(base + "-polished") for key in keys)
+
+
+def test_store_restore_roundtrip(main, track, tmp_path):
+    src = tmp_path / "out"
+    src.mkdir()
+    (src / "vocals.wav").write_bytes(b"v" * 100)
+    (src / "notes.txt").write_text("not cached")
+    key = main.SEPARATION_CACHE.key_for(track, variant=main.output_variant(None))
+    main.SEPARATION_CACHE.store(key, src, meta={"analysis": {"vocals": {"silent": False}}})
+
+    dest = tmp_path / "project"
+    meta = main.SEPARATION_CACHE.restore(key, dest)
+    assert meta == {"analysis": {"vocals": {"silent": False}}}
+    assert sorted(p.name for p in dest.iterdir()) == ["vocals.wav"]
+    assert main.SEPARATION_CACHE.restore(key + "-other", tmp_path / "miss") is None
@@ -0,0 +1,58 @@
+import time
+import uuid
+
+import pytest
+
+
+@pytest.fixture
+def project(main, make_user):
+    """A completed job whose project has only its WAV master so far."""
+    user = make_user()
+    project_id, job_id = str(uuid.uuid4()), str(uuid.uuid4())
+    folder = main.OUTPUT_DIR / main.MODEL_NAME / project_id
+    folder.mkdir(parents=True)
+    (folder / "vocals.wav").write_bytes(b"RIFF")
+    manifest = main.build_manifest(folder)
+    with main.DB.connect() as conn:
+        main.insert_project(conn, project_id, user["id"], "Song", project_id, manifest)
+    main.JOB_STORE.create(job_id, user, "Song", "file", {})
+    result = {"stems": manifest["stems"], "formats": manifest["formats"],
+              "encoding": main.pending_encodes(manifest), "project": {"id": project_id, "name": "Song"}}
+    main.complete_job(job_id, result)
+    return job_id, folder
+
+
+def test_fresh_result_advertises_pending_encodes(main, project, monkeypatch):
+    job_id, folder = project
+    result = main.JOB_STORE.get(job_id)["result"]
+    assert result["formats"] == {"vocals": {"wav": f"/stems/htdemucs/{folder.name}/vocals.wav"}}
+    monkeypatch.setattr(main, "ffmpeg_binary", lambda: "/usr/bin/ffmpeg")
+    assert main.pending_encodes(main.build_manifest(folder)) == list(main.DELIVERY_FORMATS)
+    monkeypatch.setattr(main, "ffmpeg_binary", lambda: None)
+    assert main.pending_encodes(main.build_manifest(folder)) == []  # Nothing will ever land
+
+
+def test_finished_encodes_are_published_on_the_job(main, project, monkeypatch):
+    job_id, folder = project
+    main.JOB_STORE.update(job_id, result=dict(main.JOB_STORE.get(job_id)["result"], encoding=["opus", "flac"]))
+    assert not main._settled(main.JOB_STORE.get(job_id))  # SSE stays open for the encodes
+
+    def fake_encode(folder):
+        for fmt in main.DELIVERY_FORMATS:
+            (folder / f"vocals.{fmt}").write_bytes(b"x")
+        main.refresh_manifest(folder)
+    encoder = main.StemEncoder()
+    monkeypatch.setattr(encoder, "encode", fake_encode)
+    seq = main.JOB_EVENTS.last_seq(job_id)
+
+    encoder.submit(folder, job_id)
+    deadline = time.time() + 5
+    while encoder.pending:
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+    job = main.JOB_STORE.get(job_id)
+    assert set(job["result"]["formats"]["vocals"]) == {"wav", *main.DELIVERY_FORMATS}
+    assert job["result"]["encoding"] == [] and main._settled(job)
+    [(_, event)] = main.JOB_EVENTS.replay(job_id, seq)
+    assert event["result"]["formats"] == job["result"]["formats"]
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("demucs")
+
+
+@pytest.fixture(scope="module")
+def engine(main):
+    """A SeparationEngine holding a small untrained htdemucs (no download, no load())."""
+    from demucs.apply import BagOfModels
+    from demucs.htdemucs import HTDemucs
+    torch.manual_seed(0)
+    engine = main.SeparationEngine()
+    engine.model = BagOfModels([HTDemucs(sources=["drums", "bass", "other", "vocals"], channels=8,
+                                         t_layers=1, bottom_channels=0, segment=7.8)]).eval()
+    return engine
+
+
+@pytest.fixture
+def track(main, tmp_path):
+    # Decoded-upload PCM, so no ffmpeg is needed; long enough for several segments
+    t = np.arange(main.DECODE_SAMPLERATE * 20) / main.DECODE_SAMPLERATE
+    rng = np.random.default_rng(0)
+    pcm = np.stack([np.sin(2 * np.pi * 220 * t), np.sin(2 * np.pi * 330 * t)], 1) * 0.3
+    path = tmp_path / f"track{main.DECODED_SUFFIX}"
+    (pcm + rng.normal(0, 0.01, pcm.shape)).astype("<f4").tofile(path)
+    return path
+
+
+def test_segment_parallel_matches_sequential_apply_model(main, engine, track, monkeypatch):
+    from demucs.apply import apply_model
+    threads = torch.get_num_threads()
+    monkeypatch.setattr(main, "plan_parallelism", lambda active_jobs, mode=None: (1, 4))
+
+    stems, timing = engine.separate(track)
+
+    assert timing["segment_workers"] == 4
+    assert torch.get_num_threads() == threads  # Never changed per job
+    wav = engine.load_audio(track)
+    ref = wav.mean(0)
+    with torch.no_grad():
+        expected = apply_model(engine.model, ((wav - ref.mean()) / ref.std())[None], shifts=0, split=True,
+                               overlap=engine.overlap)[0] * ref.std() + ref.mean()
+    for name, out in zip(engine.model.sources, expected):
+        assert (stems[name] - out).abs().max() < 1e-4
+
+
+def test_threads_are_fixed_per_process(main, monkeypatch):
+    monkeypatch.setattr(main.os, "cpu_count", lambda: 8)
+    monkeypatch.setattr(main, "MAX_WORKERS", 2)
+    monkeypatch.setattr(main, "_available_ram_mb", lambda: None)
+    assert main.intra_op_threads("auto") == 4
+    assert main.plan_parallelism(1, "auto") == (4, 2)  # Lone job: the idle worker's cores run segments
+    assert main.plan_parallelism(2, "auto") == (4, 1)
+    assert main.plan_parallelism(1, "segments") == (1, 8)
+    assert main.plan_parallelism(4, "segments") == (1, 2)
+    assert main.plan_parallelism(1, "single") == (main.TORCH_THREADS, 1)
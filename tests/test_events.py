@@ -0,0 +1,41 @@
+import asyncio
+
+
+def test_replay_resumes_after_last_event_id(main):
+    bus = main.JobEventBus(history=4)
+    for i in range(3):
+        bus.publish("j", {"progress": i})
+    assert bus.last_seq("j") == 3
+    assert bus.replay("j", 1) == [(2, {"progress": 1}), (3, {"progress": 2})]
+    assert bus.replay("j", 3) == []
+
+
+def test_replay_gives_up_when_the_log_cannot_cover_the_gap(main):
+    bus = main.JobEventBus(history=2)
+    for i in range(5):
+        bus.publish("j", {"progress": i})
+    assert bus.replay("j", 3) == [(4, {"progress": 3}), (5, {"progress": 4})]
+    assert bus.replay("j", 2) is None  # Event 3 was dropped from the log
+    assert bus.replay("j", 9) is None  # Id from another process / before a restart
+    assert bus.replay("unknown", 0) is None
+
+
+def test_oldest_jobs_leave_the_log(main):
+    bus = main.JobEventBus(max_jobs=2)
+    for job_id in ("a", "b", "c"):
+        bus.publish(job_id, {})
+    assert bus.last_seq("a") == 0 and bus.last_seq("c") == 1
+
+
+def test_subscribers_receive_events_from_worker_threads(main):
+    bus = main.JobEventBus()
+
+    async def scenario():
+        entry = bus.subscribe("j")
+        await asyncio.get_running_loop().run_in_executor(None, bus.publish, "j", {"status": "queued"})
+        received = await asyncio.wait_for(entry[1].get(), timeout=5)
+        bus.unsubscribe("j", entry)
+        bus.publish("j", {"status": "ignored"})
+        return received, entry[1].qsize()
+
+    assert asyncio.run(scenario()) == ((1, {"status": "queued"}), 0)
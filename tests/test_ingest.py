@@ -0,0 +1,25 @@
+import hashlib
+import uuid
+
+
+def test_upload_keeps_the_cache_key_of_its_original_bytes(main, tmp_path, monkeypatch):
+    # Stand-in decoder: PCM that differs from the upload, like a real decode
+    decoder = tmp_path / "ffmpeg"
+    decoder.write_text("#!/bin/sh\ncat\nprintf pcm\n")
+    decoder.chmod(0o755)
+    monkeypatch.setattr(main, "ffmpeg_binary", lambda: str(decoder))
+    data = b"RIFF" + bytes(range(256)) * 512
+
+    session = main.IngestSession(str(uuid.uuid4()), "wav")
+    for i in range(0, len(data), 10_000):
+        session.feed(data[i:i + 10_000])
+    decoded = session.finish()
+
+    assert decoded == session.decoded and not session.original.exists()
+    assert session.digest == hashlib.sha256(data).hexdigest()
+    legacy = tmp_path / "song.wav"  # What the multipart and remote-file routes hash
+    legacy.write_bytes(data)
+    cache = main.SEPARATION_CACHE
+    assert cache.key_for(decoded, "polished", digest=session.digest) == cache.key_for(legacy, "polished")
+    assert cache.key_for(decoded, "polished") != cache.key_for(legacy, "polished")
+    decoded.unlink()
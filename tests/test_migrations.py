@@ -0,0 +1,109 @@
+import sqlite3
+
+import pytest
+
+# Schemas as earlier releases left them. v0 is the original app (no PRAGMA
+# user_version yet); "v0-jobs" is a v0 database that already had the job,
+# cache and YouTube tables, created before the schema was versioned.
+USERS = """CREATE TABLE users (id TEXT PRIMARY KEY, username TEXT UNIQUE, password TEXT,
+    is_admin INTEGER DEFAULT 0, credits INTEGER DEFAULT 10, plan TEXT DEFAULT 'free',
+    created_at TEXT, email TEXT)"""
+SESSIONS = "CREATE TABLE sessions (token TEXT PRIMARY KEY, user_id TEXT, created_at TEXT)"
+PROJECTS = "CREATE TABLE projects (id TEXT PRIMARY KEY, user_id TEXT, name TEXT, folder_path TEXT, created_at TEXT)"
+JOBS = """CREATE TABLE jobs (id TEXT PRIMARY KEY, owner TEXT, user_id TEXT, name TEXT, status TEXT,
+    progress REAL DEFAULT 0, result TEXT, error TEXT, kind TEXT, payload TEXT, instance TEXT,
+    start_time REAL, updated_at REAL)"""
+CACHE = """CREATE TABLE separation_cache (key TEXT PRIMARY KEY, size INTEGER, hits INTEGER DEFAULT 0,
+    created_at REAL, last_used REAL, meta TEXT)"""
+YOUTUBE = """CREATE TABLE youtube_media (video_id TEXT PRIMARY KEY, title TEXT, thumbnail_url TEXT,
+    duration REAL, cache_key TEXT, updated_at REAL)"""
+V1 = [USERS, SESSIONS, PROJECTS, JOBS, CACHE, YOUTUBE, "ALTER TABLE projects ADD COLUMN manifest TEXT"]
+
+SCHEMAS = {
+    "v0": (0, [USERS, SESSIONS, PROJECTS]),
+    "v0-jobs": (0, V1),
+    "v1": (1, V1),
+    "v2": (2, V1 + ["ALTER TABLE jobs ADD COLUMN timings TEXT"]),
+}
+
+
+def columns(conn):
+    tables = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    return {t: {r[1] for r in conn.execute(f"PRAGMA table_info({t})")} for t in tables}
+
+
+def indexes(conn):
+    return {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx_%'")}
+
+
+@pytest.fixture
+def current(main, tmp_path):
+    conn = sqlite3.connect(tmp_path / "fresh.db")
+    main.migrate_db(conn.cursor())
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def old_db(tmp_path):
+    def make(version):
+        user_version, ddl = SCHEMAS[version]
+        path = tmp_path / f"{version}.db"
+        conn = sqlite3.connect(path)
+        for statement in ddl:
+            conn.execute(statement)
+        conn.execute("INSERT INTO users VALUES ('u1', 'alice', 'pw', 0, 7, 'pro', 'then', 'a@x')")
+        conn.execute("INSERT INTO projects (id, user_id, name, folder_path, created_at) "
+                     "VALUES ('p1', 'u1', 'Song', 'p1', 'then')")
+        conn.execute(f"PRAGMA user_version = {user_version}")
+        conn.commit()
+        return path, conn
+    return make
+
+
+@pytest.mark.parametrize("version", sorted(SCHEMAS))
+def test_migrates_to_current_schema(main, current, old_db, version):
+    _, conn = old_db(version)
+    main.migrate_db(conn.cursor())
+    conn.commit()
+    assert columns(conn) == columns(current)
+    assert indexes(conn) == indexes(current)
+    # Existing rows survive, new columns start empty
+    assert conn.execute("SELECT username, credits, plan FROM users").fetchall() == [("alice", 7, "pro")]
+    assert conn.execute("SELECT id, bytes, last_access, manifest FROM projects").fetchall() == [("p1", None, None, None)]
+    conn.close()
+
+
+@pytest.mark.parametrize("version", sorted(SCHEMAS))
+def test_migration_is_idempotent(main, old_db, version):
+    _, conn = old_db(version)
+    main.migrate_db(conn.cursor())
+    before = columns(conn)
+    main.migrate_db(conn.cursor())
+    assert columns(conn) == before
+    conn.close()
+
+
+@pytest.mark.parametrize("version", sorted(SCHEMAS))
+def test_init_db_stamps_the_version(main, old_db, monkeypatch, version):
+    path, conn = old_db(version)
+    conn.close()
+    db = main.SQLiteDatabase(path)
+    monkeypatch.setattr(main, "DB", db)
+    main.init_db()
+    with db.connect() as c:
+        assert c.execute("PRAGMA user_version").fetchone()[0] == main.SCHEMA_VERSION
+        assert c.execute("SELECT COUNT(*) FROM users WHERE username = 'admin'").fetchone()[0] == 1
+        assert "timings" in {r[1] for r in c.execute("PRAGMA table_info(jobs)")}
+    db.close_all()
+
+
+def test_current_version_skips_migrations(main, tmp_path, monkeypatch):
+    db = main.SQLiteDatabase(tmp_path / "v3.db")
+    monkeypatch.setattr(main, "DB", db)
+    main.init_db()
+    calls = []
+    monkeypatch.setattr(main, "migrate_db", lambda c: calls.append(c))
+    main.init_db()
+    assert calls == []
+    db.close_all()
@@ -0,0 +1,51 @@
+import os
+import time
+import uuid
+
+import pytest
+
+
+@pytest.fixture
+def store(main):
+    main.DB.execute("DELETE FROM jobs")
+    return main.JobStore(main.DB, ttl_seconds=3600, lease_seconds=30)
+
+
+def add_job(main, store, user, instance, age, status="processing"):
+    job_id = str(uuid.uuid4())
+    store.create(job_id, user, "Song", "file", {})
+    main.DB.execute("UPDATE jobs SET instance = ?, status = ?, updated_at = ? WHERE id = ?",
+                    (instance, status, time.time() - age, job_id))
+    return job_id
+
+
+def claimed(store):
+    return {job["job_id"] for job in store.claim_orphans()}
+
+
+def test_stale_lease_is_claimed_even_if_its_pid_is_alive(main, store, make_user):
+    user = make_user()
+    # PID 1 and our parent are alive; after a restart they can be anybody
+    reused = [add_job(main, store, user, f"{pid}:deadbeef", age=120) for pid in (1, os.getppid())]
+    assert claimed(store) == set(reused)
+    rows = main.DB.query("SELECT instance FROM jobs")
+    assert {r[0] for r in rows} == {main.INSTANCE_ID}
+    assert claimed(store) == set()
+
+
+def test_live_sibling_and_own_jobs_are_left_alone(main, store, make_user):
+    user = make_user()
+    add_job(main, store, user, "99999:sibling", age=5)
+    add_job(main, store, user, main.INSTANCE_ID, age=120)
+    add_job(main, store, user, "123:gone", age=120, status="completed")
+    assert claimed(store) == set()
+
+
+def test_heartbeat_renews_only_our_unfinished_jobs(main, store, make_user):
+    user = make_user()
+    ours = add_job(main, store, user, main.INSTANCE_ID, age=120)
+    foreign = add_job(main, store, user, "123:gone", age=120)
+    assert store.heartbeat() == 1
+    assert time.time() - store.get(ours)["updated_at"] < 5
+    assert store.get(foreign)["updated_at"] < time.time() - 60
+    assert claimed(store) == {foreign}
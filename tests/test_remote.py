@@ -0,0 +1,59 @@
+import threading
+import time
+import uuid
+
+
+def test_download_runs_before_the_job_takes_a_slot(main, make_user, tmp_path, monkeypatch):
+    user = make_user()
+    job_id = str(uuid.uuid4())
+    main.JOB_STORE.create(job_id, user, "x.wav", "remote", {"url": "http://example/x.wav", "title": "x.wav"})
+    release, downloading = threading.Event(), threading.Event()
+    input_path = tmp_path / f"{job_id}.wav"
+
+    def fake_download(jid, url, filename):
+        downloading.set()
+        release.wait(5)
+        input_path.write_bytes(b"RIFF")
+        main.record_stage("download", 0.5)
+        return input_path
+    submitted = []
+    monkeypatch.setattr(main, "download_remote_input", fake_download)
+    monkeypatch.setattr(main.SCHEDULER, "submit", lambda jid, fn, *args, **kw: submitted.append((jid, fn, kw)))
+
+    fetcher = main.RemoteFetcher(workers=1)
+    fetcher.submit(job_id, "http://example/x.wav", "x.wav", user)
+    assert downloading.wait(5)
+    assert fetcher.inflight(user["id"]) == 1 and submitted == []
+    release.set()
+    deadline = time.time() + 5
+    while not submitted:
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+    assert submitted == [(job_id, main.run_separation_pipeline, {"owner": user["id"], "plan": "free",
+                                                                 "check_user_cap": False})]
+    job = main.JOB_STORE.get(job_id)
+    assert job["payload"]["input_path"] == str(input_path)  # Recovery resumes at separation
+    assert job["timings"]["download"] == 0.5
+    assert fetcher.inflight(user["id"]) == 0
+
+
+def test_failed_download_never_reaches_the_scheduler(main, make_user, monkeypatch):
+    user = make_user()
+    job_id = str(uuid.uuid4())
+    main.JOB_STORE.create(job_id, user, "x.wav", "remote", {"url": "http://example/x.wav", "title": "x.wav"})
+
+    def fake_download(jid, url, filename):
+        main.fail_job(jid, "Failed to download file: 404")
+    submitted = []
+    monkeypatch.setattr(main, "download_remote_input", fake_download)
+    monkeypatch.setattr(main.SCHEDULER, "submit", lambda *a, **kw: submitted.append(a))
+
+    fetcher = main.RemoteFetcher(workers=1)
+    fetcher.submit(job_id, "http://example/x.wav", "x.wav", user)
+    deadline = time.time() + 5
+    while fetcher.inflight(user["id"]):
+        assert time.time() < deadline
+        time.sleep(0.01)
+    time.sleep(0.05)
+    assert submitted == [] and main.JOB_STORE.get(job_id)["status"] == "failed"
@@ -0,0 +1,168 @@
+import threading
+import time
+import uuid
+
+import pytest
+
+
+class Recorder:
+    """Jobs that wait for `gate`, log their start order and track peak concurrency (per owner too)."""
+
+    def __init__(self, hold=0.0):
+        self.gate = threading.Event()
+        self.hold = hold
+        self.order = []
+        self.running = {}
+        self.peak = {}
+        self.done = 0
+        self.lock = threading.Lock()
+
+    def job(self, tag, owner, width=1):
+        self.gate.wait()
+        with self.lock:
+            self.order.append(tag)
+            for key in (owner, "*"):
+                self.running[key] = self.running.get(key, 0) + width
+                self.peak[key] = max(self.peak.get(key, 0), self.running[key])
+        time.sleep(self.hold)
+        with self.lock:
+            for key in (owner, "*"):
+                self.running[key] -= width
+            self.done += 1
+
+
+def submit(sched, rec, tag, owner, plan, **kw):
+    job_id = f"{tag}-{uuid.uuid4()}"
+    sched.submit(job_id, rec.job, tag, owner, kw.get("slots", 1), owner=owner, plan=plan, **kw)
+    return job_id
+
+
+def drain(sched, rec, expected, timeout=10):
+    deadline = time.time() + timeout
+    while rec.done < expected:
+        assert time.time() < deadline, "jobs did not finish"
+        time.sleep(0.01)
+    while sched.active_count():
+        time.sleep(0.01)
+
+
+def wait_started(sched, count=1, timeout=5):
+    """Until `count` jobs have been handed to workers (they then block on the gate)."""
+    deadline = time.time() + timeout
+    while sched.active_count() < count:
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def test_weighted_fair_order(main):
+    sched, rec = main.JobScheduler(1, 50), Recorder()
+    submit(sched, rec, "block", "carol", "free")
+    wait_started(sched)  # The single worker now waits on the gate
+    free = [submit(sched, rec, f"f{i}", "alice", "free") for i in range(3)]
+    studio = [submit(sched, rec, f"s{i}", "bob", "studio") for i in range(9)]
+    predicted = sorted(free + studio, key=sched.position)
+
+    rec.gate.set()
+    drain(sched, rec, 13)
+    # Studio (8) gets eight dispatches per free (1) one; ties go to the earlier submission
+    assert rec.order == ["block", "s0", "s1", "s2", "s3", "s4", "s5", "s6", "f0", "s7", "s8", "f1", "f2"]
+    assert [j.split("-")[0] for j in predicted] == rec.order[1:]
+
+
+def test_one_user_cannot_starve_another(main):
+    sched, rec = main.JobScheduler(1, 50), Recorder()
+    submit(sched, rec, "block", "carol", "free")
+    wait_started(sched)
+    for i in range(10):
+        submit(sched, rec, f"a{i}", "alice", "free", check_user_cap=False)
+    late = submit(sched, rec, "b0", "bob", "free")
+    assert sched.position(late) == 2  # Takes turns with alice's backlog instead of queueing behind it
+    rec.gate.set()
+    drain(sched, rec, 12)
+    assert rec.order.index("b0") <= 2
+
+
+def test_max_active_caps_a_user_not_the_box(main):
+    sched, rec = main.JobScheduler(3, 50), Recorder(hold=0.05)
+    for i in range(4):
+        submit(sched, rec, f"f{i}", "alice", "free")
+        submit(sched, rec, f"p{i}", "bob", "pro")
+    rec.gate.set()
+    drain(sched, rec, 8)
+    assert rec.peak["alice"] == main.plan_terms("free")[1] == 1
+    assert rec.peak["bob"] == main.plan_terms("pro")[1] == 2
+    assert rec.peak["*"] == 3
+
+
+def test_slots_count_against_max_active(main):
+    sched, rec = main.JobScheduler(2, 50), Recorder(hold=0.05)
+    submit(sched, rec, "batch", "bob", "pro", tracks=4, slots=2)
+    submit(sched, rec, "single", "bob", "pro")
+    rec.gate.set()
+    drain(sched, rec, 2)
+    assert rec.peak["bob"] == 2  # The single job waited for the batch's two slots
+
+
+def test_user_queue_cap_counts_tracks(main):
+    sched, rec = main.JobScheduler(1, 50), Recorder()
+    limit = main.plan_terms("free")[2]
+    submit(sched, rec, "big", "alice", "free", tracks=limit - 1)
+    submit(sched, rec, "one", "alice", "free")
+    assert sched.queued_for("alice") == limit
+    assert sched.is_full("alice", "free") and not sched.is_full("bob", "free")
+    with pytest.raises(main.UserQueueFull) as e:
+        submit(sched, rec, "over", "alice", "free")
+    assert (e.value.depth, e.value.limit) == (limit, limit)
+    submit(sched, rec, "recovered", "alice", "free", check_user_cap=False)
+    rec.gate.set()
+    drain(sched, rec, 3)
+
+
+def test_global_queue_cap(main):
+    sched, rec = main.JobScheduler(1, 2), Recorder()
+    submit(sched, rec, "a", "alice", "studio")
+    submit(sched, rec, "b", "bob", "studio")
+    assert sched.is_full()
+    with pytest.raises(main.QueueFull) as e:
+        submit(sched, rec, "c", "carol", "studio")
+    assert not isinstance(e.value, main.UserQueueFull)
+    rec.gate.set()
+    drain(sched, rec, 2)
+
+
+def observed(main, plan):
+    for line in main.QUEUE_WAIT_SECONDS.render():
+        if line.startswith(f'aura_queue_wait_seconds_count{{plan="{plan}"}}'):
+            return int(line.split()[-1])
+    return 0
+
+
+def test_wait_stats_per_plan(main):
+    sched, rec = main.JobScheduler(1, 50), Recorder()
+    before = observed(main, "pro")
+    submit(sched, rec, "block", "carol", "free")
+    wait_started(sched)
+    queued_at = time.time()
+    submit(sched, rec, "p", "bob", "pro")
+    time.sleep(0.05)
+    rec.gate.set()
+    drain(sched, rec, 2)
+    stats = sched.stats()
+    assert stats["queued"] == 0 and stats["active"] == 0
+    pro = stats["plans"]["pro"]
+    assert pro["queue_wait"]["n"] == 1
+    assert 0.04 <= pro["queue_wait"]["p50"] <= time.time() - queued_at + 0.01
+    assert stats["plans"]["studio"]["queue_wait"] == {"n": 0}
+    assert observed(main, "pro") == before + 1
+
+
+def test_wait_percentiles(main):
+    assert main.wait_percentiles([]) == {"n": 0}
+    stats = main.wait_percentiles([float(i) for i in range(1, 101)])
+    assert (stats["n"], stats["p50"], stats["p90"], stats["p99"], stats["max"]) == (100, 51.0, 91.0, 100.0, 100.0)
+
+
+def test_plan_terms_fall_back_to_free(main):
+    assert main.plan_terms("no-such-plan") == main.plan_terms("free")
+    assert main.plan_terms("unlimited")[1:] == (0, 0)
+    assert main.parse_plan_table("free=1, pro = 4,bad,=3") == {"free": 1.0, "pro": 4.0}
@@ -0,0 +1,97 @@
+import os
+import time
+import uuid
+
+import pytest
+
+
+@pytest.fixture
+def projects(main, monkeypatch):
+    """add(user, size, age) -> project id, with a folder on disk; starts from an empty projects table."""
+    main.DB.execute("DELETE FROM projects")
+    monkeypatch.setattr(main, "USER_QUOTA_BYTES", 0)
+    monkeypatch.setattr(main, "STORAGE_QUOTA_BYTES", 0)
+
+    def add(user, size, age):
+        project_id = str(uuid.uuid4())
+        folder = main.OUTPUT_DIR / main.MODEL_NAME / project_id
+        folder.mkdir(parents=True)
+        (folder / "vocals.wav").write_bytes(b"\0" * size)
+        with main.DB.connect() as conn:
+            main.insert_project(conn, project_id, user["id"], "Song", project_id, main.build_manifest(folder))
+            conn.execute("UPDATE projects SET last_access = ? WHERE id = ?", (time.time() - age, project_id))
+        return project_id
+    return add
+
+
+def remaining(main):
+    return {r[0] for r in main.DB.query("SELECT id FROM projects")}
+
+
+def on_disk(main, project_id):
+    return (main.OUTPUT_DIR / main.MODEL_NAME / project_id).is_dir()
+
+
+def test_user_quota_evicts_least_recently_used(main, make_user, projects, monkeypatch):
+    alice, bob = make_user(), make_user()
+    old, mid, new = projects(alice, 400, 300), projects(alice, 400, 200), projects(alice, 400, 0)
+    other = projects(bob, 5000, 1000)
+    monkeypatch.setattr(main, "USER_QUOTA_BYTES", 900)
+
+    main.STORAGE.enforce_quotas(alice["id"], keep=new)
+
+    assert remaining(main) == {mid, new, other}
+    assert not on_disk(main, old) and on_disk(main, mid)
+    assert main.STORAGE.usage(alice["id"]) <= 900
+
+
+def test_kept_project_survives_even_over_quota(main, make_user, projects, monkeypatch):
+    alice = make_user()
+    older, huge = projects(alice, 100, 500), projects(alice, 5000, 0)
+    monkeypatch.setattr(main, "USER_QUOTA_BYTES", 1000)
+
+    main.STORAGE.enforce_quotas(alice["id"], keep=huge)
+
+    assert remaining(main) == {huge}
+    assert not on_disk(main, older)
+
+
+def test_global_quota_spans_users(main, make_user, projects, monkeypatch):
+    alice, bob = make_user(), make_user()
+    a_old, b_mid, a_new = projects(alice, 600, 300), projects(bob, 600, 200), projects(alice, 600, 0)
+    monkeypatch.setattr(main, "STORAGE_QUOTA_BYTES", 1300)
+
+    main.STORAGE.enforce_quotas(alice["id"], keep=a_new)
+
+    assert remaining(main) == {b_mid, a_new}
+    assert not on_disk(main, a_old)
+    assert main.STORAGE.usage() <= 1300
+
+
+def test_no_quota_evicts_nothing(main, make_user, projects):
+    alice = make_user()
+    ids = {projects(alice, 10_000, age) for age in (3, 2, 1)}
+    main.STORAGE.enforce_quotas(alice["id"])
+    assert remaining(main) == ids
+
+
+def test_sweep_keeps_legacy_and_young_folders(main, make_user, projects, monkeypatch):
+    monkeypatch.setattr(main, "SWEEP_GRACE", 3600)
+    old = time.time() - 7200
+
+    def folder(base, name, mtime):
+        path = main.OUTPUT_DIR / base / name
+        path.mkdir(parents=True)
+        os.utime(path, (mtime, mtime))
+        return path
+
+    registered = projects(make_user(), 100, 0)
+    os.utime(main.OUTPUT_DIR / main.MODEL_NAME / registered, (old, old))
+    orphan = folder(main.MODEL_NAME, str(uuid.uuid4()), old)
+    young = folder(main.MODEL_NAME, str(uuid.uuid4()), time.time())
+    legacy = folder(main.LEGACY_OUTPUT_DIRS[0], str(uuid.uuid4()), old)
+
+    main.StorageManager()._sweep_dirs()
+
+    assert not orphan.exists()
+    assert young.is_dir() and legacy.is_dir() and on_disk(main, registered)
@@ -0,0 +1,86 @@
+import io
+import zipfile
+
+import pytest
+from fastapi import HTTPException
+
+
+@pytest.fixture
+def plan(main, tmp_path):
+    files = []
+    for i, (name, size) in enumerate((("vocals.wav", 70_000), ("drums.wav", 1), ("bäss.wav", 5000))):
+        path = tmp_path / f"f{i}"
+        path.write_bytes(bytes((i * 7 + j) % 251 for j in range(size)))
+        files.append((name, path))
+    return main.ZipPlan(files), files
+
+
+def read_range(plan, start, end):
+    return b"".join(plan.iter_range(start, end))
+
+
+def test_full_archive_is_a_valid_zip(plan):
+    zplan, files = plan
+    data = read_range(zplan, 0, zplan.size - 1)
+    assert len(data) == zplan.size
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == [name for name, _ in files]
+        for name, path in files:
+            assert zf.read(name) == path.read_bytes()
+
+
+def test_ranges_match_the_full_body(plan):
+    zplan, _ = plan
+    full = read_range(zplan, 0, zplan.size - 1)
+    # Segment boundaries (local headers, file bodies, central directory) and single bytes
+    points = sorted({0, 1, zplan.size - 1} | {off for off, _ in zplan.segments} |
+                    {max(off - 1, 0) for off, _ in zplan.segments})
+    for start in points:
+        for end in points:
+            if end >= start:
+                assert read_range(zplan, start, end) == full[start:end + 1], (start, end)
+
+
+def test_etag_follows_the_content(main, plan):
+    zplan, files = plan
+    assert main.ZipPlan(files).etag == zplan.etag
+    files[1][1].write_bytes(b"changed")
+    assert main.ZipPlan(files).etag != zplan.etag
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-9", (0, 9)),
+    ("bytes=90-", (90, 99)),
+    ("bytes=-10", (90, 99)),
+    ("bytes=-500", (0, 99)),
+    ("bytes=50-5000", (50, 99)),
+    (None, None),
+    ("items=0-1", None),
+    ("bytes=0-1,5-6", None),
+    ("bytes=abc", None),
+    ("bytes=-0", None),
+])
+def test_parse_byte_range(main, header, expected):
+    assert main.parse_byte_range(header, 100) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=10-5"])
+def test_unsatisfiable_range(main, header):
+    with pytest.raises(HTTPException) as e:
+        main.parse_byte_range(header, 100)
+    assert e.value.status_code == 416
+    assert e.value.headers["Content-Range"] == "bytes */100"
+
+
+def test_stream_zip_honours_if_range(main, plan):
+    zplan, _ = plan
+    partial = main.stream_zip(zplan, "a.zip", "bytes=10-19", zplan.etag)
+    assert partial.status_code == 206
+    assert partial.headers["Content-Range"] == f"bytes 10-19/{zplan.size}"
+    assert partial.headers["Content-Length"] == "10"
+
+    stale = main.stream_zip(zplan, "a.zip", "bytes=10-19", '"stale"')
+    assert stale.status_code == 200
+    assert stale.headers["Content-Length"] == str(zplan.size)
+    assert "Content-Range" not in stale.headers